@@ -1,6 +1,9 @@
 import os
 from pathlib import Path
 import json
+import bisect
+import difflib
+from functools import lru_cache
 from datetime import date
 
 if not os.path.exists('app'):   # use /app for logging and caching
@@ -23,11 +26,60 @@ def get_symbols():
         symdata = json.load(symfile)
     return symdata
 
-def ticker_dict():  # For user-entered ticker validation
-    return {s['symbol']:s['symbol']+'('+s['exchange']+'):'+s['name'] for s in get_symbols()}
+class SymbolIndex:
+    """
+    Symbols of assets/symbols.json indexed once per process: O(1) validation and labels, sorted symbols and
+    company name words for prefix search (bisect), close symbols for misspelled queries
+    """
+    def __init__(self, symbols):
+        self.labels = {s['symbol']: s['symbol']+'('+s['exchange']+'):'+s['name'] for s in symbols}
+        self.exchanges = sorted({s['exchange'] for s in symbols})
+        self.symbols = sorted(self.labels)
+        self.name_words = sorted({(word, s['symbol']) for s in symbols for word in s['name'].upper().split()})
+        self.words = {s['symbol']: s['name'].upper().split() for s in symbols}
+        self.symbols_by_length = {}
+        for symbol in self.symbols:
+            self.symbols_by_length.setdefault(len(symbol), []).append(symbol)
+
+    def __contains__(self, symbol):
+        return symbol in self.labels
+
+    def get_prefixed(self, sorted_keys, prefix):
+        # the range of the sorted keys (symbols, or (word, symbol) pairs) starting with prefix
+        as_key = (lambda k: k) if isinstance(sorted_keys[0], str) else (lambda k: (k,))
+        return sorted_keys[bisect.bisect_left(sorted_keys, as_key(prefix)):bisect.bisect_left(sorted_keys, as_key(prefix + '\uffff'))]
+
+    def search(self, query, limit=10):
+        """
+        Symbols for an autocomplete query, best first: the symbol itself, symbols starting with it, companies with
+        name words starting with its words, else close symbols of about its length (typos)
+        """
+        query = query.strip().upper()
+        if not query:
+            return []
+        matches = dict.fromkeys([query] if query in self.labels else [])
+        matches.update(dict.fromkeys(self.get_prefixed(self.symbols, query)[:limit]))
+        first_word, *other_words = query.split()
+        for _, symbol in self.get_prefixed(self.name_words, first_word):
+            if len(matches) >= limit:
+                break
+            if all(any(word.startswith(other) for word in self.words[symbol]) for other in other_words):
+                matches[symbol] = None
+        if not matches:
+            candidates = [symbol for n in range(len(query)-1, len(query)+2) for symbol in self.symbols_by_length.get(n, [])]
+            matches.update(dict.fromkeys(difflib.get_close_matches(query, candidates, limit, cutoff=0.75)))
+        return [{'symbol': symbol, 'label': self.labels[symbol]} for symbol in list(matches)[:limit]]
+
+@lru_cache(maxsize=None)
+def get_symbol_index():
+    with open(Path(HERE, 'assets', 'symbols.json')) as symfile:
+        return SymbolIndex(json.load(symfile))
+
+def ticker_dict():  # For user-entered ticker validation, symbol: label
+    return get_symbol_index().labels
 
 def exchange_list():
-    return list(set([s['exchange'] for s in get_symbols()]))
+    return get_symbol_index().exchanges
 
 def get_us_exchanges():
     with open(Path(HERE, 'assets', 'us_exchanges.json')) as usexfile:
@@ -1,5 +1,6 @@
 import os
 # from flask import Flask
+import flask
 import dash
 from dash import dcc
 from dash import html
@@ -9,6 +10,10 @@ from dash.dependencies import Input, Output
 from app import app
 from layouts import sidebar, content, dcflayout, sectorlayout, legallayout
 import callbacks
+from cache_utils import get_cache_stats
+from prewarm import get_request_stats
+from get_fin_report import invalidate_ticker
+from __init__ import ticker_dict, get_symbol_index
 
 # server = Flask(__name__)
 # @server.route('/')
@@ -24,6 +29,30 @@ app.layout = html.Div([
     sidebar, content
 ])
 
+@app.server.route('/cache-stats')
+def cache_stats():  # memoized upstream fetches of this worker: hits, stale hits, misses, refresh durations
+    return flask.jsonify(get_cache_stats())
+
+@app.server.route('/prewarm-stats')
+def prewarm_stats():    # user requests that found a warm cache, see prewarm.py
+    return flask.jsonify(get_request_stats())
+
+@app.server.route('/symbols/search')
+def symbols_search():    # autocomplete: /symbols/search?q=appl&limit=10
+    limit = min(flask.request.args.get('limit', 10, type=int), 50)
+    return flask.jsonify(get_symbol_index().search(flask.request.args.get('q', ''), limit))
+
+@app.server.route('/cache/invalidate/<ticker>', methods=['POST'])
+def cache_invalidate(ticker):   # e.g. after a filing: curl -X POST -H "Authorization: Bearer $CACHE_ADMIN_TOKEN" .../cache/invalidate/AAPL
+    admin_token = os.environ.get('CACHE_ADMIN_TOKEN')
+    if not admin_token or flask.request.headers.get('Authorization') != 'Bearer ' + admin_token:
+        flask.abort(403)
+    ticker = ticker.upper()
+    if ticker not in ticker_dict():
+        flask.abort(404)
+    invalidate_ticker(ticker)
+    return flask.jsonify({'invalidated': ticker})
+
 @app.callback(Output('page-content', 'children'),
 [Input('url', 'pathname')])
 def render_page_content(pathname):
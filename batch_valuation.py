@@ -0,0 +1,295 @@
+"""
+Headless batch valuation: the default DCF valuation of the app (the assumptions update_current_year_values and
+get_cost_of_capital derive, before any override) over a list of tickers, streamed to a CSV file or Parquet parts.
+
+    python batch_valuation.py --tickers AAPL MSFT --output valuations.csv
+    python batch_valuation.py --all --reports-dir reports --output valuations.parquet --workers 8
+
+Online, the statement pages are fetched in bulk, rate limited per host (see get_financial_report_pages), parsed
+by the worker processes and the reports saved for offline runs with --save-reports-dir. Offline, they are
+read from --reports-dir (<TICKER>.json, the fin-store data of a ticker) or parsed from saved pages in
+--pages-dir (<TICKER>/<page>.html for each page of FINDATA_KEYS). Tickers valued in the checkpoint file are
+skipped, so an interrupted run resumes where it stopped, and the failed ones (e.g. a transient fetch error) are retried,
+their earlier rows replaced: the output has one row per ticker.
+"""
+import os
+import csv
+import json
+import argparse
+from pathlib import Path
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pandas as pd
+
+from __init__ import get_symbols
+from app import logger
+from page_cache import PAGE_CACHE_MAX_AGE, PAGE_CACHE_FOREVER
+from get_fin_report import get_financial_report_pages, get_financial_report_from_page_texts, get_yahoo_fin_values, get_rates_fin_values, \
+    get_report_df, FINDATA_KEYS, QUOTE_FALLBACK
+from get_dcf_valuation import get_default_assumptions, get_cost_of_capital_rate, get_dcf_inputs, get_dcf_input_record, get_dcf_result, \
+    get_dcf_implied, TERMINAL_YEAR_LENGTH, HIGH_GROWTH_YEARS
+
+# Defaults of the app inputs that are not derived from the financial report (UI units: M$, %)
+INPUT_DEFAULTS = {
+    'average_maturity': 3, 'pretax_cost_of_debt': 4, 'convertible_debt_book_value': 0, 'convertible_market_value': 0,
+    'convertible_debt_portion_market_value': 0, 'preferred_num_shares': 0, 'preferred_price_pershare': 70,
+    'preferred_dividend_pershare': 0, 'debt_value_op_leases': 0, 'erp': 6, 'tax_rate': 15, 'riskfree_rate': 4.0,
+    'terminal_growth_rate': 3.5, 'terminal_growth_eq_riskfree_rate': False,
+    'convergence_year': 3, 'marginal_tax_rate': 29, 'probability_of_failure': 0,
+    'minority_interests': 0, 'nonoperating_assets': 0, 'options_value': 0,
+    'horizon': TERMINAL_YEAR_LENGTH, 'high_growth_years': HIGH_GROWTH_YEARS, 'closed_form_fade': False,
+}
+RESULT_COLUMNS = ['ticker', 'last_price', 'estimated_value_per_share', 'price_as_pct_of_value',
+                'cost_of_cap', 'rgr_next', 'cagr_2_5', 'opm_target', 'sales_to_cap',
+                'PV_sum', 'PV_terminal_value', 'equity_value',
+                'implied_cagr_2_5', 'implied_opm_target', 'implied_cost_of_cap',
+                'report_date_note', 'error']
+# Parquet types of the columns, the same in every part even when all its values are missing
+RESULT_TYPES = {col: 'string' if col in ('ticker', 'report_date_note', 'error') else float for col in RESULT_COLUMNS}
+
+def get_fin_store_data(ticker, reports_dir=None, pages_dir=None, page_texts=None):
+    """
+    The fin-store data of ticker ({'fin_report_dict': records, 'stats_dict': stats}) as the fin_report callback builds it,
+    from a saved report, saved pages or the page texts fetched online (see get_financial_report_pages)
+    """
+    if reports_dir:
+        with open(Path(reports_dir, ticker + '.json')) as report_file:
+            return json.load(report_file)
+    if pages_dir:
+        page_texts = []
+        for k in FINDATA_KEYS:
+            with open(Path(pages_dir, ticker, k + '.html'), encoding='utf-8') as page_file:
+                page_texts.append(page_file.read())
+    df, lastprice, lastprice_time, report_date_note = get_financial_report_from_page_texts(page_texts, ticker)
+    next_earnings_date, beta = ('N/A', None) if pages_dir else get_yahoo_fin_values(ticker) or QUOTE_FALLBACK
+    stats_record = {'ticker': ticker,
+                    'lastprice': float(lastprice.replace(',','')),
+                    'lastprice_time': lastprice_time,
+                    'beta': beta or None,
+                    'next_earnings_date': next_earnings_date,
+                    'report_date_note': report_date_note,
+                    'analysis_timestamp': datetime.now().strftime("%b %-d, %Y %H:%M:%S %Z"),
+                    }
+    return {'fin_report_dict': df.to_dict('records'), 'stats_dict': stats_record}
+
+def get_ticker_valuation(ticker, settings, page_texts=None):
+    """
+    Default DCF valuation of ticker, settings has the input overrides of INPUT_DEFAULTS and the report directories,
+    page_texts are the fetched statement pages when online.
+    Returns a results row (RESULT_COLUMNS), with the error instead of the values if the valuation failed
+    """
+    try:
+        fin_store_data = get_fin_store_data(ticker, settings.get('reports_dir'), settings.get('pages_dir'), page_texts)
+        if settings.get('save_reports_dir'):
+            with open(Path(settings['save_reports_dir'], ticker + '.json'), 'w') as report_file:
+                json.dump(fin_store_data, report_file)
+        inputs = dict(INPUT_DEFAULTS, **settings.get('inputs', {}))
+        stats_record = fin_store_data['stats_dict']
+        df = get_report_df(fin_store_data['fin_report_dict'])
+        assumptions = get_default_assumptions(df)
+
+        equity_market_value = df['Shares Outstanding'].iloc[-1] * stats_record['lastprice'] /1e6
+        cost_of_cap = get_cost_of_capital_rate(equity_market_value, stats_record.get('beta') or 1,
+                        assumptions['debt_book_value'], assumptions['interest_expense_debt'], inputs['average_maturity'], inputs['pretax_cost_of_debt'],
+                        inputs['convertible_debt_book_value'], inputs['convertible_market_value'], inputs['convertible_debt_portion_market_value'],
+                        inputs['preferred_num_shares'], inputs['preferred_price_pershare'], inputs['preferred_dividend_pershare'],
+                        inputs['debt_value_op_leases'], inputs['erp'], inputs['tax_rate'], inputs['riskfree_rate'],
+                        inputs['terminal_growth_eq_riskfree_rate'], inputs['terminal_growth_rate'])
+        # same positional arguments as the dcf_valuation callback
+        dcf_inputs = get_dcf_inputs({ticker: fin_store_data}, assumptions['rgr_next'], assumptions['opm_next'], assumptions['cagr_2_5'],
+                        assumptions['opm_target'], assumptions['sales_to_cap'], inputs['tax_rate'], inputs['riskfree_rate'],
+                        inputs['terminal_growth_rate'], cost_of_cap, None,
+                        assumptions['year0_revenue'], assumptions['year0_randd'], assumptions['year0_capex'], assumptions['year0_ebit'],
+                        assumptions['year0_rgr'], assumptions['cash'], assumptions['debt_book_value'], assumptions['shares_outstanding'],
+                        inputs['minority_interests'], inputs['nonoperating_assets'], inputs['options_value'],
+                        inputs['convergence_year'], inputs['marginal_tax_rate'], inputs['probability_of_failure'],
+                        inputs['terminal_growth_eq_riskfree_rate'], [1], '',
+                        inputs['horizon'], inputs['high_growth_years'], [1] if inputs['closed_form_fade'] else [])
+        _, dcf_output_dict = get_dcf_result(get_dcf_input_record(dcf_inputs))
+
+        last_price = stats_record['lastprice']
+        value = dcf_output_dict['estimated_value_per_share']
+        return {'ticker': ticker,
+                'last_price': last_price,
+                'estimated_value_per_share': value,
+                'price_as_pct_of_value': 100*last_price/value if value else None,
+                'cost_of_cap': cost_of_cap,
+                'rgr_next': assumptions['rgr_next'],
+                'cagr_2_5': assumptions['cagr_2_5'],
+                'opm_target': assumptions['opm_target'],
+                'sales_to_cap': assumptions['sales_to_cap'],
+                'PV_sum': dcf_output_dict['PV_sum'],
+                'PV_terminal_value': dcf_output_dict['PV_terminal_value'],
+                'equity_value': dcf_output_dict['equity_value'],
+                # in % as the other assumptions
+                **{'implied_' + k: 100*get_dcf_implied(dcf_inputs, last_price, k) for k in ('cagr_2_5', 'opm_target', 'cost_of_cap')},
+                'report_date_note': stats_record.get('report_date_note'),
+                'error': None,
+                }
+    except Exception as e:
+        return get_error_row(ticker, e)
+
+def get_error_row(ticker, e):
+    return {'ticker': ticker, 'error': f'{type(e).__name__}: {e}'}
+
+def get_batch_valuations(tickers, settings, workers=None):
+    """
+    Generate the valuation rows of tickers as they complete, parsing/valuing over a process pool of workers
+    (in this process with workers=1). Online, the statement pages are fetched here in bulk (rate limited per host)
+    and each ticker's pages are parsed and valued as soon as they arrive
+    """
+    offline = settings.get('reports_dir') or settings.get('pages_dir')
+    ticker_pages = ((ticker, None) for ticker in tickers) if offline else \
+        get_financial_report_pages(tickers, max_age=settings.get('max_page_age', PAGE_CACHE_MAX_AGE))
+    if workers == 1:
+        for ticker, page_texts in ticker_pages:
+            yield get_error_row(ticker, page_texts) if isinstance(page_texts, Exception) else get_ticker_valuation(ticker, settings, page_texts)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = set()
+        for ticker, page_texts in ticker_pages:
+            if isinstance(page_texts, Exception):   # failed fetch
+                yield get_error_row(ticker, page_texts)
+                continue
+            futures.add(executor.submit(get_ticker_valuation, ticker, settings, page_texts))
+            done_futures = {future for future in futures if future.done()}
+            futures -= done_futures
+            for future in done_futures:
+                yield future.result()
+        for future in as_completed(futures):
+            yield future.result()
+
+class BatchWriter:
+    """
+    Stream result rows to a CSV file, or to Parquet part files (row groups of chunk_size rows) in a .parquet directory,
+    and append the tickers valued without error to the checkpoint file
+    """
+    def __init__(self, output, checkpoint=None, chunk_size=500):
+        self.output = Path(output)
+        self.checkpoint = Path(checkpoint or str(output) + '.checkpoint')
+        self.is_parquet = self.output.suffix == '.parquet'
+        self.chunk_size = chunk_size if self.is_parquet else 1
+        self.rows = []
+
+    def get_done_tickers(self):
+        if not self.checkpoint.exists():
+            return set()
+        with open(self.checkpoint) as checkpoint_file:
+            return set(checkpoint_file.read().split())
+
+    def drop_tickers(self, tickers):
+        """
+        Remove the rows of tickers (about to be valued again: failed, or written but not checkpointed) from the output
+        """
+        tickers = set(tickers)
+        if self.is_parquet:
+            for part in sorted(self.output.glob('part-*.parquet')):
+                df = pd.read_parquet(part)
+                kept = df[~df['ticker'].isin(tickers)]
+                if len(kept) == len(df):
+                    continue
+                if kept.empty:
+                    part.unlink()
+                else:
+                    kept.astype(RESULT_TYPES).to_parquet(part, index=False)
+        elif self.output.exists():
+            kept_path = self.output.with_name(self.output.name + '.tmp')
+            with open(self.output, newline='') as csv_file, open(kept_path, 'w', newline='') as kept_file:
+                writer = csv.DictWriter(kept_file, fieldnames=RESULT_COLUMNS)
+                writer.writeheader()
+                writer.writerows(row for row in csv.DictReader(csv_file) if row['ticker'] not in tickers)
+            os.replace(kept_path, self.output)
+
+    def write(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        if self.is_parquet:
+            self.output.mkdir(parents=True, exist_ok=True)
+            part = max((int(p.stem.split('-')[1]) for p in self.output.glob('part-*.parquet')), default=-1) + 1
+            pd.DataFrame(self.rows, columns=RESULT_COLUMNS).astype(RESULT_TYPES).to_parquet(Path(self.output, f'part-{part:05d}.parquet'), index=False)
+        else:
+            write_header = not self.output.exists()
+            with open(self.output, 'a', newline='') as csv_file:
+                writer = csv.DictWriter(csv_file, fieldnames=RESULT_COLUMNS)
+                if write_header:
+                    writer.writeheader()
+                writer.writerows(self.rows)
+        # the rows are written before the checkpoint, a crash in between values these tickers again
+        with open(self.checkpoint, 'a') as checkpoint_file:
+            checkpoint_file.write(''.join(row['ticker'] + '\n' for row in self.rows if row['error'] is None))
+        self.rows = []
+
+def run_batch_valuation(tickers, output, settings, workers=None, checkpoint=None):
+    """
+    Value the tickers not valued in the checkpoint yet and stream the rows to output, replacing their earlier rows.
+    Returns the counts of valued and failed tickers
+    """
+    writer = BatchWriter(output, checkpoint)
+    done_tickers = writer.get_done_tickers()
+    todo_tickers = [t for t in dict.fromkeys(tickers) if t not in done_tickers]
+    writer.drop_tickers(todo_tickers)   # earlier error rows of the retried tickers
+    logger.info(f'Batch valuation of {len(todo_tickers)} tickers ({len(done_tickers)} done) to {output}')
+    n_valued = n_failed = 0
+    try:
+        for row in get_batch_valuations(todo_tickers, settings, workers):
+            writer.write(row)
+            if row['error']:
+                n_failed += 1
+                logger.warning(f"{row['ticker']}: {row['error']}")
+            else:
+                n_valued += 1
+            if (n_valued+n_failed) % 100 == 0:
+                logger.info(f'{n_valued+n_failed}/{len(todo_tickers)} tickers done')
+    finally:
+        writer.flush()
+    return n_valued, n_failed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Default DCF valuation of a list of tickers, streamed to CSV or Parquet')
+    universe = parser.add_mutually_exclusive_group(required=True)
+    universe.add_argument('--tickers', nargs='+', help='tickers to value')
+    universe.add_argument('--tickers-file', help='file with one ticker per line')
+    universe.add_argument('--all', action='store_true', help='all the symbols of assets/symbols.json')
+    parser.add_argument('--output', default='valuations.csv', help='.csv file, or .parquet directory of part files')
+    parser.add_argument('--checkpoint', help='tickers done, default: <output>.checkpoint')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='processes, 1 to run in this process')
+    reports = parser.add_mutually_exclusive_group()
+    reports.add_argument('--reports-dir', help='offline: saved reports <TICKER>.json')
+    reports.add_argument('--pages-dir', help='offline: saved pages <TICKER>/<page>.html')
+    parser.add_argument('--save-reports-dir', help='save the reports for offline runs')
+    parser.add_argument('--reparse', action='store_true', help='parse the pages in the page cache without revalidating them')
+    parser.add_argument('--riskfree-rate', type=float, help='(%%) default: 10Y treasury yield online, else %(const)s')
+    for k in ('erp', 'tax_rate', 'terminal_growth_rate', 'horizon', 'high_growth_years'):
+        parser.add_argument('--' + k.replace('_', '-'), type=type(INPUT_DEFAULTS[k]), default=INPUT_DEFAULTS[k])
+    parser.add_argument('--closed-form-fade', action='store_true', help='H-model value of the fade period')
+    args = parser.parse_args(argv)
+
+    if args.all:
+        tickers = [s['symbol'] for s in get_symbols()]
+    elif args.tickers_file:
+        with open(args.tickers_file) as tickers_file:
+            tickers = tickers_file.read().split()
+    else:
+        tickers = args.tickers
+    tickers = [t.upper() for t in tickers]
+    offline = args.reports_dir or args.pages_dir
+    riskfree_rate = args.riskfree_rate if args.riskfree_rate is not None else \
+        (INPUT_DEFAULTS['riskfree_rate'] if offline else get_rates_fin_values())
+    if args.save_reports_dir:
+        os.makedirs(args.save_reports_dir, exist_ok=True)
+    settings = {'reports_dir': args.reports_dir, 'pages_dir': args.pages_dir, 'save_reports_dir': args.save_reports_dir,
+                'max_page_age': PAGE_CACHE_FOREVER if args.reparse else PAGE_CACHE_MAX_AGE,
+                'inputs': {'riskfree_rate': riskfree_rate, 'erp': args.erp, 'tax_rate': args.tax_rate,
+                            'terminal_growth_rate': args.terminal_growth_rate, 'horizon': args.horizon,
+                            'high_growth_years': args.high_growth_years, 'closed_form_fade': args.closed_form_fade}}
+
+    n_valued, n_failed = run_batch_valuation(tickers, args.output, settings, args.workers, args.checkpoint)
+    print(f'Valued {n_valued} tickers, {n_failed} failed, results in {args.output}')
+
+if __name__ == '__main__':
+    main()
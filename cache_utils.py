@@ -0,0 +1,293 @@
+"""
+Stale-while-revalidate memoization of the upstream fetches on top of the Flask-Caching caches in app.py.
+A value older than its timeout is still served (for up to stale_timeout more) while a single background refresh
+replaces it, and concurrent misses of a key share one computation: in-process by waiting on the thread computing it,
+across workers by a redis lock on the key (in-process only when redis is not reachable). Hit, stale hit, miss and
+refresh duration counters of this process are in get_cache_stats. A failing cache backend is logged and bypassed,
+as by Flask-Caching memoize: the value is computed and not cached.
+Computed results (valuations, tables) are kept in a bounded LRUResultCache per worker, optionally shared through redis.
+"""
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from redis.exceptions import RedisError, LockError
+# Local imports
+from app import db, cache_redis, logger
+
+SWR_LOCK_TIMEOUT = 120  # seconds a worker holds the lock of a key, the longest expected computation
+SWR_REFRESH_WORKERS = 4
+
+refresh_executor = ThreadPoolExecutor(SWR_REFRESH_WORKERS, thread_name_prefix='swr-refresh')
+swr_memoized = {}   # by name, for get_cache_stats
+
+class SWRMemoized:
+    """
+    func memoized in cache as {'value', 'fresh_until'}: fresh for timeout seconds (get_timeout(value, *args) when
+    given), then served stale and refreshed for stale_timeout seconds more before it expires from the cache
+    """
+    def __init__(self, func, cache, timeout, stale_timeout=None, lock_timeout=SWR_LOCK_TIMEOUT, get_timeout=None):
+        self.uncached = func
+        self.cache = cache
+        self.cache_timeout = timeout
+        self.get_timeout = get_timeout
+        self.stale_timeout = timeout if stale_timeout is None else stale_timeout
+        self.lock_timeout = lock_timeout
+        self.name = f'{func.__module__}.{func.__qualname__}'
+        self._lock = threading.Lock()
+        self._in_flight = {}    # (key, is_refresh): Future of the computation in this process
+        self.stats = {'hits': 0, 'stale_hits': 0, 'misses': 0, 'collapsed': 0, 'refreshes': 0, 'refresh_errors': 0,
+                    'cache_errors': 0, 'refresh_seconds': 0.0, 'refresh_seconds_max': 0.0}
+        self.__name__, self.__doc__, self.__wrapped__ = func.__name__, func.__doc__, func
+        swr_memoized[self.name] = self
+
+    def __call__(self, *args):
+        key = self.make_cache_key(*args)
+        try:
+            entry = self.cache.get(key)
+        except Exception as e:
+            self.log_cache_error('get', e)
+            self.count('misses')
+            return self.compute(args, set_cache=False)
+        if entry is not None:
+            if time.time() < entry['fresh_until']:
+                self.count('hits')
+            else:
+                self.count('stale_hits')
+                self.refresh_in_background(key, args)
+            return entry['value']
+        self.count('misses')
+        return self.get_single_flight(key, args)
+
+    def make_cache_key(self, *args):
+        return 'swr:' + self.name + ':' + ':'.join(map(str, args))
+
+    def set_cached(self, value, *args):
+        timeout = self.cache_timeout if self.get_timeout is None else self.get_timeout(value, *args)
+        try:
+            self.cache.set(self.make_cache_key(*args), {'value': value, 'fresh_until': time.time() + timeout},
+                            timeout=timeout + self.stale_timeout)
+        except Exception as e:  # served uncached
+            self.log_cache_error('set', e)
+
+    def get_entry(self, key):
+        # cached entry of key, None when not cached or the cache backend fails
+        try:
+            return self.cache.get(key)
+        except Exception as e:
+            self.log_cache_error('get', e)
+            return None
+
+    def log_cache_error(self, operation, e):
+        self.count('cache_errors')
+        logger.warning(f'{self.name}: cache {operation} failed ({type(e).__name__} {e}), not cached')
+
+    def get_cached(self, *args):
+        """
+        Cached value of args, fresh or stale, None when not cached (not counted, not refreshed)
+        """
+        entry = self.get_entry(self.make_cache_key(*args))
+        return None if entry is None else entry['value']
+
+    def is_cached(self, *args):
+        """
+        Whether a value of args is cached, fresh or stale, by its key only (the value is not read)
+        """
+        try:
+            return bool(self.cache.cache.has(self.make_cache_key(*args)))  # the backend's key check, no Flask-Caching wrapper
+        except Exception as e:
+            self.log_cache_error('has', e)
+            return False
+
+    def get_fresh_seconds(self, *args):
+        """
+        Seconds the cached value of args stays fresh (negative when stale), None when not cached
+        """
+        entry = self.get_entry(self.make_cache_key(*args))
+        return None if entry is None else entry['fresh_until'] - time.time()
+
+    def refresh(self, *args):
+        """
+        Recompute and cache the value of args now, None when another worker is refreshing it
+        """
+        return self.get_single_flight(self.make_cache_key(*args), args, is_refresh=True)
+
+    def delete(self, *args):
+        try:
+            self.cache.delete(self.make_cache_key(*args))
+        except Exception as e:
+            self.log_cache_error('delete', e)
+
+    def count(self, stat, value=1):
+        with self._lock:
+            self.stats[stat] += value
+
+    def refresh_in_background(self, key, args):
+        def refresh():
+            try:
+                self.get_single_flight(key, args, is_refresh=True)
+            except Exception as e:  # the stale value is served until the next refresh
+                logger.exception(e)
+        if (key, True) not in self._in_flight:
+            refresh_executor.submit(refresh)
+
+    def get_single_flight(self, key, args, is_refresh=False):
+        # computes the value of key unless this process already is, then waits for that computation
+        with self._lock:
+            future = self._in_flight.get((key, is_refresh))
+            is_leader = future is None
+            if is_leader:
+                future = self._in_flight[(key, is_refresh)] = Future()
+            else:
+                self.stats['collapsed'] += 1
+        if not is_leader:
+            return future.result()
+        try:
+            value = self.get_locked(key, args, blocking=not is_refresh)
+            future.set_result(value)
+            return value
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[(key, is_refresh)]
+
+    def get_locked(self, key, args, blocking=True):
+        # computes the value of key under its redis lock, a worker waiting for the lock then finds the value cached.
+        # A refresh does not wait, another worker is refreshing the key
+        lock = db.lock('swr-lock:' + key, timeout=self.lock_timeout, blocking_timeout=self.lock_timeout)
+        try:
+            acquired = lock.acquire(blocking=blocking)
+        except RedisError as e:
+            logger.warning(f'{self.name}: no redis lock ({type(e).__name__}), computing without')
+            return self.compute(args)
+        if not acquired and not blocking:
+            return None
+        try:
+            entry = self.get_entry(key)
+            if blocking and entry is not None and time.time() < entry['fresh_until']:  # computed while waiting
+                return entry['value']
+            return self.compute(args)
+        finally:
+            if acquired:
+                try:
+                    lock.release()
+                except (LockError, RedisError):  # expired while computing
+                    pass
+
+    def compute(self, args, set_cache=True):
+        start = time.perf_counter()
+        try:
+            value = self.uncached(*args)
+        except Exception:
+            self.count('refresh_errors')
+            raise
+        duration = time.perf_counter() - start
+        with self._lock:
+            self.stats['refreshes'] += 1
+            self.stats['refresh_seconds'] += duration
+            self.stats['refresh_seconds_max'] = max(self.stats['refresh_seconds_max'], duration)
+        if set_cache and value is not None:   # None reads as a miss, as with Flask-Caching memoize
+            self.set_cached(value, *args)
+        return value
+
+def memoize_swr(cache, timeout, stale_timeout=None, lock_timeout=SWR_LOCK_TIMEOUT, get_timeout=None):
+    """
+    Decorator memoizing a function in cache (cache or cache_redis of app.py) with stale-while-revalidate and
+    single-flight computation, see SWRMemoized
+    """
+    def decorator(func):
+        return SWRMemoized(func, cache, timeout, stale_timeout, lock_timeout, get_timeout)
+    return decorator
+
+def get_cache_stats():
+    """
+    Counters of the memoized functions in this process, by function name
+    """
+    stats = {}
+    for name, memoized in swr_memoized.items():
+        with memoized._lock:
+            stats[name] = dict(memoized.stats)
+        calls = stats[name]['hits'] + stats[name]['stale_hits'] + stats[name]['misses']
+        stats[name]['hit_ratio'] = (stats[name]['hits'] + stats[name]['stale_hits']) / calls if calls else None
+    return stats
+
+class LRUResultCache:
+    """
+    Bounded LRU cache of computed results keyed on hashable records (named tuples, tuples), shared by the threads of a
+    worker. With use_redis, misses fall through to the app's cache_redis (keys prefixed by redis_prefix, kept for
+    timeout seconds) so that workers share their results; a failing redis is logged and bypassed.
+    Cached results are shared objects: callers must not modify them
+    """
+    def __init__(self, maxsize, use_redis=False, timeout=None, redis_prefix='lru-result-', name='result'):
+        self.maxsize = maxsize
+        self.use_redis = use_redis
+        self.redis_prefix = redis_prefix
+        self.timeout = timeout
+        self.name = name
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, record):
+        with self._lock:
+            if record in self._results:
+                self._results.move_to_end(record)
+                self.hits += 1
+                return self._results[record]
+        result = self._redis_get(record) if self.use_redis else None
+        with self._lock:
+            if result is None:
+                self.misses += 1
+            else:
+                self.redis_hits += 1
+                self._put(record, result)
+        return result
+
+    def set(self, record, result):
+        with self._lock:
+            self._put(record, result)
+        if self.use_redis:
+            self._redis_set(record, result)
+
+    def get_or_compute(self, record, compute):
+        result = self.get(record)
+        if result is None:
+            result = compute(record)
+            self.set(record, result)
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+            self.hits = self.redis_hits = self.misses = 0
+
+    def stats(self):
+        return {'hits': self.hits, 'redis_hits': self.redis_hits, 'misses': self.misses,
+                'size': len(self._results), 'maxsize': self.maxsize}
+
+    def _put(self, record, result):
+        self._results[record] = result
+        self._results.move_to_end(record)
+        while len(self._results) > self.maxsize:
+            self._results.popitem(last=False)
+
+    def _redis_key(self, record):
+        return self.redis_prefix + hashlib.sha1(repr(tuple(record)).encode()).hexdigest()
+
+    def _redis_get(self, record):
+        try:
+            return cache_redis.get(self._redis_key(record))
+        except Exception as e:  # redis is optional, fall back to computing the result
+            logger.warning(f'{self.name} cache: redis get failed ({type(e).__name__} {e}), computing')
+            return None
+
+    def _redis_set(self, record, result):
+        try:
+            cache_redis.set(self._redis_key(record), result, timeout=self.timeout)
+        except Exception as e:
+            logger.warning(f'{self.name} cache: redis set failed ({type(e).__name__} {e}), kept in this worker only')
@@ -12,8 +12,9 @@ from dash.dependencies import Input, Output, State
 from dash import html
 import dash_bootstrap_components as dbc
 from dash.exceptions import PreventUpdate
-# import plotly.graph_objs as go
+import plotly.graph_objs as go
 import plotly.express as px
+from plotly.subplots import make_subplots
 import requests
 import asyncio
 from sseclient import SSEClient
@@ -21,9 +22,15 @@ from sseclient import SSEClient
 # Local imports
 from __init__ import HERE, TIMEOUT_12HR, DEFAULT_TICKER, DEFAULT_SNAPSHOT_UUID, ticker_dict, exchange_list
 from app import app, cache, db, logger
-from dash_utils import make_table, replace_str_element_w_dash_component
-from get_fin_report import get_financial_report, get_yahoo_fin_values, get_number_from_string, get_string_from_number, get_sector_data, get_rates_fin_values
-from get_dcf_valuation import get_dcf_df
+from dash_utils import make_table, replace_str_element_w_dash_component, get_display_df
+from get_fin_report import get_fin_report_sources, get_string_from_number, get_strings_from_numbers, get_sector_data, get_report_df, \
+    get_financial_report
+from prewarm import record_request
+from sector_table import get_selected_sector_table, get_sector_slice, get_sector_handle, SECTOR_TEXT_COLUMNS
+import numpy as np
+from get_dcf_valuation import get_dcf_df, get_dcf_inputs, get_simulation_distributions, get_dcf_simulation, SIMULATION_KEYS, \
+    get_sensitivity_axis, get_dcf_sensitivity, get_dcf_tornado, SENSITIVITY_STEPS, get_dcf_implied, IMPLIED_BRACKETS, \
+    get_dcf_summary_df, get_dcf_backtest
 
 def handler_data_message(title, exception_obj):
     return [{
@@ -69,14 +76,17 @@ Output('snapshot-link', 'disabled')],
 Input('save-snapshot', 'n_clicks'),
 Input('ticker-input', 'value'),
 Input('snapshot-uuid', 'value')],
-State('dcf-store', 'data'))
-def save_snapshot(live_analysis_mode, save_button_clicked, ticker, snapshot_uuid, df_dict):
+[State('dcf-store', 'data'),
+State('simulation-store', 'data')])
+def save_snapshot(live_analysis_mode, save_button_clicked, ticker, snapshot_uuid, df_dict, simulation_dict):
     if 1 in live_analysis_mode: # generate a fresh UUID
         snapshot_uuid = str(uuid.uuid5(uuid.UUID(snapshot_uuid), ticker))
         if save_button_clicked:
             # df_dict[ticker] = {**df_dict[ticker], **dcf_dict[ticker]}
             if 'analysis_timestamp' in df_dict[ticker]['stats_dict']:   # >= v0.6-alpha.3
                 df_dict[ticker]['stats_dict']['analysis_timestamp'] += f',\n{snapshot_uuid} : Analysis saved @ {datetime.now().strftime("%b %-d, %Y %H:%M:%S %Z")}'
+            if simulation_dict:     # seed and settings to reproduce the Monte Carlo run
+                df_dict[ticker]['simulation_dict'] = simulation_dict
             db.set(ticker+'-'+snapshot_uuid, json.dumps(df_dict))
         return '/apps/dcf/' + ticker + '/' + snapshot_uuid, False, not save_button_clicked
     else:
@@ -156,9 +166,9 @@ def fin_report(ticker_valid, ticker, live_analysis_mode, snapshot_uuid):
         ticker_allcaps = ticker.upper()
         db_key = ticker_allcaps+'-'+snapshot_uuid   # if snapshot_uuid != DEFAULT_SNAPSHOT_UUID else ticker_allcaps
         if 1 in live_analysis_mode or not db.exists(db_key):
-            df, lastprice, lastprice_time, report_date_note = get_financial_report(ticker_allcaps)
-            next_earnings_date, beta = get_yahoo_fin_values(ticker_allcaps)
-            riskfree_rate = get_rates_fin_values()
+            record_request('ticker', ticker_allcaps, warm=get_financial_report.is_cached(ticker_allcaps))
+            # report, quote values and treasury rate fetched concurrently
+            (df, lastprice, lastprice_time, report_date_note), (next_earnings_date, beta), riskfree_rate = get_fin_report_sources(ticker_allcaps)
 
             stats_record = {'ticker': ticker_allcaps,
                             'lastprice': float(lastprice.replace(',','')),
@@ -174,15 +184,17 @@ def fin_report(ticker_valid, ticker, live_analysis_mode, snapshot_uuid):
             df_dict = json.loads(db.get(db_key))  # pull output callback from from server cache or database: redis
             if not df_dict:
                 raise KeyError('Redis Key not found: ' + db_key + '\nPlease click the app tab link to refresh state!')
-            df = pd.DataFrame.from_dict(df_dict[ticker_allcaps]['fin_report_dict'])
+            df = get_report_df(df_dict[ticker_allcaps]['fin_report_dict'])
+            df_dict[ticker_allcaps]['fin_report_dict'] = df.to_dict('records')
             stats_record = df_dict[ticker_allcaps]['stats_dict']
+            riskfree_rate = dash.no_update  # as set by the snapshot
         select_column_options = [{'label': i, 'value': i} for i in list(df.columns)[1:]]
 
         supp_data_notes = f"Original Analysis performed on : {stats_record.get('analysis_timestamp', 'NA')},\n" \
             f"MRQ report ending: {stats_record['report_date_note']},\n" \
-            f"Shares outstanding: {df['Shares Outstanding'].iloc[-1]},\n" \
-            f"Market Cap: {get_string_from_number(get_number_from_string(df['Shares Outstanding'].iloc[-1]) * stats_record['lastprice'])},\n" \
-            f"Cash as of MRQ: {df['Cash($)'].iloc[-1]},\n" \
+            f"Shares outstanding: {get_string_from_number(df['Shares Outstanding'].iloc[-1])},\n" \
+            f"Market Cap: {get_string_from_number(df['Shares Outstanding'].iloc[-1] * stats_record['lastprice'])},\n" \
+            f"Cash as of MRQ: {get_string_from_number(df['Cash($)'].iloc[-1])},\n" \
             f"Beta: {stats_record['beta']},\n" \
             f"Next Earnings date: {stats_record['next_earnings_date']},\n"
         handler_data = {'status-info': f"{stats_record['lastprice']}", 
@@ -201,8 +213,8 @@ def update_historical_table(df_dict, ticker):
     if not df_dict:
         return []
     try:
-        return dbc.Table.from_dataframe(pd.DataFrame.from_dict(df_dict[ticker]['fin_report_dict'])[['index', 'Revenue($)', 'EPS($)', 'EPS Growth(%)', 
-              'Pretax Income($)', 'Shareholder Equity($)', 'Longterm Debt($)', 'Net Investing Cash Flow($)']], 
+        return dbc.Table.from_dataframe(get_display_df(get_report_df(df_dict[ticker]['fin_report_dict'])[['index', 'Revenue($)', 'EPS($)', 'EPS Growth(%)', 
+              'Pretax Income($)', 'Shareholder Equity($)', 'Longterm Debt($)', 'Net Investing Cash Flow($)']]), 
               striped=True, bordered=True, hover=True)
     except Exception as e:
         logger.exception(e)
@@ -217,8 +229,7 @@ def update_graph(df_dict, column_name, ticker):
     if not df_dict:
         return {}
     try:
-        df_str_format = pd.DataFrame.from_dict(df_dict[ticker]['fin_report_dict'])
-        df = pd.concat([df_str_format.iloc[:,0], df_str_format.iloc[:,1:].applymap(get_number_from_string)], axis=1)
+        df = get_report_df(df_dict[ticker]['fin_report_dict'])
         for col in list(df.columns):
             if '%' in col:  # scale up ratio by 100 if unit is %
                 df.loc[:, col] *= 100
@@ -267,23 +278,29 @@ State('marginal-tax', 'value'),
 State('prob-failure', 'value'),
 State('terminal-growth-rate', 'disabled'),
 State('analysis-mode', 'value'),
-State('snapshot-uuid', 'value')])
+State('snapshot-uuid', 'value'),
+State('horizon-years', 'value'),
+State('high-growth-years', 'value'),
+State('closed-form-fade', 'value')])
 def dcf_valuation(*args, **kwargs):    
     if not args[0]:
         return [], [], [], dash.no_update
     try:
         df_dict = args[0]
-        live_analysis_mode = args[-2]
-        snapshot_uuid = args[-1]
+        live_analysis_mode = args[26]
+        snapshot_uuid = args[27]
         ticker = list(df_dict.keys())[0]
         dcf_store_dict_json = db.get(ticker+'-'+snapshot_uuid)
         dcf_store_dict = json.loads(dcf_store_dict_json) if dcf_store_dict_json else None
         safe_get_dcf = dcf_store_dict.get(ticker).get('dcf_df_dict') if dcf_store_dict else None
         if 1 in live_analysis_mode or not safe_get_dcf:
             dcf_df, dcf_output_dict = get_dcf_df(*args)
+            dcf_inputs = get_dcf_inputs(*args)
         else:
             dcf_df = pd.DataFrame.from_dict(safe_get_dcf)
             dcf_output_dict = dcf_store_dict[ticker]['dcf_output_dict']
+            # the inputs of the saved valuation, horizon settings included, rather than the UI states
+            dcf_inputs = dcf_store_dict[ticker].get('dcf_inputs') or get_dcf_inputs(*args)
         # Capture all inputs to dcf-store.data
         ctx = dash.callback_context
         dcf_store_dict = ctx.inputs.pop('fin-store.data')
@@ -291,6 +308,9 @@ def dcf_valuation(*args, **kwargs):
             dcf_store_dict[ticker][k] = v
         dcf_store_dict[ticker]['dcf_df_dict'] = dcf_df.to_dict('records')
         dcf_store_dict[ticker]['dcf_output_dict'] = dcf_output_dict
+        dcf_store_dict[ticker]['dcf_inputs'] = dcf_inputs
+        # Reverse DCF: what the last price implies for each input, the others fixed
+        implied = {k: get_dcf_implied(dcf_inputs, dcf_output_dict['last_price'], k) for k in IMPLIED_BRACKETS}
         
         dcf_output_df = pd.DataFrame({
                             'Price': [dcf_output_dict['last_price']],
@@ -298,15 +318,161 @@ def dcf_valuation(*args, **kwargs):
                             'Price as % of Value': ['{:.2f}'.format(100*dcf_output_dict['last_price']/dcf_output_dict['estimated_value_per_share'])],
                             'PV Total': [get_string_from_number(dcf_output_dict['PV_sum'])],
                             'PV Terminal Value': [get_string_from_number(dcf_output_dict['PV_terminal_value'])],
+                            'Implied CAGR 2-5': [get_strings_from_numbers([implied['cagr_2_5']], True)[0]],
+                            'Implied Target Margin': [get_strings_from_numbers([implied['opm_target']], True)[0]],
+                            'Implied Cost of Capital': [get_strings_from_numbers([implied['cost_of_cap']], True)[0]],
                             })
-        return dcf_store_dict, make_table('dcf-df', dcf_df), dbc.Table.from_dataframe(dcf_output_df, striped=True, bordered=True, hover=True), dash.no_update
+        return dcf_store_dict, make_table('dcf-df', get_display_df(get_dcf_summary_df(dcf_df, dcf_inputs['high_growth_years']))), \
+            dbc.Table.from_dataframe(dcf_output_df, striped=True, bordered=True, hover=True), dash.no_update
     except TypeError as e:
         logger.exception(e)
         return [], [], replace_str_element_w_dash_component(traceback.format_exc()), handler_data_message('See Error Message(s) in DCF outputs:', '')
     except Exception as e:
         logger.exception(e)
         raise PreventUpdate
-        
+
+@app.callback([Output('horizon-years', 'value'),
+Output('high-growth-years', 'value'),
+Output('closed-form-fade', 'value')],
+[Input('fin-store', 'data')],
+[State('analysis-mode', 'value')])
+def restore_horizon_settings(df_dict, live_analysis_mode):
+    # horizon settings of the valuation saved with the snapshot, shown as they were
+    if not df_dict or 1 in live_analysis_mode:
+        raise PreventUpdate
+    dcf_inputs = list(df_dict.values())[0].get('dcf_inputs')
+    if not dcf_inputs:
+        raise PreventUpdate
+    return dcf_inputs['horizon'], dcf_inputs['high_growth_years'], [1] if dcf_inputs['closed_form_fade'] else []
+
+@app.callback([Output('simulation-graph', 'figure'),
+Output('simulation-data', 'children'),
+Output('simulation-store', 'data')],
+[Input('run-simulation', 'n_clicks')],
+[State('dcf-store', 'data'),
+State('simulation-draws', 'value'),
+State('simulation-distribution', 'value'),
+State('simulation-spread', 'value'),
+State('simulation-correlation', 'value'),
+State('simulation-seed', 'value')])
+def dcf_simulation(run_simulation_clicks, dcf_store_dict, n_draws, distribution, spread, correlation, seed):
+    if not run_simulation_clicks or not dcf_store_dict:
+        raise PreventUpdate
+    try:
+        ticker = list(dcf_store_dict.keys())[0]
+        dcf_inputs = dcf_store_dict[ticker].get('dcf_inputs')
+        if not dcf_inputs:
+            raise KeyError('DCF inputs not found for simulation, please run the DCF calculation again!')
+        distributions = get_simulation_distributions(dcf_inputs, distribution, spread)
+        correlation_matrix = np.eye(len(SIMULATION_KEYS))
+        i, j = SIMULATION_KEYS.index('cagr_2_5'), SIMULATION_KEYS.index('opm_target')
+        correlation_matrix[i, j] = correlation_matrix[j, i] = correlation
+        last_price = dcf_store_dict[ticker]['dcf_output_dict']['last_price']
+        simulation = get_dcf_simulation(dcf_inputs, distributions, int(n_draws or 50000),
+                                        seed=None if seed is None else int(seed), correlation=correlation_matrix, price=last_price)
+
+        bin_edges = simulation['histogram']['bin_edges']
+        fig = px.bar(x=[(bin_edges[b]+bin_edges[b+1])/2 for b in range(len(bin_edges)-1)], y=simulation['histogram']['counts'],
+                    labels={'x': 'Estimated Value per Share ($)', 'y': 'Number of draws'})
+        fig.update_traces(width=bin_edges[1]-bin_edges[0])
+        fig.add_vline(x=last_price, line_dash='dash', annotation_text=f'Price {last_price}')
+        fig.update_layout(
+            title=f"{ticker}: {simulation['n_valid']} valid of {simulation['n_draws']} draws, seed {simulation['seed']}",
+        )
+        simulation_df = pd.DataFrame({**{f'P{p}': ['{:.2f}'.format(v)] for p, v in simulation['percentiles'].items()},
+                                    'Mean': ['{:.2f}'.format(simulation['mean'])],
+                                    'Prob. Value > Price (%)': ['{:.1f}'.format(100*simulation['prob_above_price'])],
+                                    'Seed': [simulation['seed']]})  # enter it as the seed to reproduce this run
+        simulation_dict = {'seed': simulation['seed'], 'n_draws': simulation['n_draws'], 'distribution': distribution,
+                            'spread': spread, 'correlation': correlation, 'percentiles': simulation['percentiles']}
+        return fig, dbc.Table.from_dataframe(simulation_df, striped=True, bordered=True, hover=True), simulation_dict
+    except Exception as e:
+        logger.exception(e)
+        return {}, replace_str_element_w_dash_component(traceback.format_exc()), dash.no_update
+
+@app.callback([Output('simulation-draws', 'value'),
+Output('simulation-distribution', 'value'),
+Output('simulation-spread', 'value'),
+Output('simulation-correlation', 'value'),
+Output('simulation-seed', 'value')],
+[Input('fin-store', 'data')],
+[State('analysis-mode', 'value')])
+def restore_simulation_settings(df_dict, live_analysis_mode):
+    # Monte Carlo settings saved with the snapshot, running the simulation reproduces the saved run
+    if not df_dict or 1 in live_analysis_mode:
+        raise PreventUpdate
+    simulation_dict = list(df_dict.values())[0].get('simulation_dict')
+    if not simulation_dict:
+        raise PreventUpdate
+    return simulation_dict['n_draws'], simulation_dict['distribution'], simulation_dict['spread'], \
+        simulation_dict['correlation'], simulation_dict['seed']
+
+DCF_INPUT_LABELS = {'rgr_next': 'Revenue Growth next year(%)', 'cagr_2_5': 'CAGR years 2-5(%)', 'opm_target': 'Target Operating Margin(%)',
+                    'sales_to_cap': 'Sales to Capital', 'cost_of_cap': 'Cost of Capital(%)', 'terminal_growth_rate': 'Terminal Growth Rate(%)',
+                    'tax_rate': 'Effective Tax Rate(%)'}
+
+@app.callback(Output('sensitivity-graph', 'figure'),
+[Input('run-sensitivity', 'n_clicks')],
+[State('dcf-store', 'data'),
+State('sensitivity-axes', 'value')])
+def dcf_sensitivity(run_sensitivity_clicks, dcf_store_dict, sensitivity_axes):
+    if not run_sensitivity_clicks or not dcf_store_dict:
+        raise PreventUpdate
+    try:
+        ticker = list(dcf_store_dict.keys())[0]
+        dcf_inputs = dcf_store_dict[ticker].get('dcf_inputs')
+        if not dcf_inputs:
+            raise KeyError('DCF inputs not found for sensitivity analysis, please run the DCF calculation again!')
+        x_key, y_key = sensitivity_axes.split(':')
+        x_values = get_sensitivity_axis(dcf_inputs[x_key], SENSITIVITY_STEPS[x_key])
+        y_values = get_sensitivity_axis(dcf_inputs[y_key], SENSITIVITY_STEPS[y_key])
+        value_matrix = get_dcf_sensitivity(dcf_inputs, x_key, x_values, y_key, y_values)
+        base_value, tornado = get_dcf_tornado(dcf_inputs)
+
+        fig = make_subplots(rows=1, cols=2, column_widths=[0.6, 0.4], horizontal_spacing=0.2,
+                            subplot_titles=['Value per Share ($)', f'Swing around Value per Share {base_value:.2f} ($)'])
+        fig.add_trace(go.Heatmap(x=[f'{100*x:.2f}' for x in x_values], y=[f'{100*y:.2f}' for y in y_values], z=value_matrix,
+                                text=[[f'{v:.2f}' for v in row] for row in value_matrix], texttemplate='%{text}',
+                                colorscale='RdYlGn', showscale=False), row=1, col=1)
+        tornado_labels = [DCF_INPUT_LABELS.get(k, k) for k, _, _ in reversed(tornado)]
+        fig.add_trace(go.Bar(y=tornado_labels, x=[low-base_value for _, low, _ in reversed(tornado)], base=base_value,
+                            orientation='h', name='Input down'), row=1, col=2)
+        fig.add_trace(go.Bar(y=tornado_labels, x=[high-base_value for _, _, high in reversed(tornado)], base=base_value,
+                            orientation='h', name='Input up'), row=1, col=2)
+        fig.update_xaxes(title_text=DCF_INPUT_LABELS[x_key], type='category', row=1, col=1)
+        fig.update_yaxes(title_text=DCF_INPUT_LABELS[y_key], type='category', row=1, col=1)
+        fig.update_layout(barmode='overlay', title=ticker + ": Sensitivity of Estimated Value per Share")
+        return fig
+    except Exception as e:
+        logger.exception(e)
+        return {}
+
+@app.callback(Output('backtest-graph', 'figure'),
+[Input('run-backtest', 'n_clicks')],
+[State('fin-store', 'data'),
+State('dcf-store', 'data')])
+def dcf_backtest(run_backtest_clicks, df_dict, dcf_store_dict):
+    if not run_backtest_clicks or not df_dict or not dcf_store_dict:
+        raise PreventUpdate
+    try:
+        ticker = list(dcf_store_dict.keys())[0]
+        dcf_inputs = dcf_store_dict[ticker].get('dcf_inputs')
+        if not dcf_inputs:
+            raise KeyError('DCF inputs not found for backtest, please run the DCF calculation again!')
+        backtest_df = get_dcf_backtest(get_report_df(df_dict[ticker]['fin_report_dict']), dcf_inputs)
+        last_price = dcf_store_dict[ticker]['dcf_output_dict']['last_price']
+
+        fig = px.line(backtest_df, x='Year', y='estimated_value_per_share', markers=True,
+                    hover_data={k: ':.3f' for k in ('rgr_next', 'cagr_2_5', 'opm_target', 'sales_to_cap')},
+                    labels={'estimated_value_per_share': 'Estimated Value per Share ($)'})
+        fig.add_hline(y=last_price, line_dash='dash', annotation_text=f'Current Price {last_price}')
+        fig.update_xaxes(dtick=1)
+        fig.update_layout(title=ticker + ": Estimated Value per Share as of each report year")
+        return fig
+    except Exception as e:
+        logger.exception(e)
+        return {}
+
 @app.callback([Output('sector-store', 'data'),#ServerSideOutput
 Output('crossfilter-xaxis-column', 'options'),
 Output('crossfilter-yaxis-column', 'options'),
@@ -315,21 +481,17 @@ Output('select-company', 'options')],
 )
 def update_sector_analysis(sector_names):
     if not sector_names:
-        return {}, [], [], []
+        return None, [], [], []
     try:
-        sector_dict = {}
         for s in sector_names:
-            sector_data = get_sector_data(s)
-            for ticker in sector_data:
-                sector_data[ticker]['advanced-stats']['sector'] = s
-            sector_dict.update(sector_data)
-        sector_df = pd.DataFrame.from_dict({s:sector_dict[s]['advanced-stats'] for s in sector_dict}, orient='index')
-        xfilter_options = [{'label': i, 'value': i} for i in list(sector_df.columns) + ['EBITDAToEV(%)', 'EBITDAToRevenueMargin', 'TotalAssets', 'EBITDAToAssets(%)']]
-        company_options = [{'label': c, 'value': c} for c in list(sector_df.companyName)]
-        return sector_dict, xfilter_options, xfilter_options, company_options
+            record_request('sector', s, warm=get_sector_data.is_cached(s))
+        sector_table = get_selected_sector_table(sector_names)
+        xfilter_options = [{'label': i, 'value': i} for i in sector_table.columns if i not in SECTOR_TEXT_COLUMNS]
+        company_options = [{'label': c, 'value': c} for c in sector_table.companyName.unique()]
+        return get_sector_handle(sector_names), xfilter_options, xfilter_options, company_options
     except Exception as e:
         logger.exception(e)
-        return {}, [], [], []
+        return None, [], [], []
 
 @app.callback([Output('sector-distribution', 'figure')],
 [Input('sector-store', 'data'),
@@ -337,34 +499,19 @@ Input('select-company', 'value'),
 Input('sector-ev-filter', 'value'),
 Input('crossfilter-xaxis-column', 'value'),
 Input('crossfilter-yaxis-column', 'value')],
+[State('select-sector', 'value')]
 )
-def graph_sector_matrix(sector_dict, company_selections, ev_limits, xaxis, yaxis):
-    if not sector_dict:
+def graph_sector_matrix(sector_handle, company_selections, ev_limits, xaxis, yaxis, sector_names):
+    # the browser holds the handle only, the table is rebuilt from the selection if it expired from the caches
+    if not sector_handle or not sector_names:
         return []
-    sector_df = pd.DataFrame.from_dict({s:sector_dict[s]['advanced-stats'] for s in sector_dict}, orient='index')
-    sector_df.dropna(inplace=True, subset=['marketcap', 'enterpriseValue', 'profitMargin', 'enterpriseValueToRevenue'])
-    if sector_df.empty:
-        return []
-    if not company_selections:
-        sector_df_filtered = sector_df.query(f"enterpriseValue >= {10 ** ev_limits[0]} \
-                        & enterpriseValue <= {10 ** ev_limits[1]}")
-    else:
-        sector_df_filtered = sector_df.query(f"companyName in {company_selections} \
-                        & enterpriseValue >= {10 ** ev_limits[0]} \
-                        & enterpriseValue <= {10 ** ev_limits[1]}")
+    if sector_handle != get_sector_handle(sector_names):    # selection changed, its handle is on the way
+        raise PreventUpdate
+    sector_df_filtered = get_sector_slice(get_selected_sector_table(sector_names), ev_limits, company_selections)
     total_companies = len(sector_df_filtered)
     if not total_companies:
         return []
     else:
-        sector_df_filtered.loc[:, 'EBITDAToEV(%)'] = sector_df_filtered.EBITDA / sector_df_filtered.enterpriseValue
-        sector_df_filtered.loc[:, 'EBITDAToRevenueMargin'] = sector_df_filtered['EBITDAToEV(%)'] * sector_df_filtered.enterpriseValueToRevenue
-        sector_df_filtered.loc[:, 'TotalAssets'] = (sector_df_filtered.marketcap / sector_df_filtered.priceToBook) * (1 + sector_df_filtered.debtToEquity) + sector_df_filtered.currentDebt
-        # Alternate Debt + Equity: (sector_df_filtered.enterpriseValue - sector_df_filtered.marketcap + sector_df_filtered.totalCash) * (1 + 1/sector_df_filtered.debtToEquity)
-        sector_df_filtered.loc[:, 'EBITDAToAssets(%)'] = sector_df_filtered.EBITDA / sector_df_filtered.TotalAssets
-
-        for col in list(sector_df_filtered.columns):
-            if 'Margin' in col or 'Percent' in col or '%' in col:  # scale up ratio by 100 if 'Margin' or 'Percent' in col name
-                sector_df_filtered.loc[:, col] *= 100
         x_limits = [-5, min([sector_df_filtered[xaxis].max(), 40])+5] if xaxis in ['EBITDAToEV(%)'] else None
         y_limits = [-5, min([sector_df_filtered[yaxis].max(), 80])+5] if yaxis in ['EBITDAToRevenueMargin', 'EBITDAToAssets(%)', 'profitMargin'] else None
         fig = px.scatter(sector_df_filtered, x=xaxis, y=yaxis, range_x=x_limits, range_y=y_limits,
@@ -5,9 +5,11 @@ import dash_bootstrap_components as dbc
 from dash import dash_table
 from dash.dependencies import Input, Output, State
 import dateutil.relativedelta
+import pandas as pd
 from datetime import date
 from app import app
 from __init__ import DEFAULT_TICKER
+from get_fin_report import get_strings_from_numbers
 
 def make_table(id, dataframe, lineHeight = '17px', page_size = 5):
     return   dash_table.DataTable(
@@ -52,6 +54,17 @@ def make_table(id, dataframe, lineHeight = '17px', page_size = 5):
         data=dataframe.to_dict('records')
     )
 
+def get_display_df(dataframe, index_columns=('index', 'Year')):
+    """
+    Format the numeric columns of a report/DCF df for display, ratios in '%' columns as percent.
+    Columns that are already strings (e.g. from older snapshots) are left as is
+    """
+    display_df = dataframe.copy()
+    for col in display_df.columns:
+        if col not in index_columns and pd.api.types.is_numeric_dtype(display_df[col]):
+            display_df[col] = get_strings_from_numbers(display_df[col], '%' in col)
+    return display_df
+
 def make_card(alert_message, color, cardbody, style_dict = None):
     return  dbc.Card([
         dbc.Alert(alert_message, color=color),
@@ -1,4 +1,3 @@
-from statistics import mean
 import json
 from dash import dcc
 from dash import html
@@ -7,7 +6,8 @@ from dash.dependencies import Input, Output, State
 from dash.exceptions import PreventUpdate
 # Local imports
 from app import app, db, logger
-from get_fin_report import get_number_from_string
+from get_fin_report import get_report_df
+from get_dcf_valuation import get_default_assumptions, get_cost_of_capital_rate
 
 def get_dcf_current_year_input_overrides():
     return [dbc.Form([dbc.Form(
@@ -226,6 +226,22 @@ def get_other_input_overrides():
                     )
                 ]
         ),
+        dbc.Form(
+                [
+                    dbc.Label("Forecast Horizon (Years)", html_for="horizon-years"),
+                    dcc.Slider(id="horizon-years", min=5, max=50, step=1, value=10,
+                    marks={v: str(v) for v in range(5, 51, 5)},
+                    )
+                ]
+        ),
+        dbc.Form(
+                [
+                    dbc.Label("High Growth Years (CAGR until this year, then fade to Terminal Growth)", html_for="high-growth-years"),
+                    dcc.Slider(id="high-growth-years", min=2, max=20, step=1, value=5,
+                    marks={v: str(v) for v in range(2, 21, 2)},
+                    )
+                ]
+        ),
         dbc.Form(
                 [
                     dbc.Label("Marginal Tax Rate(%)", html_for="marginal-tax"),
@@ -253,6 +269,14 @@ def get_other_input_overrides():
                     id="override-default-assumptions",
                     switch=True,
                     ),
+                    dbc.Checklist(
+                    options=[
+                        {"label": "Approximate the fade period in closed form (H-model)? Faster, values differ from the explicit projection", "value": 1},
+                    ],
+                    value=[],
+                    id="closed-form-fade",
+                    switch=True,
+                    ),
                 ]
         ),
     ])
@@ -283,28 +307,9 @@ def update_current_year_values(df_dict, live_analysis_mode, snapshot_uuid):
         dcf_store_dict = json.loads(dcf_store_dict_json) if dcf_store_dict_json else None
         safe_get_year0_revenue = dcf_store_dict.get(ticker).get('year0-revenue.value') if dcf_store_dict else None
         if 1 in live_analysis_mode or not safe_get_year0_revenue:
-            df_dict = list(df_dict.values())[0]['fin_report_dict']
-            for y in df_dict:
-                if y['Research & Development($)'] == '-' or y['Research & Development($)'] == '--':
-                    y['Research & Development($)'] = '0'
-            year0_dict = df_dict[-1]
-            year0_revenue = get_number_from_string(year0_dict['Revenue($)'])/1e6
-            year0_randd = get_number_from_string(year0_dict['Research & Development($)'])/1e6
-            year0_ebit = get_number_from_string(year0_dict['Pretax Income($)'])/1e6 + year0_randd
-            year0_capex = -round(get_number_from_string(year0_dict['Net Investing Cash Flow($)']))/1e6
-            year0_rgr = round(100 * ((get_number_from_string(df_dict[-2]['Revenue($)'])/get_number_from_string(df_dict[0]['Revenue($)'])) ** (1/(len(df_dict)-2)) - 1), 2)
-            # starting point same as past performance
-            cagr_2_5 = min(year0_rgr, 15)
-            opm_target = min(100 * mean([ (get_number_from_string(y['Pretax Income($)']) + get_number_from_string(y['Research & Development($)']) )/
-                                get_number_from_string(y['Revenue($)']) for y in df_dict]), 50 )
-            rgr_next = round(0.5 * cagr_2_5, 1)
-            opm_next = round(0.5 * opm_target, 1)
-            sales_to_cap = max(0.05, mean([get_number_from_string(y['Sales-to-Capital(%)']) for y in df_dict]) )
-
-            debt_book_value = (get_number_from_string(year0_dict['Longterm Debt($)']) or 0)/1e6
-            interest_expense_debt = (get_number_from_string(year0_dict['Interest Expense($)']) or 0)/1e6
-            cash = (get_number_from_string(year0_dict['Cash($)']) or 0)/1e6
-            shares_outstanding = get_number_from_string(year0_dict['Shares Outstanding'])/1e6
+            default_assumptions = get_default_assumptions(get_report_df(list(df_dict.values())[0]['fin_report_dict']))
+            year0_revenue, year0_randd, year0_capex, year0_ebit, year0_rgr, rgr_next, opm_next, cagr_2_5, opm_target, sales_to_cap, \
+                debt_book_value, interest_expense_debt, cash, shares_outstanding = default_assumptions.values()
         else:
             year0_revenue = safe_get_year0_revenue or 0
             year0_randd = dcf_store_dict.get(ticker).get('year0-randd.value') or 0
@@ -353,7 +358,7 @@ def get_cost_of_capital(df_dict, *args):
     try:
         df_dict_value = list(df_dict.values())[0]
         year0_dict = df_dict_value['fin_report_dict'][-1]
-        equity_market_value = get_number_from_string(year0_dict['Shares Outstanding']) * df_dict_value['stats_dict']['lastprice'] /1e6
+        equity_market_value = year0_dict['Shares Outstanding'] * df_dict_value['stats_dict']['lastprice'] /1e6
         beta = df_dict_value['stats_dict']['beta'] or 1
         debt_book_value, interest_expense_debt, average_maturity, pretax_cost_of_debt, convertible_debt_book_value, \
             convertible_market_value, convertible_debt_portion_market_value, preferred_num_shares, preferred_price_pershare, preferred_dividend_pershare, debt_value_op_leases, \
@@ -364,26 +369,10 @@ def get_cost_of_capital(df_dict, *args):
         dcf_store_dict = db.get(ticker+'-'+snapshot_uuid)
         safe_get_coc = json.loads(dcf_store_dict).get(ticker).get('cost-of-cap.value') if dcf_store_dict else None
         if 1 in live_analysis_mode or not safe_get_coc:
-            pretax_cost_of_debt /= 100  # convert to %
-            convertible_debt_portion_market_value /= 100
-
-            # =B19*(1-(1+B25)^(-B20))/B25+B18/(1+B25)^B20
-            debt_market_value = (interest_expense_debt * (1-(1+pretax_cost_of_debt) ** (-average_maturity)) / pretax_cost_of_debt) + (debt_book_value / ((1+pretax_cost_of_debt) ** average_maturity))
-            convertible_market_value = (interest_expense_debt * (1-(1+pretax_cost_of_debt) ** (-average_maturity)) / pretax_cost_of_debt) + (convertible_debt_book_value / ((1+pretax_cost_of_debt) ** average_maturity))
-            convertible_equity_portion_market_value = convertible_market_value * (1 - convertible_debt_portion_market_value)
-            # TODO: Why Convertible Equity not used in CoC?
-            total_debt = debt_market_value + convertible_debt_portion_market_value + debt_value_op_leases
-
-            cap_structure_list = [equity_market_value, preferred_num_shares * preferred_price_pershare, total_debt]
-            total_capital = sum(cap_structure_list)
-            wcc = [c/total_capital for c in cap_structure_list]
-            coc = [riskfree_rate + (beta * erp),
-                    100*preferred_dividend_pershare/preferred_price_pershare,
-                    100*pretax_cost_of_debt * (1-tax_rate/100)]
-            # Use 5 basis points over the Terminal Growth rate as Minimum CoC
-            min_coc = 0.05 + (riskfree_rate if terminal_growth_eq_riskfree_rate else terminal_growth_rate)
-
-            return [max(sum([wcc[c]*rate for c, rate in enumerate(coc)]), min_coc)]
+            return [get_cost_of_capital_rate(equity_market_value, beta, debt_book_value, interest_expense_debt, average_maturity, pretax_cost_of_debt,
+                        convertible_debt_book_value, convertible_market_value, convertible_debt_portion_market_value, preferred_num_shares,
+                        preferred_price_pershare, preferred_dividend_pershare, debt_value_op_leases, erp, tax_rate, riskfree_rate,
+                        terminal_growth_eq_riskfree_rate, terminal_growth_rate)]
         else:
             return [safe_get_coc]
     except Exception as e:
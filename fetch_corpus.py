@@ -0,0 +1,63 @@
+"""
+Corpus of recorded responses (MarketWatch statement pages, Yahoo quote pages, IEX JSON) to run the tests
+and the parser benchmarks offline. Record while running the tests online, then replay without network:
+
+    FETCH_CORPUS_MODE=record FETCH_CORPUS_DIR=tests/corpus python -m unittest tests.main_unittest
+    FETCH_CORPUS_DIR=tests/corpus python -m unittest tests.main_unittest
+
+A response is kept as <host>/<quoted path and query> in the corpus directory, the API token left out of the query.
+"""
+import os
+import json
+from pathlib import Path
+from urllib.parse import urlsplit, parse_qsl, urlencode, quote
+import requests
+
+CORPUS_DIR = os.environ.get('FETCH_CORPUS_DIR')
+CORPUS_MODE = os.environ.get('FETCH_CORPUS_MODE', 'replay') if CORPUS_DIR else None
+CORPUS_MODES = ('record', 'replay')
+if CORPUS_MODE not in CORPUS_MODES + (None,):
+    raise ValueError('Invalid FETCH_CORPUS_MODE: ' + CORPUS_MODE)
+
+def get_corpus_path(url, params=None, corpus_dir=None):
+    parts = urlsplit(url)
+    query = [(k, v) for k, v in parse_qsl(parts.query) + list((params or {}).items()) if k != 'token']
+    name = quote(parts.path.strip('/') + ('?' + urlencode(query) if query else ''), safe='') or 'index'
+    return Path(corpus_dir or CORPUS_DIR, parts.netloc, name)
+
+def is_replay():
+    return CORPUS_MODE == 'replay'
+
+def read_corpus(url, params=None):
+    """
+    Recorded response text of url, FileNotFoundError when url was not recorded
+    """
+    corpus_path = get_corpus_path(url, params)
+    if not corpus_path.exists():
+        raise FileNotFoundError('Not in the fetch corpus: ' + url)
+    return corpus_path.read_text(encoding='utf-8')
+
+def record_corpus(url, text, params=None):
+    """
+    Keep the response text of url when recording, no-op otherwise
+    """
+    if CORPUS_MODE == 'record':
+        corpus_path = get_corpus_path(url, params)
+        corpus_path.parent.mkdir(parents=True, exist_ok=True)
+        corpus_path.write_text(text, encoding='utf-8')
+
+def get_url_text(url, **kwargs):
+    """
+    requests.get(url).text through the corpus
+    """
+    if is_replay():
+        return read_corpus(url)
+    text = requests.get(url, **kwargs).text
+    record_corpus(url, text)
+    return text
+
+def get_corpus_json(url, params=None):
+    return json.loads(read_corpus(url, params))
+
+def record_corpus_json(url, data, params=None):
+    record_corpus(url, json.dumps(data), params)
@@ -1,107 +1,602 @@
+import os
+from collections import namedtuple
+import numpy as np
 import pandas as pd
-from __init__ import CURRENT_YEAR
-from get_fin_report import get_number_from_string, get_string_from_number
+from __init__ import CURRENT_YEAR, TIMEOUT_12HR
+from cache_utils import LRUResultCache
 
-# Assumptions for DCF:
-TERMINAL_YEAR_LENGTH = 10
+# Assumptions for DCF (defaults, both can be set per valuation):
+TERMINAL_YEAR_LENGTH = 10   # forecast horizon in years, the terminal year follows
+HIGH_GROWTH_YEARS = 5   # cagr_2_5 applies up to this year, then growth fades to the terminal growth rate
+# Order of the DCF engine inputs (ratios as decimals, amounts in $, shares in units)
+DCF_INPUT_KEYS = ('year0_revenue', 'year0_randd', 'year0_capex', 'year0_ebit', 'year0_rgr',
+                'rgr_next', 'opm_next', 'cagr_2_5', 'opm_target', 'sales_to_cap',
+                'tax_rate', 'marginal_tax_rate', 'terminal_growth_rate', 'cost_of_cap',
+                'convergence_year', 'probability_of_failure',
+                'cash', 'ltdebt', 'shares', 'minority_interests', 'nonoperating_assets', 'options_value')
+# Horizon settings of a valuation, scalars for a whole get_dcf_batch call
+HORIZON_KEYS = ('horizon', 'high_growth_years', 'closed_form_fade')
 
-def get_dcf_df(df_dict=[], rgr_next='5', opm_next='10', 
-                cagr_2_5='10', opm_target='20', sales_to_cap='1.2', 
-                    tax_rate='15', riskfree_rate='3', terminal_growth_rate='3',  
+def get_dcf_inputs(df_dict=[], rgr_next='5', opm_next='10',
+                cagr_2_5='10', opm_target='20', sales_to_cap='1.2',
+                    tax_rate='15', riskfree_rate='3', terminal_growth_rate='3',
                     cost_of_cap='8.5', run_dcf_button_clicks=None, *args):
     """
-    Calculate the Discounted Cash Flow Outputs and return a df with the table information
+    Convert the dcf_valuation callback arguments (UI units) into the DCF engine inputs keyed by DCF_INPUT_KEYS
+    and the horizon settings keyed by HORIZON_KEYS
     """
-    last_price = list(df_dict.values())[0]['stats_dict']['lastprice']
-
-    rgr_next = float(rgr_next)/100
-    opm_next = float(opm_next)/100
-    cagr_2_5 = float(cagr_2_5)/100
-    opm_target = float(opm_target)/100
-    tax_rate = float(tax_rate)/100
-    riskfree_rate = float(riskfree_rate)/100
-    cost_of_cap = float(cost_of_cap)/100
-    sales_to_cap = float(sales_to_cap)
-
-    # From dynamic updates of update_current_year_values
-    year0_revenue = args[0]*1e6
-    year0_randd = args[1]*1e6
-    year0_capex = args[2]*1e6
-    year0_ebit = args[3]*1e6
-    year0_rgr = args[4]/100
-    year0_cash = args[5]*1e6
-    year0_ltdebt = args[6]*1e6
-    year0_shares = args[7]*1e6
-    minority_interests = args[8]*1e6
-    nonoperating_assets = args[9]*1e6
-    options_value = args[10]*1e6
     # From dynamic updates of user input
-    convergence_year = args[11]
-    marginal_tax_rate = args[12]/100
-    probability_of_failure = args[13]/100
     terminal_growth_eq_riskfree_rate = args[14]
-
     if terminal_growth_eq_riskfree_rate:
         terminal_growth_rate = riskfree_rate
-    else:
-        terminal_growth_rate = float(terminal_growth_rate)/100
-    
-    delta_rate_late_stage = (cagr_2_5 - terminal_growth_rate) / (TERMINAL_YEAR_LENGTH-5)
-
-    year0_margin = year0_ebit/year0_revenue
-    year0_ebitlesstax = (year0_ebit) * (1-tax_rate)
-    year0_reinvestment = min((year0_revenue * year0_rgr / sales_to_cap), year0_capex)
-    year0_fcf = year0_ebitlesstax - year0_reinvestment
-    year0_randd_to_revenue = year0_randd/year0_revenue
-
-    dcftable = {
-        'Revenue($)': [year0_revenue],
-        'Revenue Growth(%)': [year0_rgr, rgr_next] + [cagr_2_5] * 4 + 
-                    [cagr_2_5-(delta_rate_late_stage * p) for p in range (1, TERMINAL_YEAR_LENGTH-5+1)] + [terminal_growth_rate],
-        'EBIT+R&D($)': [year0_ebit],
-        'Operating Margin(%)': [year0_margin, opm_next] + 
-                    [opm_target if p>convergence_year else opm_target-((opm_target-year0_margin)/convergence_year)*(convergence_year-p) for p in range (2, TERMINAL_YEAR_LENGTH+2)],
-        'Tax Rate(%)': [tax_rate] * 6 + [tax_rate + (marginal_tax_rate - tax_rate) * p/5 for p in range(1, TERMINAL_YEAR_LENGTH-5+1)] + [marginal_tax_rate],
-        'EBIT(1-T)($)': [year0_ebitlesstax],
-        'Reinvestment($)': [year0_reinvestment],
-        'FCF($)': [year0_fcf],
-        'CDF(%)': [1],
-        'PV_FCF($)': [year0_fcf * 1]
+    # Horizon settings come last, callers without them get the defaults
+    horizon = int(args[17]) if len(args) > 17 and args[17] else TERMINAL_YEAR_LENGTH
+    high_growth_years = min(int(args[18]) if len(args) > 18 and args[18] else HIGH_GROWTH_YEARS, horizon)
+    closed_form_fade = bool(args[19]) if len(args) > 19 else False
+
+    return {
+        # From dynamic updates of update_current_year_values
+        'year0_revenue': args[0]*1e6,
+        'year0_randd': args[1]*1e6,
+        'year0_capex': args[2]*1e6,
+        'year0_ebit': args[3]*1e6,
+        'year0_rgr': args[4]/100,
+        'rgr_next': float(rgr_next)/100,
+        'opm_next': float(opm_next)/100,
+        'cagr_2_5': float(cagr_2_5)/100,
+        'opm_target': float(opm_target)/100,
+        'sales_to_cap': float(sales_to_cap),
+        'tax_rate': float(tax_rate)/100,
+        'marginal_tax_rate': args[12]/100,
+        'terminal_growth_rate': float(terminal_growth_rate)/100,
+        'cost_of_cap': float(cost_of_cap)/100,
+        'convergence_year': args[11],
+        'probability_of_failure': args[13]/100,
+        'cash': args[5]*1e6,
+        'ltdebt': args[6]*1e6,
+        'shares': args[7]*1e6,
+        'minority_interests': args[8]*1e6,
+        'nonoperating_assets': args[9]*1e6,
+        'options_value': args[10]*1e6,
+        'horizon': horizon,
+        'high_growth_years': high_growth_years,
+        'closed_form_fade': closed_form_fade,
+    }
+
+def get_dcf_horizon(dcf_inputs):
+    """
+    Horizon settings of dcf_inputs as get_dcf_batch keyword arguments, defaults for inputs saved without them
+    """
+    return {'horizon': int(dcf_inputs.get('horizon', TERMINAL_YEAR_LENGTH)),
+            'high_growth_years': int(dcf_inputs.get('high_growth_years', HIGH_GROWTH_YEARS)),
+            'closed_form_fade': bool(dcf_inputs.get('closed_form_fade', False))}
+
+def get_default_assumptions(fin_report_df):
+    """
+    Year0 values and default GPE levers derived from the numeric financial report df (see get_report_df),
+    in the units of the dcf_valuation inputs (M$, %)
+    """
+    df = fin_report_df.copy()
+    df[['Research & Development($)', 'Longterm Debt($)', 'Interest Expense($)', 'Cash($)']] = \
+        df[['Research & Development($)', 'Longterm Debt($)', 'Interest Expense($)', 'Cash($)']].fillna(0)
+    year0_dict = df.iloc[-1]
+    year0_randd = year0_dict['Research & Development($)']/1e6
+    year0_rgr = round(100 * ((df['Revenue($)'].iloc[-2]/df['Revenue($)'].iloc[0]) ** (1/(len(df)-2)) - 1), 2)
+    # starting point same as past performance
+    cagr_2_5 = min(year0_rgr, 15)
+    opm_target = min(100 * ((df['Pretax Income($)'] + df['Research & Development($)'])/df['Revenue($)']).mean(), 50 )
+    return {
+        'year0_revenue': year0_dict['Revenue($)']/1e6,
+        'year0_randd': year0_randd,
+        'year0_capex': -round(year0_dict['Net Investing Cash Flow($)'])/1e6,
+        'year0_ebit': year0_dict['Pretax Income($)']/1e6 + year0_randd,
+        'year0_rgr': year0_rgr,
+        'rgr_next': round(0.5 * cagr_2_5, 1),
+        'opm_next': round(0.5 * opm_target, 1),
+        'cagr_2_5': cagr_2_5,
+        'opm_target': opm_target,
+        'sales_to_cap': max(0.05, df['Sales-to-Capital(%)'].mean() ),
+        'debt_book_value': year0_dict['Longterm Debt($)']/1e6,
+        'interest_expense_debt': year0_dict['Interest Expense($)']/1e6,
+        'cash': year0_dict['Cash($)']/1e6,
+        'shares_outstanding': year0_dict['Shares Outstanding']/1e6,
+    }
+
+def get_cost_of_capital_rate(equity_market_value, beta, debt_book_value, interest_expense_debt, average_maturity, pretax_cost_of_debt,
+        convertible_debt_book_value, convertible_market_value, convertible_debt_portion_market_value, preferred_num_shares,
+        preferred_price_pershare, preferred_dividend_pershare, debt_value_op_leases, erp, tax_rate, riskfree_rate,
+        terminal_growth_eq_riskfree_rate, terminal_growth_rate):
+    """
+    Weighted cost of capital (%) of equity, preferred stock and debt at market values, amounts in M$ and rates in %
+    """
+    pretax_cost_of_debt /= 100  # convert to %
+    convertible_debt_portion_market_value /= 100
+
+    # =B19*(1-(1+B25)^(-B20))/B25+B18/(1+B25)^B20
+    debt_market_value = (interest_expense_debt * (1-(1+pretax_cost_of_debt) ** (-average_maturity)) / pretax_cost_of_debt) + (debt_book_value / ((1+pretax_cost_of_debt) ** average_maturity))
+    convertible_market_value = (interest_expense_debt * (1-(1+pretax_cost_of_debt) ** (-average_maturity)) / pretax_cost_of_debt) + (convertible_debt_book_value / ((1+pretax_cost_of_debt) ** average_maturity))
+    convertible_equity_portion_market_value = convertible_market_value * (1 - convertible_debt_portion_market_value)
+    # TODO: Why Convertible Equity not used in CoC?
+    total_debt = debt_market_value + convertible_debt_portion_market_value + debt_value_op_leases
+
+    cap_structure_list = [equity_market_value, preferred_num_shares * preferred_price_pershare, total_debt]
+    total_capital = sum(cap_structure_list)
+    wcc = [c/total_capital for c in cap_structure_list]
+    coc = [riskfree_rate + (beta * erp),
+            100*preferred_dividend_pershare/preferred_price_pershare,
+            100*pretax_cost_of_debt * (1-tax_rate/100)]
+    # Use 5 basis points over the Terminal Growth rate as Minimum CoC
+    min_coc = 0.05 + (riskfree_rate if terminal_growth_eq_riskfree_rate else terminal_growth_rate)
+
+    return max(sum([wcc[c]*rate for c, rate in enumerate(coc)]), min_coc)
+
+# Hashable record of the DCF engine inputs, the key of a valuation result
+DCFInputs = namedtuple('DCFInputs', DCF_INPUT_KEYS + HORIZON_KEYS)
+
+def get_dcf_input_record(dcf_inputs):
+    """
+    Canonical DCFInputs record of the engine inputs: floats rounded to 10 significant digits,
+    so that UI strings, ints and float noise of the same value ('5', 5, 5.0000000001) are the same key
+    """
+    dcf_inputs = dict(dcf_inputs, **get_dcf_horizon(dcf_inputs))
+    return DCFInputs(**{k: float('%.10g' % float(dcf_inputs[k])) for k in DCF_INPUT_KEYS + HORIZON_KEYS})
+
+# Engine inputs by stage: the projection of the FCF rows, their discounting and the equity bridge to value per share
+PROJECTION_KEYS = ('year0_revenue', 'year0_randd', 'year0_capex', 'year0_ebit', 'year0_rgr',
+                'rgr_next', 'opm_next', 'cagr_2_5', 'opm_target', 'sales_to_cap',
+                'tax_rate', 'marginal_tax_rate', 'terminal_growth_rate', 'convergence_year')
+DISCOUNT_KEYS = ('cost_of_cap', 'probability_of_failure')
+BRIDGE_KEYS = ('cash', 'ltdebt', 'shares', 'minority_interests', 'nonoperating_assets', 'options_value')
+
+def get_dcf_batch(year0_revenue, year0_randd, year0_capex, year0_ebit, year0_rgr,
+                rgr_next, opm_next, cagr_2_5, opm_target, sales_to_cap,
+                tax_rate, marginal_tax_rate, terminal_growth_rate, cost_of_cap,
+                convergence_year, probability_of_failure,
+                cash, ltdebt, shares, minority_interests, nonoperating_assets, options_value,
+                horizon=TERMINAL_YEAR_LENGTH, high_growth_years=HIGH_GROWTH_YEARS, closed_form_fade=False):
+    """
+    Vectorized DCF engine: each input is a scalar or an array of N scenarios, broadcast against each other.
+    The horizon settings are scalars: see get_explicit_horizon for the number of projected years P.
+    Returns a dict of (N, P+2) arrays keyed by the DCF table columns and a dict of (N,) arrays of the DCF outputs
+    """
+    n_scenarios = np.broadcast(*[np.asarray(v) for v in (
+                year0_revenue, year0_randd, year0_capex, year0_ebit, year0_rgr,
+                rgr_next, opm_next, cagr_2_5, opm_target, sales_to_cap,
+                tax_rate, marginal_tax_rate, terminal_growth_rate, cost_of_cap,
+                convergence_year, probability_of_failure,
+                cash, ltdebt, shares, minority_interests, nonoperating_assets, options_value)]).size
+    explicit_horizon = get_explicit_horizon(horizon, high_growth_years, closed_form_fade)
+    dcftable = get_dcf_projection(year0_revenue, year0_randd, year0_capex, year0_ebit, year0_rgr,
+                rgr_next, opm_next, cagr_2_5, opm_target, sales_to_cap,
+                tax_rate, marginal_tax_rate, terminal_growth_rate, convergence_year,
+                explicit_horizon, high_growth_years)
+    terminal_factor = get_fade_terminal_factor(np.atleast_1d(cagr_2_5), np.atleast_1d(terminal_growth_rate), horizon-explicit_horizon)
+    cdf, pv_fcf, dcf_output = get_dcf_discounting(dcftable['FCF($)'], np.atleast_1d(terminal_growth_rate),
+                np.atleast_1d(cost_of_cap), np.atleast_1d(probability_of_failure), terminal_factor)
+    dcf_output.update(get_dcf_equity_bridge(dcf_output['value_operating_assets'],
+                cash, ltdebt, shares, minority_interests, nonoperating_assets, options_value))
+    dcftable['CDF(%)'] = cdf
+    dcftable['PV_FCF($)'] = pv_fcf
+    return ({k: np.broadcast_to(v, (n_scenarios, explicit_horizon+2)) for k, v in dcftable.items()},
+            {k: np.broadcast_to(v, (n_scenarios,)) for k, v in dcf_output.items()})
+
+def get_explicit_horizon(horizon=TERMINAL_YEAR_LENGTH, high_growth_years=HIGH_GROWTH_YEARS, closed_form_fade=False):
+    """
+    Number of years projected row by row: the horizon, or only the high growth years when the fade period
+    is approximated in closed form (see get_fade_terminal_factor)
+    """
+    horizon, high_growth_years = int(horizon), int(high_growth_years)
+    if not 1 <= high_growth_years <= horizon:
+        raise ValueError(f'High growth years ({high_growth_years}) must be between 1 and the horizon ({horizon})')
+    return high_growth_years if closed_form_fade else horizon
+
+def get_fade_terminal_factor(cagr_2_5, terminal_growth_rate, fade_years):
+    """
+    Closed-form value of a fade period (H-model of Fuller & Hsia): growth falling linearly from cagr_2_5 to
+    terminal_growth_rate over fade_years multiplies the terminal value at the start of the fade by
+    1 + (fade_years/2) * (cagr_2_5-terminal_growth_rate) / (1+terminal_growth_rate). 1 with no fade years.
+    An approximation of the explicit projection: the margin convergence and reinvestment of the fade years are
+    not projected, so values differ (e.g. 68.5 vs 73.0 per share with a 10 year horizon and 5 high growth years)
+    """
+    return 1 + (fade_years/2) * (cagr_2_5-terminal_growth_rate) / (1+terminal_growth_rate)
+
+def get_dcf_projection(year0_revenue, year0_randd, year0_capex, year0_ebit, year0_rgr,
+                rgr_next, opm_next, cagr_2_5, opm_target, sales_to_cap,
+                tax_rate, marginal_tax_rate, terminal_growth_rate, convergence_year,
+                horizon=TERMINAL_YEAR_LENGTH, high_growth_years=HIGH_GROWTH_YEARS):
+    """
+    Projection stage of the DCF engine: the (N, horizon+2) rows from Revenue to FCF,
+    N is the number of distinct projection scenarios after broadcasting these inputs only.
+    Growth is cagr_2_5 from year 2 to high_growth_years, then fades linearly to terminal_growth_rate by the horizon
+    """
+    (year0_revenue, year0_randd, year0_capex, year0_ebit, year0_rgr,
+        rgr_next, opm_next, cagr_2_5, opm_target, sales_to_cap,
+        tax_rate, marginal_tax_rate, terminal_growth_rate, convergence_year) = \
+            [np.atleast_1d(a) for a in np.broadcast_arrays(*[np.asarray(v, dtype=float) for v in (
+                year0_revenue, year0_randd, year0_capex, year0_ebit, year0_rgr,
+                rgr_next, opm_next, cagr_2_5, opm_target, sales_to_cap,
+                tax_rate, marginal_tax_rate, terminal_growth_rate, convergence_year)])]
+    n_scenarios = year0_revenue.shape[0]
+    horizon, high_growth_years = int(horizon), int(high_growth_years)
+    n_periods = horizon+2  # year0, explicit forecast years and the terminal year
+    fade_years = horizon-high_growth_years
+    fade_periods = np.arange(1, fade_years+1)
+    periods = np.arange(1, n_periods)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        delta_rate_late_stage = (cagr_2_5 - terminal_growth_rate) / max(fade_years, 1)
+        year0_margin = year0_ebit/year0_revenue
+        year0_randd_to_revenue = year0_randd/year0_revenue
+
+        revenue_growth = np.empty((n_scenarios, n_periods))
+        revenue_growth[:, 0] = year0_rgr
+        revenue_growth[:, 1] = rgr_next
+        revenue_growth[:, 2:high_growth_years+1] = cagr_2_5[:, None]
+        revenue_growth[:, high_growth_years+1:-1] = cagr_2_5[:, None] - delta_rate_late_stage[:, None] * fade_periods
+        revenue_growth[:, -1] = terminal_growth_rate
+
+        operating_margin = np.empty((n_scenarios, n_periods))
+        operating_margin[:, 0] = year0_margin
+        operating_margin[:, 1] = opm_next
+        convergence_periods = np.arange(2, n_periods)
+        operating_margin[:, 2:] = np.where(convergence_periods > convergence_year[:, None], opm_target[:, None],
+                    opm_target[:, None] - ((opm_target-year0_margin)/convergence_year)[:, None] * (convergence_year[:, None]-convergence_periods))
+
+        tax = np.empty((n_scenarios, n_periods))
+        tax[:, :high_growth_years+1] = tax_rate[:, None]
+        tax[:, high_growth_years+1:-1] = tax_rate[:, None] + (marginal_tax_rate - tax_rate)[:, None] * fade_periods/max(fade_years, 1)
+        tax[:, -1] = marginal_tax_rate
+
+        revenue = np.empty((n_scenarios, n_periods))
+        revenue[:, 0] = year0_revenue
+        revenue[:, 1:] = year0_revenue[:, None] * np.cumprod(1+revenue_growth[:, 1:], axis=1)
+
+        ebit = np.empty((n_scenarios, n_periods))
+        ebit[:, 0] = year0_ebit
+        ebit[:, 1:] = revenue[:, 1:] * (operating_margin[:, 1:] + year0_randd_to_revenue[:, None])
+
+        ebit_less_tax = np.empty((n_scenarios, n_periods))
+        ebit_less_tax[:, 0] = year0_ebit * (1-tax_rate)
+        ebit_less_tax[:, 1:] = ebit[:, 1:] * (1-tax[:, 1:])
+
+        reinvestment = np.empty((n_scenarios, n_periods))
+        reinvestment[:, 0] = np.minimum(year0_revenue * year0_rgr / sales_to_cap, year0_capex)
+        capitalized_randd = year0_randd_to_revenue[:, None] * revenue[:, 1:] * np.maximum(1-0.05*periods, 0)    # fully amortized after 20 years
+        reinvestment[:, 1:] = np.where(revenue_growth[:, 1:] > 0,
+                    np.diff(revenue, axis=1)/sales_to_cap[:, None] + capitalized_randd, capitalized_randd)
+
+    return {
+        'Revenue($)': revenue,
+        'Revenue Growth(%)': revenue_growth,
+        'EBIT+R&D($)': ebit,
+        'Operating Margin(%)': operating_margin,
+        'Tax Rate(%)': tax,
+        'EBIT(1-T)($)': ebit_less_tax,
+        'Reinvestment($)': reinvestment,
+        'FCF($)': ebit_less_tax - reinvestment,
     }
-    for period in range(1, TERMINAL_YEAR_LENGTH+2):
-        dcftable['Revenue($)'].append(dcftable['Revenue($)'][period-1] * (1+dcftable['Revenue Growth(%)'][period]))
-        dcftable['EBIT+R&D($)'].append(dcftable['Revenue($)'][period] * (dcftable['Operating Margin(%)'][period] + year0_randd_to_revenue))
-        dcftable['EBIT(1-T)($)'].append(dcftable['EBIT+R&D($)'][period] * (1 - dcftable['Tax Rate(%)'][period]))
-        capitalized_randd = year0_randd_to_revenue * dcftable['Revenue($)'][period] * (1-0.05*period)
-        dcftable['Reinvestment($)'].append((dcftable['Revenue($)'][period]-dcftable['Revenue($)'][period-1])/sales_to_cap + (capitalized_randd) if dcftable['Revenue Growth(%)'][period]>0 else capitalized_randd)
-        dcftable['FCF($)'].append(dcftable['EBIT(1-T)($)'][period] - dcftable['Reinvestment($)'][period])
-        dcftable['CDF(%)'].append(dcftable['CDF(%)'][period-1] / (1+cost_of_cap))
-        dcftable['PV_FCF($)'].append(dcftable['FCF($)'][period] * dcftable['CDF(%)'][period])
-    
-    dcf_output_dict = {}
-    dcf_output_dict['terminal_FCF'] = dcftable['FCF($)'][TERMINAL_YEAR_LENGTH+1]
-    dcf_output_dict['terminal_value'] = dcf_output_dict['terminal_FCF'] / (cost_of_cap - terminal_growth_rate)
-    dcf_output_dict['PV_terminal_value'] = dcf_output_dict['terminal_value'] * dcftable['CDF(%)'][TERMINAL_YEAR_LENGTH]
-    dcf_output_dict['PV_sum'] = sum(dcftable['PV_FCF($)'][1:TERMINAL_YEAR_LENGTH+1]) + dcf_output_dict['PV_terminal_value']
-    dcf_output_dict['value_operating_assets'] = (1-probability_of_failure) * dcf_output_dict['PV_sum'] + probability_of_failure * (dcf_output_dict['PV_sum']/2)
-    dcf_output_dict['book_value_LTdebt'] = year0_ltdebt
-    dcf_output_dict['cash'] = year0_cash
-
-    dcf_output_dict['equity_value'] = dcf_output_dict['value_operating_assets'] - dcf_output_dict['book_value_LTdebt'] - minority_interests + dcf_output_dict['cash'] + nonoperating_assets
-    dcf_output_dict['common_equity_value'] = dcf_output_dict['equity_value'] - options_value
-    dcf_output_dict['outstanding_shares'] = year0_shares
-    dcf_output_dict['estimated_value_per_share'] = dcf_output_dict['common_equity_value']/dcf_output_dict['outstanding_shares']
-    dcf_output_dict['last_price'] = last_price
-
-    df = pd.DataFrame(dcftable)
-    for col in list(df.columns):
-        if '%' in col:  # scale up ratio by 100 if unit is %
-            df.loc[:, col] *= 100
-    df = df.applymap(get_string_from_number)
-    
-    df['Year'] = range(CURRENT_YEAR, CURRENT_YEAR+TERMINAL_YEAR_LENGTH+2)
-    # df.set_index('Year', inplace=True)
-    column_list = list(df.columns)  # column 'Year' move to be first
-    df = df.reindex(columns=[column_list[-1]] + column_list[:-1], copy=False)
-    
+
+def get_dcf_discounting(fcf, terminal_growth_rate, cost_of_cap, probability_of_failure, terminal_factor=1):
+    """
+    Discounting stage of the DCF engine: fcf has the periods on its last axis, the last one is the terminal year,
+    the leading axes broadcast against the (array) rates, e.g. fcf[:, None, :] with cost_of_cap[None, :] for a grid.
+    terminal_factor scales the terminal value (see get_fade_terminal_factor).
+    Returns the discount factors, the PV of the FCF rows and a dict of the outputs up to value_operating_assets
+    """
+    terminal_growth_rate, cost_of_cap, probability_of_failure = [np.asarray(v, dtype=float) for v in (
+                terminal_growth_rate, cost_of_cap, probability_of_failure)]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cdf = (1+cost_of_cap[..., None]) ** -np.arange(fcf.shape[-1])
+        pv_fcf = fcf * cdf
+        dcf_output = {}
+        dcf_output['terminal_FCF'] = fcf[..., -1]
+        dcf_output['terminal_value'] = terminal_factor * dcf_output['terminal_FCF'] / (cost_of_cap - terminal_growth_rate)
+        dcf_output['PV_terminal_value'] = dcf_output['terminal_value'] * cdf[..., -2]
+        dcf_output['PV_sum'] = pv_fcf[..., 1:-1].sum(axis=-1) + dcf_output['PV_terminal_value']
+        dcf_output['value_operating_assets'] = (1-probability_of_failure) * dcf_output['PV_sum'] + probability_of_failure * (dcf_output['PV_sum']/2)
+    return cdf, pv_fcf, dcf_output
+
+def get_dcf_equity_bridge(value_operating_assets, cash, ltdebt, shares, minority_interests, nonoperating_assets, options_value):
+    """
+    Equity bridge stage of the DCF engine: from the value of operating assets to the estimated value per share
+    """
+    value_operating_assets, cash, ltdebt, shares, minority_interests, nonoperating_assets, options_value = [np.asarray(v, dtype=float) for v in (
+                value_operating_assets, cash, ltdebt, shares, minority_interests, nonoperating_assets, options_value)]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dcf_output = {}
+        dcf_output['book_value_LTdebt'] = ltdebt
+        dcf_output['cash'] = cash
+        dcf_output['equity_value'] = value_operating_assets - ltdebt - minority_interests + cash + nonoperating_assets
+        dcf_output['common_equity_value'] = dcf_output['equity_value'] - options_value
+        dcf_output['outstanding_shares'] = shares
+        dcf_output['estimated_value_per_share'] = dcf_output['common_equity_value']/shares
+    return dcf_output
+
+def get_dcf_df(df_dict=[], rgr_next='5', opm_next='10',
+                cagr_2_5='10', opm_target='20', sales_to_cap='1.2',
+                    tax_rate='15', riskfree_rate='3', terminal_growth_rate='3',
+                    cost_of_cap='8.5', run_dcf_button_clicks=None, *args):
+    """
+    Calculate the Discounted Cash Flow Outputs and return a df with the table information
+    """
+    last_price = list(df_dict.values())[0]['stats_dict']['lastprice']
+    dcf_inputs = get_dcf_inputs(df_dict, rgr_next, opm_next, cagr_2_5, opm_target, sales_to_cap,
+                                tax_rate, riskfree_rate, terminal_growth_rate, cost_of_cap, run_dcf_button_clicks, *args)
+    df, dcf_output_dict = dcf_cache.get_or_compute(get_dcf_input_record(dcf_inputs), get_dcf_result)
+
+    return df, dict(dcf_output_dict, last_price=last_price)
+
+def get_dcf_result(dcf_record):
+    """
+    Run the DCF engine for a single DCFInputs record: the numeric DCF table df and the dict of the DCF outputs.
+    The projection and discounting stages are cached on their own inputs, so a change of only the discounting
+    or equity bridge inputs (e.g. a cost of capital slider) reuses the projected FCF rows
+    """
+    horizon = get_dcf_horizon(dcf_record._asdict())
+    explicit_horizon = get_explicit_horizon(**horizon)
+    projection_key = tuple(getattr(dcf_record, k) for k in PROJECTION_KEYS + HORIZON_KEYS)
+    dcftable = dcf_projection_cache.get_or_compute(projection_key,
+                    lambda key: get_dcf_projection(**{k: getattr(dcf_record, k) for k in PROJECTION_KEYS},
+                                    horizon=explicit_horizon, high_growth_years=horizon['high_growth_years']))
+    discounting_key = projection_key + tuple(getattr(dcf_record, k) for k in DISCOUNT_KEYS)
+    cdf, pv_fcf, dcf_output = dcf_discounting_cache.get_or_compute(discounting_key,
+                    lambda key: get_dcf_discounting(dcftable['FCF($)'], np.atleast_1d(dcf_record.terminal_growth_rate),
+                                    np.atleast_1d(dcf_record.cost_of_cap), np.atleast_1d(dcf_record.probability_of_failure),
+                                    get_fade_terminal_factor(dcf_record.cagr_2_5, dcf_record.terminal_growth_rate,
+                                                                horizon['horizon']-explicit_horizon)))
+    dcf_output = dict(dcf_output, **get_dcf_equity_bridge(dcf_output['value_operating_assets'],
+                    *[getattr(dcf_record, k) for k in BRIDGE_KEYS]))
+
+    dcf_output_dict = {k: float(np.ravel(v)[0]) for k, v in dcf_output.items()}
+
+    # numbers are only formatted for display, column 'Year' first
+    df = pd.DataFrame({'Year': np.arange(CURRENT_YEAR, CURRENT_YEAR+explicit_horizon+2),
+                        **{k: v[0] for k, v in dcftable.items()}, 'CDF(%)': cdf[0], 'PV_FCF($)': pv_fcf[0]})
+
     return df, dcf_output_dict
+
+def get_dcf_summary_df(dcf_df, high_growth_years=HIGH_GROWTH_YEARS, max_rows=16):
+    """
+    Rows of the DCF table df to display for long horizons: the years up to the end of the high growth period,
+    then evenly spaced fade years, always with the last forecast year and the terminal year
+    """
+    n_rows = len(dcf_df)
+    if n_rows <= max_rows:
+        return dcf_df
+    head = np.arange(min(int(high_growth_years)+1, max_rows//2))
+    fade = np.linspace(len(head), n_rows-2, max_rows-len(head)-1).round().astype(int)
+    return dcf_df.iloc[np.unique(np.concatenate([head, fade, [n_rows-1]]))]
+
+DCF_CACHE_SIZE = 256    # valuations kept per worker
+DCF_CACHE_TIMEOUT = TIMEOUT_12HR
+
+class DCFResultCache(LRUResultCache):
+    """
+    LRUResultCache of DCF results (df, dcf_output_dict) keyed on DCFInputs records, shared by the callbacks of a worker,
+    also used for the engine stages keyed on the tuple of their inputs. With use_redis, workers share their valuations
+    """
+    def __init__(self, maxsize=DCF_CACHE_SIZE, use_redis=False, timeout=DCF_CACHE_TIMEOUT, redis_prefix='dcf-result-'):
+        super().__init__(maxsize, use_redis, timeout, redis_prefix, name='DCF result')
+
+dcf_cache = DCFResultCache(use_redis=os.environ.get('DCF_CACHE_REDIS', 'False').lower() in ('1', 'true'))
+# Stage caches of get_dcf_result, per worker only: the projected rows and the discounted outputs
+dcf_projection_cache = DCFResultCache(maxsize=64)
+dcf_discounting_cache = DCFResultCache()
+
+# Assumptions that can be drawn from a distribution in the Monte Carlo valuation mode
+SIMULATION_KEYS = ('rgr_next', 'cagr_2_5', 'opm_target', 'sales_to_cap', 'cost_of_cap')
+
+def get_simulation_distributions(dcf_inputs, dist='normal', spread=20, keys=SIMULATION_KEYS):
+    """
+    Build a distribution spec for each assumption in keys around its dcf_inputs value,
+    spread is the relative width (%) of the distribution: std for normal, +/- range for triangular and uniform
+    """
+    distributions = {}
+    for k in keys:
+        base = dcf_inputs[k]
+        width = abs(base) * spread/100
+        if dist == 'normal':
+            distributions[k] = {'dist': 'normal', 'mean': base, 'std': width}
+        elif dist == 'triangular':
+            distributions[k] = {'dist': 'triangular', 'low': base-width, 'mode': base, 'high': base+width}
+        elif dist == 'uniform':
+            distributions[k] = {'dist': 'uniform', 'low': base-width, 'high': base+width}
+        else:
+            raise ValueError('Invalid distribution for simulation: ' + dist)
+    return distributions
+
+def get_dcf_simulation(dcf_inputs, distributions, n_draws=50000, seed=None, correlation=None,
+                        percentiles=(5, 10, 25, 50, 75, 90, 95), bins=50, price=None):
+    """
+    Monte Carlo DCF valuation: draw the assumptions in distributions (see get_simulation_distributions),
+    keep the other dcf_inputs fixed and value all the draws in one get_dcf_batch call.
+    correlation is an optional matrix over the keys of distributions (in order), applied with a Gaussian copula.
+    The seed used is returned so that a run can be reproduced, and with a price the probability that value exceeds it.
+    """
+    if seed is None:
+        seed = int(np.random.SeedSequence().generate_state(1)[0])
+    rng = np.random.default_rng(seed)
+    keys = list(distributions)
+    z = rng.standard_normal((n_draws, len(keys)))
+    if correlation is not None:
+        z = z @ np.linalg.cholesky(np.asarray(correlation, dtype=float)).T
+    u = None
+    draws = dict(dcf_inputs)
+    for i, k in enumerate(keys):
+        spec = distributions[k]
+        if spec['dist'] == 'normal':
+            draws[k] = spec.get('mean', dcf_inputs[k]) + spec['std'] * z[:, i]
+            continue
+        if u is None:   # uniform marginals of the (correlated) normal draws
+            u = _get_normal_cdf(z)
+        low, high = spec['low'], spec['high']
+        if spec['dist'] == 'uniform':
+            draws[k] = low + (high-low) * u[:, i]
+        elif spec['dist'] == 'triangular':
+            mode = spec.get('mode', dcf_inputs[k])
+            c = (mode-low)/(high-low) if high > low else 0.5
+            draws[k] = np.where(u[:, i] < c, low + np.sqrt(u[:, i] * (high-low) * (mode-low)),
+                                high - np.sqrt((1-u[:, i]) * (high-low) * (high-mode)))
+        else:
+            raise ValueError('Invalid distribution for simulation: ' + spec['dist'])
+
+    _, dcf_output = get_dcf_batch(**draws)
+    values = dcf_output['estimated_value_per_share']
+    # draws with cost of capital at or below terminal growth have no meaningful terminal value
+    valid = np.isfinite(values) & (np.broadcast_to(draws['cost_of_cap'], values.shape) > np.broadcast_to(draws['terminal_growth_rate'], values.shape))
+    values = values[valid]
+    if not values.size:
+        raise ValueError('No valid draws in simulation, check the assumption distributions')
+    # clip the histogram to the 1st-99th percentile, the tails of a DCF distribution are very long
+    counts, bin_edges = np.histogram(values, bins=bins, range=tuple(np.percentile(values, [1, 99])))
+    simulation = {
+        'seed': seed,
+        'n_draws': n_draws,
+        'n_valid': int(values.size),
+        'mean': float(values.mean()),
+        'std': float(values.std()),
+        'percentiles': {p: float(v) for p, v in zip(percentiles, np.percentile(values, percentiles))},
+        'histogram': {'counts': counts.tolist(), 'bin_edges': bin_edges.tolist()},
+    }
+    if price is not None:
+        simulation['prob_above_price'] = float((values > price).mean())
+    return simulation
+
+def _get_normal_cdf(z):
+    # numpy has no erf, use the Abramowitz & Stegun 7.1.26 approximation (abs error < 1.5e-7)
+    x = np.abs(z)/np.sqrt(2)
+    t = 1/(1 + 0.3275911*x)
+    erf = 1 - t*(0.254829592 + t*(-0.284496736 + t*(1.421413741 + t*(-1.453152027 + t*1.061405429)))) * np.exp(-x*x)
+    return 0.5 * (1 + np.sign(z)*erf)
+
+# Default step (in engine units) of each sensitivity axis and the +/- swing of each tornado bar
+SENSITIVITY_STEPS = {'cost_of_cap': 0.005, 'terminal_growth_rate': 0.0025, 'cagr_2_5': 0.01, 'opm_target': 0.025}
+TORNADO_SWINGS = {'rgr_next': 0.05, 'cagr_2_5': 0.03, 'opm_target': 0.05, 'sales_to_cap': 0.25,
+                'cost_of_cap': 0.01, 'terminal_growth_rate': 0.005, 'tax_rate': 0.05}
+
+def get_sensitivity_axis(base, step, n_steps=4):
+    """
+    Axis values for a sensitivity grid: base +/- n_steps * step
+    """
+    return base + step * np.arange(-n_steps, n_steps+1)
+
+def get_dcf_sensitivity(dcf_inputs, x_key, x_values, y_key, y_values):
+    """
+    Two-way sensitivity of the estimated value per share over two engine inputs in one batched evaluation.
+    Returns a (len(y_values), len(x_values)) matrix. An axis that is not a projection input
+    (e.g. cost_of_cap) reuses the projected FCF rows, so the projection only runs over the other axis.
+    """
+    x_values, y_values = np.asarray(x_values, dtype=float), np.asarray(y_values, dtype=float)
+    grid = {x_key: x_values[None, :], y_key: y_values[:, None]}
+    horizon = get_dcf_horizon(dcf_inputs)
+    explicit_horizon = get_explicit_horizon(**horizon)
+    projection_axes = [k for k in (y_key, x_key) if k in PROJECTION_KEYS]
+    projection_inputs = {k: dcf_inputs[k] for k in PROJECTION_KEYS}
+    projection_inputs.update(horizon=explicit_horizon, high_growth_years=horizon['high_growth_years'])
+    if projection_axes:
+        mesh = np.broadcast_arrays(*[grid[k] for k in projection_axes])
+        projection_inputs.update({k: m.ravel() for k, m in zip(projection_axes, mesh)})
+        projection_shape = mesh[0].shape
+    else:
+        projection_shape = (1, 1)
+    fcf = get_dcf_projection(**projection_inputs)['FCF($)']
+    fcf = fcf.reshape(projection_shape + fcf.shape[-1:])
+
+    rates = {k: grid.get(k, dcf_inputs[k]) for k in ('terminal_growth_rate',) + DISCOUNT_KEYS}
+    terminal_factor = get_fade_terminal_factor(grid.get('cagr_2_5', dcf_inputs['cagr_2_5']), rates['terminal_growth_rate'],
+                                                horizon['horizon']-explicit_horizon)
+    _, _, dcf_output = get_dcf_discounting(fcf, terminal_factor=terminal_factor, **rates)
+    bridge = get_dcf_equity_bridge(dcf_output['value_operating_assets'], **{k: grid.get(k, dcf_inputs[k]) for k in BRIDGE_KEYS})
+    return np.broadcast_to(bridge['estimated_value_per_share'], (len(y_values), len(x_values)))
+
+def get_dcf_tornado(dcf_inputs, swings=TORNADO_SWINGS):
+    """
+    Single-variable swings of the estimated value per share: each input in swings is moved down and up by its swing
+    with the others fixed, all in one get_dcf_batch call. Returns the base value and a list of
+    (key, low value, high value) sorted by the size of the swing, largest first.
+    """
+    keys = list(swings)
+    scenarios = {k: np.full(2*len(keys)+1, dcf_inputs[k], dtype=float) for k in DCF_INPUT_KEYS}   # last one is the base
+    for i, k in enumerate(keys):
+        scenarios[k][2*i] -= swings[k]
+        scenarios[k][2*i+1] += swings[k]
+    values = get_dcf_batch(**scenarios, **get_dcf_horizon(dcf_inputs))[1]['estimated_value_per_share']
+    base_value = float(values[-1])
+    values = values[:-1].reshape(len(keys), 2)
+    tornado = sorted(zip(keys, values[:, 0].tolist(), values[:, 1].tolist()), key=lambda t: -abs(t[2]-t[1]))
+    return base_value, tornado
+
+# Reverse DCF: the inputs that can be solved for from the market price and their search bracket (engine units)
+IMPLIED_BRACKETS = {'cagr_2_5': (-0.5, 1.0), 'opm_target': (-0.5, 1.0), 'cost_of_cap': (0.0, 1.0)}
+
+def get_dcf_implied(dcf_inputs, price, key='cagr_2_5', bracket=None, n_grid=32, tol=1e-6, max_iter=50):
+    """
+    Reverse DCF: the value of dcf_inputs[key] at which the estimated value per share equals price, the other inputs fixed.
+    dcf_inputs is one dict of engine inputs, or a list of them (a watchlist) with price a list of prices.
+    All valuations are scanned over the bracket in one batch for the first sign change of (value - price),
+    then refined together by a batched bisection. NaN where the price is not reached within the bracket.
+    """
+    inputs_list = [dcf_inputs] if isinstance(dcf_inputs, dict) else list(dcf_inputs)
+    n_valuations = len(inputs_list)
+    batch = {k: np.array([inputs[k] for inputs in inputs_list], dtype=float) for k in DCF_INPUT_KEYS}
+    prices = np.broadcast_to(np.asarray(price, dtype=float), (n_valuations,))
+    # valuations with the same horizon settings are evaluated in one get_dcf_batch call
+    horizons = [tuple(get_dcf_horizon(inputs).values()) for inputs in inputs_list]
+    horizon_groups = [(dict(zip(HORIZON_KEYS, h)), np.flatnonzero([g == h for g in horizons])) for h in set(horizons)]
+    lo, hi = [np.full(n_valuations, b, dtype=float) for b in (bracket or IMPLIED_BRACKETS[key])]
+    if key == 'cost_of_cap':    # the terminal value needs cost_of_cap > terminal_growth_rate
+        lo = np.maximum(lo, batch['terminal_growth_rate'] + 1e-4)
+    rows = np.arange(n_valuations)
+
+    grid = lo[:, None] + (hi-lo)[:, None] * np.linspace(0, 1, n_grid+1)
+    excess = _get_values_per_share(batch, horizon_groups, key, grid) - prices[:, None]
+    with np.errstate(invalid='ignore'):
+        sign_change = (np.signbit(excess[:, :-1]) != np.signbit(excess[:, 1:])) \
+                        & np.isfinite(excess[:, :-1]) & np.isfinite(excess[:, 1:])
+    found = sign_change.any(axis=1)
+    first = sign_change.argmax(axis=1)
+    lo, hi, excess_lo = grid[rows, first], grid[rows, first+1], excess[rows, first]
+
+    for _ in range(max_iter):
+        if np.all(hi-lo < tol):
+            break
+        mid = (lo+hi)/2
+        excess_mid = _get_values_per_share(batch, horizon_groups, key, mid) - prices
+        move_lo = np.signbit(excess_mid) == np.signbit(excess_lo)
+        lo, excess_lo, hi = np.where(move_lo, mid, lo), np.where(move_lo, excess_mid, excess_lo), np.where(move_lo, hi, mid)
+
+    implied = np.where(found, (lo+hi)/2, np.nan)
+    return float(implied[0]) if isinstance(dcf_inputs, dict) else implied
+
+def _get_values_per_share(batch, horizon_groups, key, values):
+    # estimated value per share of each valuation in batch (arrays of n) at its row of values for key, shape (n,) or (n, m)
+    n_values = values.size // len(values)
+    values_per_share = np.empty(values.shape)
+    for horizon, rows in horizon_groups:
+        scenarios = {k: np.repeat(v[rows], n_values) for k, v in batch.items()}
+        scenarios[key] = values[rows].ravel()
+        values_per_share[rows] = get_dcf_batch(**scenarios, **horizon)[1]['estimated_value_per_share'].reshape(values[rows].shape)
+    return values_per_share
+
+# Engine input derived from each default assumption (see get_default_assumptions) and its scale from UI units
+BACKTEST_ASSUMPTIONS = {'year0_revenue': ('year0_revenue', 1e6), 'year0_randd': ('year0_randd', 1e6),
+                        'year0_capex': ('year0_capex', 1e6), 'year0_ebit': ('year0_ebit', 1e6), 'year0_rgr': ('year0_rgr', 0.01),
+                        'rgr_next': ('rgr_next', 0.01), 'opm_next': ('opm_next', 0.01), 'cagr_2_5': ('cagr_2_5', 0.01),
+                        'opm_target': ('opm_target', 0.01), 'sales_to_cap': ('sales_to_cap', 1),
+                        'cash': ('cash', 1e6), 'ltdebt': ('debt_book_value', 1e6), 'shares': ('shares_outstanding', 1e6)}
+
+def get_dcf_backtest(fin_report_df, dcf_inputs, min_years=3):
+    """
+    As-of valuation of each report year: the default assumptions derived from the report up to that year,
+    the other inputs (cost of capital, tax and terminal growth rates, ...) as in dcf_inputs.
+    All years are valued in one batch. Returns a df of the as-of Year, the assumptions (engine units) and the value per share
+    """
+    as_of_rows = range(min_years-1, len(fin_report_df))
+    assumptions_list = [get_default_assumptions(fin_report_df.iloc[:row+1]) for row in as_of_rows]
+    batch = {k: np.full(len(assumptions_list), dcf_inputs[k], dtype=float) for k in DCF_INPUT_KEYS}
+    for k, (assumption_key, scale) in BACKTEST_ASSUMPTIONS.items():
+        batch[k] = scale * np.array([assumptions[assumption_key] for assumptions in assumptions_list], dtype=float)
+    dcf_output = get_dcf_batch(**batch, **get_dcf_horizon(dcf_inputs))[1]
+    return pd.DataFrame({'Year': fin_report_df.iloc[list(as_of_rows), 0].to_numpy(),
+                        **{k: batch[k] for k in BACKTEST_ASSUMPTIONS},
+                        'estimated_value_per_share': dcf_output['estimated_value_per_share']})
@@ -1,159 +1,491 @@
 import os
-from time import sleep
+import re
+import time
+import random
+from time import sleep, monotonic
+import numpy as np
 import pandas as pd
 from bs4 import BeautifulSoup
-import requests
 import asyncio
 import json
-from aiohttp import ClientSession, ClientResponseError
+from datetime import datetime, timedelta
+from collections import namedtuple
+from functools import lru_cache
+from contextlib import asynccontextmanager, nullcontext
+from urllib.parse import urlsplit
+from aiohttp import ClientResponseError, ClientError, ClientTimeout
 # from aiohttp_sse_client import client as sse_client
 from iexfinance.base import _IEXBase
 from dotenv import load_dotenv
 load_dotenv()
+try:
+    from lxml import html as lxml_html
+except ImportError:     # statement pages are extracted with BeautifulSoup only
+    lxml_html = None
 # from functools import lru_cache # https://gist.github.com/Morreski/c1d08a3afa4040815eafd3891e16b945
 # Local imports
 from __init__ import TIMEOUT_12HR, CURRENT_YEAR, ticker_dict, get_us_exchanges
 from app import cache, cache_redis, logger
+from io_runtime import io_runtime
+from cache_utils import memoize_swr, SWRMemoized
+from page_cache import page_cache, PAGE_CACHE_MAX_AGE
+from fetch_corpus import is_replay, read_corpus, record_corpus, get_url_text, get_corpus_json, record_corpus_json
 
 # @lru_cache(maxsize = 100)     # now using Flask-Caching in app.py for sharing memory across instances, sessions, time-based expiry
-@cache.memoize(timeout=TIMEOUT_12HR)
-def get_financial_report(ticker):
-    if ticker not in ticker_dict():  # Validate with https://sandbox.iexapis.com/stable/ref-data/symbols?token=
-        raise ValueError("Invalid Ticker entered: " + ticker)
+# Financial statement pages of a report: annual and quarterly income statement, balance sheet and cash flow
+FINDATA_KEYS = ['ais', 'abs', 'acf', 'qis', 'qbs', 'qcf']
+
+def get_financial_report_urls(ticker):  # in FINDATA_KEYS order
     urlincome = 'https://www.marketwatch.com/investing/stock/'+ticker+'/financials'
     urlbalancesheet = 'https://www.marketwatch.com/investing/stock/'+ticker+'/financials/balance-sheet'
     urlcashflow = 'https://www.marketwatch.com/investing/stock/'+ticker+'/financials/cash-flow'
     urlqincome = urlincome + '/income/quarter'
     urlqbalancesheet = urlbalancesheet + '/quarter'
     urlqcashflow = urlcashflow + '/quarter'
-    urls = [urlincome, urlbalancesheet, urlcashflow, urlqincome, urlqbalancesheet, urlqcashflow]
-    findata_keys = ['ais', 'abs', 'acf', 'qis', 'qbs', 'qcf']
+    return [urlincome, urlbalancesheet, urlcashflow, urlqincome, urlqbalancesheet, urlqcashflow]
+
+# Statements change only when a company files: a report stays fresh until its next expected filing (capped at a week and
+# at the freshness of the quote values, the last price of the report ages with it), then is checked every 12 hours as
+# before until the filing shows up
+REPORT_TTL_MAX = TIMEOUT_12HR*2*7
+REPORT_TTL_NEAR_EARNINGS = TIMEOUT_12HR
+QUARTER_DAYS = 91
+EARNINGS_LAG_DAYS = 14  # earliest filings after a quarter end (banks), most come within 30-45 days
+
+def get_earnings_date(next_earnings_date):
+    # 'Oct 27, 2026' or a range 'Oct 27, 2026 - Oct 31, 2026' of the Yahoo quote page, None when not a date
+    try:
+        return datetime.strptime(next_earnings_date.split(' - ')[0].strip(), '%b %d, %Y')
+    except (AttributeError, ValueError):
+        return None
 
+def get_mrq_date(report_date_note):
+    # '30-Jun-2026, Fiscal year is ...' of get_report_notes
     try:
-        loop = asyncio.get_event_loop()
-    except RuntimeError:
-        loop = asyncio.new_event_loop()
-    # future = asyncio.ensure_future(fetch_async(urls, format = 'text'))
-    souped_text_list = loop.run_until_complete(fetch_async(urls, format = 'text'))
-    finsoup = {k:souped_text_list[idx] for idx, k in enumerate(findata_keys)}
-
-    # build lists for the Financial statements
-    isdata_lines = {'revenue': [], 'eps': [], 'pretaxincome': [], 'netincome': [],
-                    'interestexpense': [], 'randd': [], 'ebitda': [], 'shares': []
-                    }
-    bsdata_lines = {'equity': [], 'ltd': [], 'totalassets': [], 'intangibleassets': [],
-                    'currentliab': [], 'cash': []
-                    }
-    cfdata_lines = {'capex': [], 'fcf': []}
-
-    # find the table headers for the Financial statements
-    fin_titles = {k:get_titles(finsoup[k]) for k in findata_keys}
-
-    isdata_lines = get_income_data(fin_titles, isdata_lines)
-    bsdata_lines = get_balancesheet_data(fin_titles, bsdata_lines)
-    cfdata_lines = get_cashflow_data(fin_titles, cfdata_lines)
-
-    #get the data from the fin statement lists and use helper function get_element to index for format line#
-    revenue = get_element(isdata_lines['revenue'],0) + get_element(isdata_lines['revenue'],2)
-    revenueGrowth = get_element(isdata_lines['revenue'],1) + get_element(isdata_lines['revenue'],3)
-    if len(isdata_lines['revenue']) == 10:    # for Financial companies top-line, add Interest and non-Interest Income
-        net_interest_income_after_provision = get_element(isdata_lines['revenue'],2) + get_element(isdata_lines['revenue'],7)
-        non_interest_income = get_element(isdata_lines['revenue'],4) + get_element(isdata_lines['revenue'],9)
-        revenue = [get_string_from_number(get_number_from_string(net_interest_income_after_provision[y])+get_number_from_string(nii)) for y, nii in enumerate(non_interest_income)]
-        revenueGrowth = get_element(isdata_lines['revenue'],3) + get_element(isdata_lines['revenue'],8)
-    eps = get_element(isdata_lines['eps'],0) + get_element(isdata_lines['eps'],2)
-    epsGrowth = get_element(isdata_lines['eps'],1) + get_element(isdata_lines['eps'],3)
-    preTaxIncome = get_element(isdata_lines['pretaxincome'],0) + get_element(isdata_lines['pretaxincome'],2)
-    netIncome = get_element(isdata_lines['netincome'],1) + get_element(isdata_lines['netincome'],6)
-    interestExpense = get_element(isdata_lines['interestexpense'],0) + (get_element(isdata_lines['interestexpense'],3) if len(isdata_lines['interestexpense'][3]) ==1 else get_element(isdata_lines['interestexpense'],4))
-    resanddev = get_element(isdata_lines['randd'],0) + get_element(isdata_lines['randd'],1)
-    ebitda = get_element(isdata_lines['ebitda'],0) + get_element(isdata_lines['ebitda'],3)
-    outstanding_shares = get_element(isdata_lines['shares'],0) + get_element(isdata_lines['shares'],1)
-
-    shareholderEquity = get_element(bsdata_lines['equity'],0) + get_element(bsdata_lines['equity'],2)
-    longtermDebt = get_element(bsdata_lines['ltd'],0) + get_element(bsdata_lines['ltd'],1)
-    if bsdata_lines['totalassets'][1][0] != '-':
-        totalAssets = get_element(bsdata_lines['totalassets'],1) + get_element(bsdata_lines['totalassets'],1+int(len(bsdata_lines['totalassets'])/2))
+        return datetime.strptime(report_date_note.split(',')[0].strip(), '%d-%b-%Y')
+    except (AttributeError, ValueError):
+        return None
+
+def get_ttl_until(next_date, ttl_max, ttl_min=REPORT_TTL_NEAR_EARNINGS):
+    if next_date is None:
+        return ttl_max
+    return min(ttl_max, max(ttl_min, (next_date - datetime.now()).total_seconds()))
+
+def get_report_timeout(report, ticker):
+    """
+    Seconds the report of ticker stays fresh: until the next earnings date of the quote values of ticker or the earliest
+    filing expected for the quarter after its MRQ, whichever comes first, and no longer than the quote values stay fresh
+    (12 hours when the quote failed)
+    """
+    quote_values = get_yahoo_fin_values(ticker)     # cached, or shares the fetch of a concurrent get_fin_report_sources
+    quote_fresh_seconds = get_yahoo_fin_values.get_fresh_seconds(ticker) if quote_values is not None else None
+    next_filings = [get_earnings_date((quote_values or QUOTE_FALLBACK)[0])]
+    mrq_date = get_mrq_date(report[3])
+    if mrq_date is not None:
+        next_filings.append(mrq_date + timedelta(days=QUARTER_DAYS + EARNINGS_LAG_DAYS))
+    next_filings = [d for d in next_filings if d is not None]
+    ttl_max = min(REPORT_TTL_MAX, max(REPORT_TTL_NEAR_EARNINGS, quote_fresh_seconds or 0))
+    return get_ttl_until(min(next_filings) if next_filings else datetime.now(), ttl_max)
+
+def get_quote_timeout(quote_values, ticker):
+    """
+    Seconds the quote values of ticker stay fresh: a week, until the day after its next earnings date when sooner
+    (the next date is announced)
+    """
+    earnings_date = get_earnings_date(quote_values[0])
+    return get_ttl_until(earnings_date and earnings_date + timedelta(days=1), TIMEOUT_12HR*2*7)
+
+def invalidate_ticker(ticker):
+    """
+    Drop the cached report, quote values and statement pages of ticker (e.g. after a filing), the next request fetches them
+    """
+    get_financial_report.delete(ticker)
+    get_yahoo_fin_values.delete(ticker)
+    for url in get_financial_report_urls(ticker):
+        page_cache.delete(url)
+
+@memoize_swr(cache, timeout=TIMEOUT_12HR, stale_timeout=TIMEOUT_12HR*2, get_timeout=get_report_timeout)  # served stale for up to a day more while refreshed
+def get_financial_report(ticker):
+    # fetched on the I/O runtime, parsed in this thread
+    return get_financial_report_from_page_texts(io_runtime.run(fetch_financial_report_pages(ticker)), ticker)
+
+async def fetch_financial_report(ticker):
+    page_texts = await fetch_financial_report_pages(ticker)
+    # parsed in a worker thread, the loop goes on with the other fetches
+    return await asyncio.get_running_loop().run_in_executor(None, get_financial_report_from_page_texts, page_texts, ticker)
+
+async def fetch_financial_report_pages(ticker):
+    if ticker not in ticker_dict():  # Validate with https://sandbox.iexapis.com/stable/ref-data/symbols?token=
+        raise ValueError("Invalid Ticker entered: " + ticker)
+    urls = get_financial_report_urls(ticker)
+
+    return await fetch_async(urls, format = 'text')
+
+# Timeouts (seconds) of the fin_report sources, the quote values and the treasury rate fall back to these defaults
+FIN_SOURCE_TIMEOUTS = {'report': 30, 'quote': 8, 'rates': 8}
+QUOTE_FALLBACK = ('N/A', [])
+RATES_FALLBACK = 2
+
+def get_fin_report_sources(ticker, timeouts=FIN_SOURCE_TIMEOUTS):
+    """
+    The financial report (see get_financial_report), the next earnings date and beta (see get_yahoo_fin_values)
+    and the 10Y treasury rate (see get_rates_fin_values) of ticker, fetched concurrently so a cold load takes
+    as long as the slowest source. Cached values are reused, a slow or failed quote or rate source gives its fallback
+    (not cached: the next call fetches it again), a failed report raises
+    """
+    return io_runtime.run(fetch_fin_report_sources(ticker, timeouts))
+
+async def fetch_fin_report_sources(ticker, timeouts=FIN_SOURCE_TIMEOUTS):
+    return await asyncio.gather(
+        get_memoized_async(get_financial_report, fetch_financial_report, ticker, timeout=timeouts['report']),
+        get_memoized_async(get_yahoo_fin_values, fetch_yahoo_fin_values, ticker, timeout=timeouts['quote'], fallback=QUOTE_FALLBACK),
+        get_memoized_async(get_rates_fin_values, fetch_rates_fin_values, timeout=timeouts['rates'], fallback=RATES_FALLBACK))
+
+async def get_memoized_async(memoized, fetch, *args, timeout=None, fallback=None):
+    # the cached value of memoized(*args), else awaits fetch(*args) within timeout and caches it as memoized would.
+    # A stale-while-revalidate memoized is called in a worker thread instead, concurrent misses share its computation
+    if isinstance(memoized, SWRMemoized):
+        pending = asyncio.get_running_loop().run_in_executor(None, memoized, *args)
     else:
-        totalAssets = get_element(bsdata_lines['totalassets'],0) + get_element(bsdata_lines['totalassets'],6)
-    if get_number_from_string(totalAssets[0]) < 10: # another special case?
-        totalAssets = get_element(bsdata_lines['totalassets'],0) + get_element(bsdata_lines['totalassets'],4)
-    intangibleAssets = get_element(bsdata_lines['intangibleassets'],0) + get_element(bsdata_lines['intangibleassets'],1)
-    currentLiabilities = get_element(bsdata_lines['currentliab'],0) + get_element(bsdata_lines['currentliab'],1)
-    if all([c == '-' for c in currentLiabilities]):
-        currentLiabilities = ['0'] * len(totalAssets)
-    cash = get_element(bsdata_lines['cash'],0) + get_element(bsdata_lines['cash'],2)
-
-    # some companies data doesn't have Net Investing Cash Flow Growth or Net Investing Cash Flow / Sales
-    capEx = get_element(cfdata_lines['capex'],0) + get_element(cfdata_lines['capex'],int(len(cfdata_lines['capex'])/2))
-    fcf = get_element(cfdata_lines['fcf'],0) + get_element(cfdata_lines['fcf'],3)
-
-    # load all the data into dataframe
-    df= pd.DataFrame({'Revenue($)': revenue, 'Revenue Growth(%)': revenueGrowth, 'EPS($)': eps, 'EPS Growth(%)': epsGrowth,
-            'Pretax Income($)': preTaxIncome, 'Net Income($)': netIncome, 'Interest Expense($)': interestExpense,
-            'EBITDA($)': ebitda, 'Research & Development($)': resanddev, 'Shares Outstanding': outstanding_shares,
-            'Longterm Debt($)': longtermDebt, 'Shareholder Equity($)': shareholderEquity,
-            'Total Assets($)': totalAssets, 'Intangible Assets($)': intangibleAssets,
-            'Total Current Liabilities($)': currentLiabilities, 'Cash($)': cash,
-            'Net Investing Cash Flow($)': capEx, 'Free Cash Flow($)': fcf
-            },index=range(CURRENT_YEAR-5,CURRENT_YEAR+1))
+        cache_key = memoized.make_cache_key(memoized.uncached, *args)
+        cached_value = cache.get(cache_key)
+        if cached_value is not None:
+            return cached_value
+        pending = fetch(*args)
+    try:
+        value = await asyncio.wait_for(pending, timeout)
+    except Exception as e:
+        if fallback is None:
+            raise
+        logger.warning(f'{fetch.__name__}{args}: {type(e).__name__} {e}, using {fallback}')
+        return fallback
+    if value is None and fallback is not None:  # a memoized source that failed without raising, not cached
+        logger.warning(f'{fetch.__name__}{args}: no value, using {fallback}')
+        return fallback
+    if not isinstance(memoized, SWRMemoized):
+        cache.set(cache_key, value, timeout=memoized.cache_timeout)
+    return value
+
+# Bulk fetch limits, per host: requests in flight and request rate (per second), retries of 429/5xx and timeouts
+FETCH_HOST_CONCURRENCY = int(os.environ.get('FETCH_HOST_CONCURRENCY', 4))
+FETCH_HOST_RATE = float(os.environ.get('FETCH_HOST_RATE', 2))
+FETCH_RETRIES = 3
+FETCH_BACKOFF = 1   # seconds, doubled at each retry with full jitter
+FETCH_TIMEOUT = 15
+
+def get_financial_reports(tickers, **fetch_kwargs):
+    """
+    Generate (ticker, report) of the tickers as soon as each report is fetched and parsed, report as returned by
+    get_financial_report or the exception that failed it. The reports are parsed in this thread, while the I/O
+    runtime goes on fetching (see get_financial_report_pages)
+    """
+    for ticker, page_texts in get_financial_report_pages(tickers, **fetch_kwargs):
+        try:
+            report = page_texts if isinstance(page_texts, Exception) else get_financial_report_from_page_texts(page_texts, ticker)
+        except Exception as e:
+            report = e
+        yield ticker, report
+
+def get_financial_report_pages(tickers, **fetch_kwargs):
+    """
+    Generate (ticker, page texts) of the tickers as soon as each one's statement pages are fetched, or the exception
+    that failed them. The fetches share the session of the I/O runtime, limited per host by fetch_kwargs of
+    fetch_statement_pages
+    """
+    pages = fetch_statement_pages(tickers, **fetch_kwargs)
+    try:
+        while True:
+            try:
+                yield io_runtime.run(pages.__anext__())
+            except StopAsyncIteration:
+                break
+    finally:
+        io_runtime.run(pages.aclose())
+
+async def fetch_statement_pages(tickers, concurrency=FETCH_HOST_CONCURRENCY, rate=FETCH_HOST_RATE, retries=FETCH_RETRIES,
+                                    timeout=FETCH_TIMEOUT, backoff=FETCH_BACKOFF, max_age=PAGE_CACHE_MAX_AGE):
+    limiter = HostRateLimiter(concurrency, rate)
+    # a few tickers at a time so their pages complete and stream out early, instead of all at the end
+    tickers_in_flight = asyncio.Semaphore(2*concurrency)
+    async def get_pages(session, ticker):
+        async with tickers_in_flight:
+            return await get_ticker_pages(session, ticker)
+    async def get_ticker_pages(session, ticker):
+        try:
+            if ticker not in ticker_dict():
+                raise ValueError("Invalid Ticker entered: " + ticker)
+            urls = get_financial_report_urls(ticker)
+            return ticker, await asyncio.gather(*[get_page_text(session, url, limiter, retries, timeout, backoff, max_age) for url in urls])
+        except Exception as e:
+            return ticker, e
+
+    session = await io_runtime.get_session()
+    tasks = [asyncio.ensure_future(get_pages(session, ticker)) for ticker in dict.fromkeys(tickers)]
+    try:
+        for pages in asyncio.as_completed(tasks):
+            yield await pages
+    finally:    # the consumer stopped early
+        for task in tasks:
+            task.cancel()
+
+class RetryableResponseError(Exception):
+    def __init__(self, status, retry_after=None):
+        super(RetryableResponseError, self).__init__(f'HTTP {status}')
+        self.retry_after = retry_after
+
+async def get_page_text(session, url, limiter=None, retries=FETCH_RETRIES, timeout=FETCH_TIMEOUT, backoff=FETCH_BACKOFF,
+                        max_age=PAGE_CACHE_MAX_AGE, use_page_cache=True):
+    """
+    Page text of url, from the page cache when cached within max_age seconds, else fetched (conditionally when cached),
+    retried with jittered exponential backoff on 429/5xx responses, timeouts and connection errors.
+    API responses (use_page_cache=False) are neither read from nor kept in the page cache
+    """
+    # the page cache and corpus files are read and written in worker threads, off the loop
+    loop = asyncio.get_running_loop()
+    if is_replay():
+        return await loop.run_in_executor(None, read_corpus, url)
+    cached = await loop.run_in_executor(None, page_cache.get, url) if use_page_cache else None
+    if cached and page_cache.is_fresh(cached, max_age):
+        return cached['text']
+    for attempt in range(retries+1):
+        try:
+            async with limiter.limit(urlsplit(url).netloc) if limiter else nullcontext():
+                async with session.get(url, headers=page_cache.get_validators(cached) if cached else None,
+                                        timeout=ClientTimeout(total=timeout)) as response:
+                    if response.status == 304 and cached:   # not modified upstream
+                        await loop.run_in_executor(None, page_cache.touch, url)
+                        return cached['text']
+                    if response.status == 429 or response.status >= 500:
+                        retry_after = response.headers.get('Retry-After', '')
+                        raise RetryableResponseError(response.status, float(retry_after) if retry_after.isdigit() else None)
+                    response.raise_for_status()
+                    page_text = (await response.read()).decode('utf-8')
+            if use_page_cache:
+                await loop.run_in_executor(None, page_cache.set, url, page_text, response.headers.get('ETag'), response.headers.get('Last-Modified'))
+            await loop.run_in_executor(None, record_corpus, url, page_text)
+            return page_text
+        except (RetryableResponseError, asyncio.TimeoutError, ClientError) as e:
+            if isinstance(e, ClientResponseError) and e.status < 500 and e.status != 429:
+                raise
+            if attempt == retries:
+                if cached:  # the stale page rather than none
+                    logger.warning(f'{url}: {type(e).__name__} {e}, using the page cached at {time.ctime(cached["fetched_at"])}')
+                    return cached['text']
+                raise
+            delay = getattr(e, 'retry_after', None) or random.uniform(0, backoff * 2**attempt)
+            logger.warning(f'{url}: {type(e).__name__} {e}, retry {attempt+1} in {delay:.1f}s')
+            await asyncio.sleep(delay)
+
+class HostRateLimiter:
+    """
+    Per host: at most concurrency requests in flight, started at rate requests per second on average
+    (token bucket of concurrency tokens)
+    """
+    def __init__(self, concurrency=FETCH_HOST_CONCURRENCY, rate=FETCH_HOST_RATE):
+        self.concurrency, self.rate = concurrency, rate
+        self.hosts = {}
+
+    @asynccontextmanager
+    async def limit(self, host):
+        if host not in self.hosts:
+            self.hosts[host] = {'semaphore': asyncio.Semaphore(self.concurrency), 'tokens': self.concurrency, 'updated': monotonic()}
+        host_state = self.hosts[host]
+        async with host_state['semaphore']:
+            while True:
+                now = monotonic()
+                host_state['tokens'] = min(self.concurrency, host_state['tokens'] + (now-host_state['updated'])*self.rate)
+                host_state['updated'] = now
+                if host_state['tokens'] >= 1:
+                    host_state['tokens'] -= 1
+                    break
+                await asyncio.sleep((1-host_state['tokens'])/self.rate)
+            yield
+
+def get_financial_report_from_pages(statement_pages, ticker=''):
+    """
+    Parse the financial statement pages (see get_statement_page, in FINDATA_KEYS order) into the financial report df,
+    the last price, its time and the report date note
+    """
+    finsoup = {k:statement_pages[idx] for idx, k in enumerate(FINDATA_KEYS)}
+    isdata_lines, bsdata_lines, cfdata_lines = get_statement_lines(finsoup)
+    df = get_report_ratios(get_report_frame(isdata_lines, bsdata_lines, cfdata_lines))
+    lastprice, lastprice_time, report_date_note = get_report_notes(finsoup, ticker)
+    return df, lastprice, lastprice_time, report_date_note
+
+def get_financial_report_from_page_texts(page_texts, ticker=''):
+    """
+    get_financial_report_from_pages of the statement page texts (html, None for a page that failed to fetch)
+    """
+    return get_financial_report_from_pages([None if page_text is None else get_statement_page(page_text) for page_text in page_texts], ticker)
+
+# Stages of get_financial_report_from_pages, timed separately by the parser benchmarks
+def get_statement_lines(finsoup):
+    """
+    Map the statement rows of the pages (keyed by FINDATA_KEYS) to the line items of the company profile, for the income,
+    balance sheet and cash flow statements: {item: annual values followed by the TTM/MRQ value}
+    """
+    profile = get_statement_profile(finsoup['ais'])
+    statement_lines = {}
+    for statement, (annual_key, quarterly_key) in STATEMENT_PAGES.items():
+        periods = {}    # item: {'annual': values, 'quarterly': values}, the rows of an item's labels summed
+        for period, page_key in (('annual', annual_key), ('quarterly', quarterly_key)):
+            for row in finsoup[page_key].rows:
+                item = get_row_item(profile, row.text)
+                if item is None or LINE_ITEMS[item][0] != statement:
+                    continue
+                values = [float(d) if d else None for d in row.data]
+                item_periods = periods.setdefault(item, {})
+                summed = item_periods.get(period)
+                item_periods[period] = values if summed is None else [add_numbers(a, b) for a, b in zip(summed, values)]
+        lines = {}
+        for item, item_periods in periods.items():
+            if 'annual' in item_periods and not isinstance(LINE_ITEMS[item][1], tuple):
+                lines[item] = item_periods['annual'] + [get_ttm_value(LINE_ITEMS[item][1], item_periods.get('quarterly'))]
+        for item, item_periods in periods.items():  # growth of the TTM value of an item over its last annual value
+            if 'annual' in item_periods and isinstance(LINE_ITEMS[item][1], tuple):
+                base = lines.get(LINE_ITEMS[item][1][1])
+                lines[item] = item_periods['annual'] + [get_growth(base[-1], base[-2]) if base else None]
+        statement_lines[statement] = lines
+    return statement_lines['is'], statement_lines['bs'], statement_lines['cf']
+
+def get_report_frame(isdata_lines, bsdata_lines, cfdata_lines):
+    """
+    Financial report df of the annual and TTM/MRQ values of the line items
+    """
+    lines = {**isdata_lines, **bsdata_lines, **cfdata_lines}
+    if lines.get('current_liabilities') is None or all(c is None for c in lines['current_liabilities']):
+        lines['current_liabilities'] = [0] * (CURRENT_YEAR_COUNT + 1)
+    # numbers are kept as floats (NaN if missing) and only formatted for display
+    df = pd.DataFrame({column: lines.get(item) for column, item in REPORT_COLUMNS.items()},
+                        index=range(CURRENT_YEAR-CURRENT_YEAR_COUNT, CURRENT_YEAR+1), dtype=float)
     df.reset_index(inplace=True)
+    return df
+
+def get_report_ratios(df):
     # Derived Financial Metrics/Ratios
-    df['Net Profit Margin(%)'] = (df['Net Income($)'].apply(get_number_from_string) / df['Revenue($)'].apply(get_number_from_string)).apply(get_string_from_number)
-    df['Capital Employed($)'] = df['Total Assets($)'].apply(get_number_from_string) - df['Total Current Liabilities($)'].apply(get_number_from_string)
-    df['Sales-to-Capital(%)'] = (df['Revenue($)'].apply(get_number_from_string) / df['Capital Employed($)']).apply(get_string_from_number)
-    df['ROCE(%)'] = (df['Net Income($)'].apply(get_number_from_string) / df['Capital Employed($)']).apply(get_string_from_number)
-    df['Capital Employed($)'] = df['Capital Employed($)'].apply(get_string_from_number)
+    df['Net Profit Margin(%)'] = df['Net Income($)'] / df['Revenue($)']
+    df['Capital Employed($)'] = df['Total Assets($)'] - df['Total Current Liabilities($)']
+    df['Sales-to-Capital(%)'] = df['Revenue($)'] / df['Capital Employed($)']
+    df['ROCE(%)'] = df['Net Income($)'] / df['Capital Employed($)']
+    return df
 
+def get_report_notes(finsoup, ticker=''):
     try:
-        lastprice = finsoup['ais'].findAll('bg-quote', {'class': 'value'})[0].text
-        lastprice_time = finsoup['ais'].findAll('bg-quote', {'field': 'date'})[0].text
-        fiscal_year_note = finsoup['abs'].findAll('small', {'class': 'small'})[0].text
-        mrq_date = finsoup['qbs'].findAll('thead', {'class': 'table__header'})[0].text.split('\n')[-4]
+        lastprice = finsoup['ais'].lastprice[0]
+        lastprice_time = finsoup['ais'].lastprice_time[0]
+        fiscal_year_note = finsoup['abs'].fiscal_year_note[0]
+        mrq_date = finsoup['qbs'].table_header[0].split('\n')[-4]
         report_date_note = mrq_date + ", " + fiscal_year_note
     except IndexError:
         raise IndexError("Data not found for Ticker: " + ticker)
+    return lastprice, lastprice_time, report_date_note
 
-    return df, lastprice, lastprice_time, report_date_note
+# Sector ingestion: IEX batch queries of at most 100 symbols, all fetched with bounded concurrency and rate
+SECTOR_BATCH_SIZE = 100
+SECTOR_BATCH_CONCURRENCY = 8
+SECTOR_BATCH_RATE = 20
+SECTOR_PARTIAL_TIMEOUT = TIMEOUT_12HR   # a sector missing batches is refreshed sooner than weekly
+sector_coverage = {}    # sector: coverage of its last ingestion in this process, see get_sector_coverage
 
-@cache_redis.memoize(timeout=TIMEOUT_12HR*2*7)    # weekly update
+def get_exchange_key(exchange_name):
+    # exchange names of the sector collection and us_exchanges.json differ in case, spacing and word order
+    return ''.join(sorted(exchange_name.upper())).strip()
+
+@lru_cache(maxsize=None)
+def get_us_exchange_keys():
+    return frozenset(get_exchange_key(e['name']) for e in get_us_exchanges())
+
+def get_sector_coverage(sector):
+    """
+    Companies and batches of the last ingestion of sector: {'companies', 'fetched', 'batches', 'failed_batches'}
+    """
+    if sector in sector_coverage:
+        return sector_coverage[sector]
+    try:
+        return cache_redis.get('sector-coverage:' + sector)
+    except Exception as e:  # coverage is bookkeeping, not known without redis
+        logger.warning(f'Coverage of {sector} not read: {type(e).__name__} {e}')
+        return None
+
+def set_sector_coverage(sector, coverage):
+    sector_coverage[sector] = coverage
+    try:
+        cache_redis.set('sector-coverage:' + sector, coverage, timeout=TIMEOUT_12HR*2*7)
+    except Exception as e:  # the ingested data is kept regardless
+        logger.warning(f'Coverage of {sector} not saved: {type(e).__name__} {e}')
+
+def get_sector_timeout(sector_data, sector):
+    coverage = sector_coverage.get(sector)
+    return TIMEOUT_12HR*2*7 if coverage is None or not coverage['failed_batches'] else SECTOR_PARTIAL_TIMEOUT
+
+@memoize_swr(cache_redis, timeout=TIMEOUT_12HR*2*7, get_timeout=get_sector_timeout)    # weekly update, served stale for up to a week more while refreshed
 def get_sector_data(sector):
     """
     Get sector data from iexfinance API
     """
     try:
         # ONLY US-listed stocks in NYSE, NASDAQ, and other US market providers
-        stocks = [s for s in SectorCollection(sector, output_format = 'json').fetch() if 'primaryExchange' in s and ''.join(sorted(s['primaryExchange'].upper())).strip() in [''.join(sorted(e['name'].upper())).strip() for e in get_us_exchanges()]]
+        us_exchange_keys = get_us_exchange_keys()
+        stocks = [s for s in SectorCollection(sector, output_format = 'json').fetch() if 'primaryExchange' in s and get_exchange_key(s['primaryExchange']) in us_exchange_keys]
         logger.info(f'\t{sector}\tSector Universe of US-listed:\t{len(stocks)}\tcompanies.')
         # If we can't see its PE here, we're probably not interested in a stock. Omit it from batch queries.
         stocks = [s for s in stocks if s['peRatio'] and s['peRatio']>0]
         logger.info(f'\t{sector}\tPE>0:\t{len(stocks)}\tcompanies.')
-        # IEX doesn't like batch queries for more than 100 symbols at a time.
-        # We need to build our fundamentals info iteratively.
-        batch_idx = 0
-        batch_size = 100
-        adv_stats_api_urls = []
+        # IEX doesn't like batch queries for more than 100 symbols at a time, the batches are fetched concurrently
+        adv_stats_api_urls = [os.environ.get('IEX_CLOUD_APIURL') + 'stock/market/batch?symbols='
+                                + ','.join(s['symbol'] for s in stocks[batch_idx:batch_idx+SECTOR_BATCH_SIZE])
+                                + '&types=advanced-stats&token=' + os.environ.get('IEX_TOKEN')
+                                for batch_idx in range(0, len(stocks), SECTOR_BATCH_SIZE)]
         resp_dict = {}
-        try:
-            loop = asyncio.get_event_loop()
-        except RuntimeError:
-            loop = asyncio.new_event_loop()
-        while batch_idx < len(stocks):
-            symbol_batch = [s['symbol']
-                            for s in stocks[batch_idx:batch_idx+batch_size]]
-            adv_stats_api_urls.append(os.environ.get('IEX_CLOUD_APIURL')
-                                + 'stock/market/batch?symbols=' + ','.join(symbol_batch) + '&types=advanced-stats&token='
-                                + os.environ.get('IEX_TOKEN'))
-            batch_idx += batch_size
-        # limit to 300 companies per sector for getting advanced-stats endpoint,
-        # TODO: improve this in future
-        for d in loop.run_until_complete(fetch_async(adv_stats_api_urls[:3], format = 'json')):
-            resp_dict.update(d)
-        logger.info(f'\t{sector}\tGot data for:\t{len(resp_dict)}\tcompanies.')
+        failed_batches = []
+        for batch_idx, batch_data in get_sector_batches(adv_stats_api_urls):  # merged as each batch arrives
+            if isinstance(batch_data, Exception):
+                logger.warning(f'\t{sector}\tbatch {batch_idx} failed: {type(batch_data).__name__} {batch_data}')
+                failed_batches.append(batch_idx)
+            else:
+                resp_dict.update(batch_data)
+        if adv_stats_api_urls and len(failed_batches) == len(adv_stats_api_urls):
+            raise ConnectionError(f'No batch of {sector} fetched')
+        coverage = {'companies': len(stocks), 'fetched': len(resp_dict), 'batches': len(adv_stats_api_urls), 'failed_batches': failed_batches}
+        set_sector_coverage(sector, coverage)
+        logger.info(f'\t{sector}\tGot data for:\t{len(resp_dict)}\tof {len(stocks)}\tcompanies, {len(failed_batches)} of {len(adv_stats_api_urls)} batches failed.')
         return resp_dict
     except Exception as e:
         logger.exception(e)
 
+def get_sector_batches(urls, **fetch_kwargs):
+    """
+    Generate (index of the url, data) of the IEX batch urls as each is fetched, data the JSON response or the
+    exception that failed it, see fetch_sector_batches
+    """
+    batches = fetch_sector_batches(urls, **fetch_kwargs)
+    try:
+        while True:
+            try:
+                yield io_runtime.run(batches.__anext__())
+            except StopAsyncIteration:
+                break
+    finally:
+        io_runtime.run(batches.aclose())
+
+async def fetch_sector_batches(urls, concurrency=SECTOR_BATCH_CONCURRENCY, rate=SECTOR_BATCH_RATE, retries=FETCH_RETRIES,
+                                timeout=FETCH_TIMEOUT, backoff=FETCH_BACKOFF):
+    limiter = HostRateLimiter(concurrency, rate)
+    async def get_batch(session, idx, url):
+        try:
+            return idx, json.loads(await get_page_text(session, url, limiter, retries, timeout, backoff, use_page_cache=False))
+        except Exception as e:
+            return idx, e
+
+    session = await io_runtime.get_session()
+    tasks = [asyncio.ensure_future(get_batch(session, idx, url)) for idx, url in enumerate(urls)]
+    try:
+        for batch in asyncio.as_completed(tasks):
+            yield await batch
+    finally:
+        for task in tasks:
+            task.cancel()
+
 # We extend iexfinance a bit to support the sector collection endpoint.
 class SectorCollection(_IEXBase):
 
@@ -165,30 +497,48 @@ class SectorCollection(_IEXBase):
     def url(self):
         return '/stock/market/collection/sector?collectionName={}'.format(self.sector)
 
+    def _execute_iex_query(self, url):
+        if is_replay():
+            return get_corpus_json(url, self.params)
+        data = super(SectorCollection, self)._execute_iex_query(url)
+        record_corpus_json(url, data, self.params)
+        return data
+
 async def fetch_async(urls, format = 'text'):
+    if is_replay():     # offline from the recorded corpus, read in a worker thread
+        return await asyncio.get_running_loop().run_in_executor(None, lambda: [get_corpus_resp(url, format) for url in urls])
     tasks = []
-    # try to use one client session
-    async with ClientSession() as session:
-        for url in urls:
-            if format == 'text':
-                task = asyncio.ensure_future(get_souped_text(session, url))
-            elif format == 'json':
-                task = asyncio.ensure_future(get_json_resp(session, url))
-            else:
-                raise ValueError('Invalid format for fetching URL: ' + format)
-            tasks.append(task)
-        # await response outside the for loop
-        resp_list = await asyncio.gather(*tasks)
+    # the keep-alive session of the I/O runtime, shared by all fetches
+    session = await io_runtime.get_session()
+    for url in urls:
+        if format == 'text':
+            task = asyncio.ensure_future(get_logged_page_text(session, url))
+        elif format == 'json':
+            task = asyncio.ensure_future(get_json_resp(session, url))
+        else:
+            raise ValueError('Invalid format for fetching URL: ' + format)
+        tasks.append(task)
+    # await response outside the for loop
+    resp_list = await asyncio.gather(*tasks)
     return resp_list
 
-async def get_souped_text(session, url):
+async def fetch_url_text(url, timeout=FETCH_TIMEOUT):
+    # text of url with the session of the I/O runtime, through the fetch corpus
+    if is_replay():
+        return read_corpus(url)
+    session = await io_runtime.get_session()
+    async with session.get(url, timeout=ClientTimeout(total=timeout)) as response:
+        response.raise_for_status()
+        text = await response.text()
+    record_corpus(url, text)
+    return text
+
+async def get_logged_page_text(session, url):
     # sleep(0.1)  # throttle scraping
     try:
-        async with session.get(url, timeout=15) as response:
-            resp = await response.read()
-        return BeautifulSoup(resp.decode('utf-8'), features="html.parser")  # read in
+        return await get_page_text(session, url, retries=0, timeout=15)  # read in, through the page cache, parsed by the caller
     except ClientResponseError as e:
-        logger.error(e.code)
+        logger.error(e.status)
     except asyncio.TimeoutError:
         logger.error("Timeout")
     except Exception as e:
@@ -197,8 +547,20 @@ async def get_souped_text(session, url):
 async def get_json_resp(session, url):
     async with session.get(url) as resp:
         resp = await resp.json()
+    record_corpus_json(url, resp)
     return resp
 
+def get_corpus_resp(url, format = 'text'):
+    try:
+        if format == 'text':
+            return read_corpus(url)
+        elif format == 'json':
+            return get_corpus_json(url)
+        else:
+            raise ValueError('Invalid format for fetching URL: ' + format)
+    except FileNotFoundError as e:   # as a failed fetch
+        logger.error(e)
+
 # async def get_stream_quote(ticker):
 #     async with sse_client.EventSource(
 #         f"{os.environ.get('IEX_CLOUD_APISSEURL')}tops?token={os.environ.get('IEX_TOKEN')}&symbols={ticker}"
@@ -210,124 +572,173 @@ async def get_json_resp(session, url):
 #         except ConnectionError as e:
 #             logger.exception(e)
 
-def get_titles(souptext):
-    return souptext.findAll('td', {'class': 'overflow__cell fixed--column'})
-
-def walk_row(titlerow): # use the fact that data-chart-data has the numeric values
-    return titlerow.findNextSiblings(attrs={'class': 'overflow__cell'})[-1].div.div['data-chart-data'].split(',')
-
-def get_income_data(data_titles, data_lines):
-    def build_income_list(data_list):
-        if 'Sales' in title.text \
-                or 'Net Interest Inc' in title.text or 'Non-Interest Income' in title.text:     # for Financial companies top-line
-            data_lines['revenue'].append(data_list)
-        if 'EPS (Diluted)' in title.text:
-            data_lines['eps'].append(data_list)
-        if 'Pretax Income' in title.text:
-            data_lines['pretaxincome'].append(data_list)
-        if 'Net Income' in title.text:
-            data_lines['netincome'].append(data_list)
-        if ' Interest Expense' in title.text:
-            data_lines['interestexpense'].append(data_list)
-        if 'Research & Development' in title.text:
-            data_lines['randd'].append(data_list)
-        if 'EBITDA' in title.text:
-            data_lines['ebitda'].append(data_list)
-        if 'Diluted Shares Outstanding' in title.text:
-            data_lines['shares'].append(data_list)
-
-    for title in data_titles['ais']:
-        if 'Growth' in title.text:    # scale to %
-            build_income_list([get_string_from_number(float(d), True) if d else '-' for d in walk_row(title)])
-        else:
-            build_income_list([get_string_from_number(float(d)) if d else '-' for d in walk_row(title)])
-
-    for title in data_titles['qis']:    # first convert to numbers, then sum last 4 of 5 qtrs for TTM data
-        qtr_data = [get_number_from_string(cell) for cell in walk_row(title)]
-        qtr_sum = sum(qtr_data[1:]) if all(v is not None for v in qtr_data[1:]) else None
-        if 'Sales Growth' in title.text \
-                or 'Net Interest Inc After Loan Loss Prov Growth' in title.text:     # for Financial companies top-line
-            qtr_sum_str = get_string_from_number(get_number_from_string(data_lines['revenue'][-1][0])/get_number_from_string(data_lines['revenue'][0][-1]) - 1, True)
-        elif 'EPS (Diluted)' in title.text: # don't scale to 'M' or '%' for pershare
-            qtr_sum_str = f'{qtr_sum:.2f}' if qtr_sum else '-'
-            if 'Growth' in title.text:    # get growth rate
-                qtr_sum_str = get_string_from_number(get_number_from_string(data_lines['eps'][-1][0])/get_number_from_string(data_lines['eps'][0][-1]) - 1, True)
-        elif 'Diluted Shares Outstanding' in title.text:  # don't add the Shares Outstanding, return the last Quarter reported value
-            qtr_sum_str = get_string_from_number(qtr_data[-1]) if qtr_sum else '-'
-        else:
-            qtr_sum_str = get_string_from_number(qtr_sum) if qtr_sum else '-'
-        build_income_list([qtr_sum_str])
-
-    return data_lines
-
-def get_balancesheet_data(data_titles, data_lines):
-    def build_balancesheet_list(data_list):
-        if 'Total Shareholders\' Equity' in title.text:
-            data_lines['equity'].append(data_list)
-        if 'Debt excl. Capital' in title.text:
-            data_lines['ltd'].append(data_list)
-        if 'Total Assets' in title.text:
-            data_lines['totalassets'].append(data_list)
-        if 'Intangible Assets' in title.text:
-            data_lines['intangibleassets'].append(data_list)
-        if 'Total Current Liabilities' in title.text:
-            data_lines['currentliab'].append(data_list)
-        if 'Cash & Short Term Investments' in title.text or 'Cash & Due from' in title.text:
-            data_lines['cash'].append(data_list)
-
-    for title in data_titles['abs']:
-        build_balancesheet_list([get_string_from_number(float(d)) if d else '-' for d in walk_row(title)])
-    for title in data_titles['qbs']:
-        mrq_cell = walk_row(title)[-1]
-        build_balancesheet_list([get_string_from_number(float(mrq_cell)) if mrq_cell else '-'])    # only get MRQ
-
-    return data_lines
-
-def get_cashflow_data(data_titles, data_lines):
-    def build_cashflow_list(data_list):
-        if 'Net Investing Cash Flow' in title.text:
-            data_lines['capex'].append(data_list)
-        if 'Free Cash Flow' in title.text:
-            data_lines['fcf'].append(data_list)
-
-    for title in data_titles['acf']:
-        build_cashflow_list([get_string_from_number(float(d)) if d else '-' for d in walk_row(title)])
-
-    for title in data_titles['qcf']:    # first convert to numbers, then sum last 4 of 5 qtrs for TTM data
-        qtr_data = [get_number_from_string(cell) for cell in walk_row(title)]
-        qtr_sum_str = get_string_from_number(sum(qtr_data[1:])) if all(v is not None for v in qtr_data[1:]) else '-'
-        build_cashflow_list([qtr_sum_str])
-
-    return data_lines
-
-def get_element(list, element):
-    try:
-        return list[element]
-    except:
-        return '-'
+# The fields of a statement page the report uses: the rows (title text and the data-chart-data values of the row)
+# and the texts of the header elements, lists as there can be none or several of each element
+StatementPage = namedtuple('StatementPage', ['rows', 'lastprice', 'lastprice_time', 'fiscal_year_note', 'table_header'])
+StatementRow = namedtuple('StatementRow', ['text', 'data'])
 
-def get_number_from_string(str_value):
-    try:
-        if isinstance(str_value, str):
-            str_value = str_value.replace(',', '')  # remove commas for formatting
-            if str_value[0] == '(': # negative number in parenthesis format
-                str_value = '-' + str_value[1:-1]
-            if str_value == '-' or str_value == '--':
-                return None
-            else:
-                try:
-                    return float(str_value)
-                except ValueError:
-                    units_dict = {'M': 1e6, 'B': 1e9, 'T': 1e12, '%': 0.01}
-                    return float(str_value[:-1]) * units_dict[str_value[-1]]
-        else:
-            raise ValueError('Need a string input to convert to number!')
-    except Exception as e:
-        logger.exception(e)
+def get_statement_page(page_text, extractor=None):
+    """
+    Extract the StatementPage of a MarketWatch financial statement page (html text) with the extractor of PAGE_EXTRACTORS,
+    by default PAGE_EXTRACTOR
+    """
+    return PAGE_EXTRACTORS[extractor or PAGE_EXTRACTOR](page_text)
+
+def get_statement_page_bs4(page_text):
+    souptext = BeautifulSoup(page_text, features="html.parser")
+    return StatementPage(
+        rows=[StatementRow(title.text, title.findNextSiblings(attrs={'class': 'overflow__cell'})[-1].div.div['data-chart-data'].split(','))
+                for title in souptext.findAll('td', {'class': 'overflow__cell fixed--column'})],
+        lastprice=[e.text for e in souptext.findAll('bg-quote', {'class': 'value'})],
+        lastprice_time=[e.text for e in souptext.findAll('bg-quote', {'field': 'date'})],
+        fiscal_year_note=[e.text for e in souptext.findAll('small', {'class': 'small'})],
+        table_header=[e.text for e in souptext.findAll('thead', {'class': 'table__header'})])
+
+def get_statement_page_lxml(page_text):
+    # same elements as get_statement_page_bs4 with XPath on the libxml2 tree, several times faster than html.parser
+    tree = lxml_html.fromstring(page_text.encode('utf-8'), parser=LXML_PARSER)
+    rows = []
+    for title in tree.xpath('//td[normalize-space(@class)="overflow__cell fixed--column"]'):
+        cell = title.xpath('following-sibling::*[' + get_xpath_class('overflow__cell') + ']')[-1]
+        chart = next(next(cell.iterdescendants('div')).iterdescendants('div'))
+        rows.append(StatementRow(get_lxml_text(title), chart.attrib['data-chart-data'].split(',')))
+    return StatementPage(
+        rows=rows,
+        lastprice=[get_lxml_text(e) for e in tree.xpath('//bg-quote[' + get_xpath_class('value') + ']')],
+        lastprice_time=[get_lxml_text(e) for e in tree.xpath('//bg-quote[@field="date"]')],
+        fiscal_year_note=[get_lxml_text(e) for e in tree.xpath('//small[' + get_xpath_class('small') + ']')],
+        table_header=[get_lxml_text(e) for e in tree.xpath('//thead[' + get_xpath_class('table__header') + ']')])
+
+def get_xpath_class(class_name):   # element has class_name among its classes, as BeautifulSoup matches a single class
+    return 'contains(concat(" ", normalize-space(@class), " "), " ' + class_name + ' ")'
+
+def get_lxml_text(element):
+    # BeautifulSoup collapses whitespace-only strings to a newline (or a space), keep the texts identical
+    return ''.join(t if t.strip(' \n\t\f\r') else '\n' if '\n' in t else ' ' for t in element.itertext())
+
+# Statement page extractors, picked in this order when available
+PAGE_EXTRACTORS = {'lxml': get_statement_page_lxml, 'bs4': get_statement_page_bs4} if lxml_html else {'bs4': get_statement_page_bs4}
+PAGE_EXTRACTOR = os.environ.get('PAGE_EXTRACTOR') or next(iter(PAGE_EXTRACTORS))
+LXML_PARSER = lxml_html.HTMLParser(encoding='utf-8') if lxml_html else None
+
+# Line items of the report: statement and how the TTM/MRQ value follows from the 5 quarters, the 'sum' of the last 4,
+# the 'last' quarter or ('growth', item): of the TTM value of item over its last annual value
+LINE_ITEMS = {
+    'revenue': ('is', 'sum'), 'revenue_growth': ('is', ('growth', 'revenue')), 'eps': ('is', 'sum'),
+    'eps_growth': ('is', ('growth', 'eps')), 'pretax_income': ('is', 'sum'), 'net_income': ('is', 'sum'),
+    'interest_expense': ('is', 'sum'), 'research_development': ('is', 'sum'), 'ebitda': ('is', 'sum'), 'shares': ('is', 'last'),
+    'equity': ('bs', 'last'), 'longterm_debt': ('bs', 'last'), 'total_assets': ('bs', 'last'),
+    'intangible_assets': ('bs', 'last'), 'current_liabilities': ('bs', 'last'), 'cash': ('bs', 'last'),
+    'net_investing_cash_flow': ('cf', 'sum'), 'free_cash_flow': ('cf', 'sum'),
+}
+STATEMENT_PAGES = {'is': ('ais', 'qis'), 'bs': ('abs', 'qbs'), 'cf': ('acf', 'qcf')}
+# Row labels of the line items by company profile (the rows of several labels are summed), new items and labels go here
+INDUSTRIAL_LABELS = {
+    'revenue': ['Sales/Revenue'], 'revenue_growth': ['Sales Growth'], 'eps': ['EPS (Diluted)'], 'eps_growth': ['EPS (Diluted) Growth'],
+    'pretax_income': ['Pretax Income'], 'net_income': ['Net Income'], 'interest_expense': ['Interest Expense'],
+    'research_development': ['Research & Development'], 'ebitda': ['EBITDA'], 'shares': ['Diluted Shares Outstanding'],
+    'equity': ["Total Shareholders' Equity"], 'longterm_debt': ['Long-Term Debt excl. Capitalized Leases'],
+    'total_assets': ['Total Assets'], 'intangible_assets': ['Intangible Assets'],
+    'current_liabilities': ['Total Current Liabilities'], 'cash': ['Cash & Short Term Investments'],
+    'net_investing_cash_flow': ['Net Investing Cash Flow'], 'free_cash_flow': ['Free Cash Flow'],
+}
+LINE_ITEM_PROFILES = {
+    'industrial': INDUSTRIAL_LABELS,
+    # top-line of Financial companies: Interest and non-Interest Income
+    'bank': dict(INDUSTRIAL_LABELS, revenue=['Net Interest Inc After Loan Loss Prov', 'Non-Interest Income'],
+                revenue_growth=['Net Interest Inc After Loan Loss Prov Growth'], cash=['Cash & Due from Banks']),
+    # unclassified balance sheet, capital employed is the total assets
+    'insurer': dict(INDUSTRIAL_LABELS, current_liabilities=[]),
+}
+PROFILE_MARKERS = {'bank': 'Net Interest Income', 'insurer': 'Premiums Earned'}   # row labels of the annual income statement
+
+def get_label_pattern(labels):
+    # a row title is its label, or the label twice (full and mobile cells of the row), after collapsing whitespace
+    return re.compile('^(?P<label>' + '|'.join(map(re.escape, sorted(labels, key=len, reverse=True))) + ')(?: ?(?P=label))?$')
+
+LINE_ITEM_INDEX = {profile: {label: item for item, labels in item_labels.items() for label in labels}
+                    for profile, item_labels in LINE_ITEM_PROFILES.items()}
+LINE_ITEM_PATTERNS = {profile: get_label_pattern(label_items) for profile, label_items in LINE_ITEM_INDEX.items()}
+PROFILE_PATTERN = get_label_pattern(PROFILE_MARKERS.values())
+REPORT_COLUMNS = {
+    'Revenue($)': 'revenue', 'Revenue Growth(%)': 'revenue_growth', 'EPS($)': 'eps', 'EPS Growth(%)': 'eps_growth',
+    'Pretax Income($)': 'pretax_income', 'Net Income($)': 'net_income', 'Interest Expense($)': 'interest_expense',
+    'EBITDA($)': 'ebitda', 'Research & Development($)': 'research_development', 'Shares Outstanding': 'shares',
+    'Longterm Debt($)': 'longterm_debt', 'Shareholder Equity($)': 'equity', 'Total Assets($)': 'total_assets',
+    'Intangible Assets($)': 'intangible_assets', 'Total Current Liabilities($)': 'current_liabilities', 'Cash($)': 'cash',
+    'Net Investing Cash Flow($)': 'net_investing_cash_flow', 'Free Cash Flow($)': 'free_cash_flow',
+}
+CURRENT_YEAR_COUNT = 5  # annual values of the report before the TTM/MRQ value
+
+def get_statement_profile(statement_page):
+    # company profile of the annual income statement page
+    for row in statement_page.rows:
+        marker = PROFILE_PATTERN.match(' '.join(row.text.split()))
+        if marker:
+            return next(profile for profile, label in PROFILE_MARKERS.items() if label == marker['label'])
+    return 'industrial'
+
+@lru_cache(maxsize=4096)    # the same row titles on every page of a profile
+def get_row_item(profile, row_text):
+    label = LINE_ITEM_PATTERNS[profile].match(' '.join(row_text.split()))
+    return LINE_ITEM_INDEX[profile][label['label']] if label else None
+
+def get_ttm_value(rule, quarters):
+    if not quarters:
         return None
+    if rule == 'last':  # MRQ (balance sheet), last quarter reported (shares)
+        return quarters[-1]
+    return sum(quarters[1:]) or None if all(v is not None for v in quarters[1:]) else None     # last 4 of 5 qtrs
+
+def add_numbers(a, b):
+    return a + b if a is not None and b is not None else None
 
+def get_growth(current, previous):
+    return current/previous - 1 if current is not None and previous else None
+
+def get_report_df(fin_report_records):
+    """
+    Financial report df from the records kept in fin-store, with the numbers as floats (NaN if missing)
+    """
+    df = pd.DataFrame.from_dict(fin_report_records)
+    # missing values, or formatted strings in snapshots saved before numeric storage, parsed in one pass
+    object_cols = [col for col in list(df.columns)[1:] if df[col].dtype == object]
+    if object_cols:
+        df[object_cols] = get_numbers_from_strings(df[object_cols].to_numpy())
+    return df
+
+# Display strings of get_string_from_number: '1,234.50', '-0.25', '(2.10B)' negative, '12.00%' ratio; '-' or '--' missing
+NUMBER_UNITS = {'M': 1e6, 'B': 1e9, 'T': 1e12, '%': 0.01}
+
+def get_numbers_from_strings(str_values):
+    """
+    Vectorized get_number_from_string over a Series or array (any shape) of display strings, numbers are kept and
+    missing markers (or any string that is not a number) are NaN, without raising. Returns floats of the same shape
+    """
+    values = np.asarray(str_values, dtype=object)
+    cells = pd.Series(values.ravel(), dtype=object)
+    is_text = cells.map(type).eq(str).to_numpy()
+    numbers = pd.to_numeric(cells.where(~is_text), errors='coerce').to_numpy(dtype=float)
+    if is_text.any():   # the strings as one column: sign, unit and separators taken off, then parsed by pd.to_numeric
+        text = cells[is_text]
+        is_negative = text.str.contains('(', regex=False).to_numpy(dtype=bool)
+        text = text.str.strip(' \t\n()')
+        scales = text.str.get(-1).map(NUMBER_UNITS).to_numpy(dtype=float)
+        has_unit = ~np.isnan(scales)
+        text = text.str.replace(',', '', regex=False)
+        text[has_unit] = text[has_unit].str[:-1]
+        text_numbers = pd.to_numeric(text, errors='coerce').to_numpy(dtype=float) * np.where(has_unit, scales, 1)
+        numbers[is_text] = np.where(is_negative, -text_numbers, text_numbers)
+    numbers = numbers.reshape(values.shape)
+    return pd.Series(numbers, index=str_values.index, name=str_values.name) if isinstance(str_values, pd.Series) else numbers
+
+def get_number_from_string(str_value):
+    number = get_numbers_from_strings([str_value])[0]
+    return None if np.isnan(number) else number
 
 def get_string_from_number(num_value, ratio_to_percent=False):
+    if num_value is None or num_value != num_value:     # missing (None or NaN)
+        return '-'
     if abs(num_value) > 1e12:
         return '{:.2f}'.format(num_value/1e12) + 'T' if num_value >= 0 else '(' + '{:.2f}'.format(-num_value/1e12) + 'T)'
     if abs(num_value) > 1e9:
@@ -338,23 +749,48 @@ def get_string_from_number(num_value, ratio_to_percent=False):
         return '{:.2f}'.format(num_value*100) + '%' if num_value >= 0 else '(' + '{:.2f}'.format(-num_value*100) + '%)'
     return '{:.2f}'.format(num_value)
 
-@cache.memoize(timeout=TIMEOUT_12HR*2*7)    # weekly update
+# get_strings_from_numbers formats by unit (none, T, B, M, %) and sign: the scale of the unit and the format of
+# non-negative values, of negative values
+NUMBER_FORMATS = [(1, '%.2f', '%.2f'), (1e12, '%.2fT', '(%.2fT)'), (1e9, '%.2fB', '(%.2fB)'), (1e6, '%.2fM', '(%.2fM)'),
+                    (0.01, '%.2f%%', '(%.2f%%)')]
+
+def get_strings_from_numbers(num_values, ratio_to_percent=False):
+    """
+    get_string_from_number over a Series or array of numbers: the units, scales and signs are selected with NumPy,
+    leaving one %-format per value (several times faster than the scalar function), missing values are formatted as '-'
+    """
+    values = np.asarray(num_values, dtype=float)
+    abs_values = np.abs(values)
+    with np.errstate(invalid='ignore'):
+        unit = np.select([abs_values > 1e12, abs_values > 1e9, abs_values > 1e6], [1, 2, 3], 4 if ratio_to_percent else 0)
+        is_negative = (values < 0) & (unit > 0)     # in parentheses, plain numbers keep the minus sign
+    scales = np.array([f[0] for f in NUMBER_FORMATS])[unit]
+    scaled = np.where(is_negative, -values, values) / scales
+    formats = np.array([f[1] for f in NUMBER_FORMATS] + [f[2] for f in NUMBER_FORMATS], dtype=object)[unit + is_negative*len(NUMBER_FORMATS)]
+    strings = [fmt % value if value == value else '-' for fmt, value in zip(formats.ravel().tolist(), scaled.ravel().tolist())]
+    return np.array(strings, dtype=object).reshape(values.shape)
+
+@memoize_swr(cache, timeout=TIMEOUT_12HR*2*7, get_timeout=get_quote_timeout)    # weekly update, sooner after earnings
 def get_yahoo_fin_values(ticker):
-    urlmain = 'https://finance.yahoo.com/quote/'+ticker+'/'
+    # None when the quote page fails, not cached (callers use QUOTE_FALLBACK)
     try:
-        s = BeautifulSoup(requests.get(urlmain).text, features="html.parser")
-        beta = float(s.findAll('td', {'class': 'Ta(end) Fw(600) Lh(14px)', 'data-test': 'BETA_5Y-value'})[0].text)
-        next_earnings_date = s.findAll('td', {'class': 'Ta(end) Fw(600) Lh(14px)', 'data-test': 'EARNINGS_DATE-value'})[0].text
-        return next_earnings_date, beta
+        return io_runtime.run(asyncio.wait_for(fetch_yahoo_fin_values(ticker), FIN_SOURCE_TIMEOUTS['quote']))
     except Exception as e:
         logger.exception(e)
-        return 'N/A', []
+        return None
+
+async def fetch_yahoo_fin_values(ticker):
+    urlmain = 'https://finance.yahoo.com/quote/'+ticker+'/'
+    s = BeautifulSoup(await fetch_url_text(urlmain), features="html.parser")
+    beta = float(s.findAll('td', {'class': 'Ta(end) Fw(600) Lh(14px)', 'data-test': 'BETA_5Y-value'})[0].text)
+    next_earnings_date = s.findAll('td', {'class': 'Ta(end) Fw(600) Lh(14px)', 'data-test': 'EARNINGS_DATE-value'})[0].text
+    return next_earnings_date, beta
 
 @cache.memoize(timeout=TIMEOUT_12HR*2*7)    # weekly update
 def get_overview_fin_values(ticker):
     urlmain = 'https://www.marketwatch.com/investing/stock/'+ticker
     try:
-        s = BeautifulSoup(requests.get(urlmain).text, features="html.parser")
+        s = BeautifulSoup(get_url_text(urlmain), features="html.parser")
         beta = float(s.findAll('div', {'class':'element element--list'})[0].findAll('li', {'class':'kv__item'})[6].findAll('span')[0].text)
         next_earnings_date = '<-Check Yahoo Finance!->'
         return next_earnings_date, beta
@@ -364,13 +800,16 @@ def get_overview_fin_values(ticker):
 
 @cache.memoize(timeout=TIMEOUT_12HR*2)    # daily update
 def get_rates_fin_values():
-    urlmain = 'https://finance.yahoo.com/quote/^TNX' # Treasury Yield 10 Years
     try:
-        s = BeautifulSoup(requests.get(urlmain).text, features="html.parser")
-        return float(s.findAll('fin-streamer', {'data-symbol':'^TNX'})[0].text)
+        return io_runtime.run(asyncio.wait_for(fetch_rates_fin_values(), FIN_SOURCE_TIMEOUTS['rates']))
     except Exception as e:
         logger.exception(e)
-        return 2
+        return RATES_FALLBACK
+
+async def fetch_rates_fin_values():
+    urlmain = 'https://finance.yahoo.com/quote/^TNX' # Treasury Yield 10 Years
+    s = BeautifulSoup(await fetch_url_text(urlmain), features="html.parser")
+    return float(s.findAll('fin-streamer', {'data-symbol':'^TNX'})[0].text)
 
 # %%
 if __name__ == '__main__':
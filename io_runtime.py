@@ -0,0 +1,69 @@
+"""
+Process-wide I/O runtime: one long-lived event loop in a daemon thread and a shared keep-alive ClientSession,
+so warm requests to the same hosts reuse their connections. Sync code (Dash callbacks in worker threads,
+batch runs) submits coroutines to the loop instead of running a loop of its own.
+"""
+import os
+import asyncio
+import threading
+import atexit
+from aiohttp import ClientSession, TCPConnector
+
+IO_CONNECTIONS = 100    # connections of the shared session, in total (per host, see HostRateLimiter)
+IO_KEEPALIVE_TIMEOUT = 60   # seconds an idle connection is kept for the next request to its host
+IO_DNS_CACHE_TTL = 300
+
+class IORuntime:
+    """
+    Event loop running in its own thread, started on first use (again in a forked process) with its ClientSession
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+        self._session = None
+        self._pid = None
+
+    def get_loop(self):
+        with self._lock:
+            if self._loop is None or self._pid != os.getpid():  # the loop thread is not inherited by a forked process
+                self._loop = asyncio.new_event_loop()
+                self._session = None
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._loop.run_forever, name='io-runtime', daemon=True)
+                self._thread.start()
+            return self._loop
+
+    def submit(self, coro):
+        """
+        Schedule coro on the runtime loop, returns its concurrent.futures.Future
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.get_loop())
+
+    def run(self, coro, timeout=None):
+        """
+        Run coro on the runtime loop and wait for its result
+        """
+        if threading.current_thread() is self._thread:    # would wait on itself forever
+            raise RuntimeError('Blocking on the I/O runtime from its own loop, await the coroutine instead')
+        return self.submit(coro).result(timeout)
+
+    async def get_session(self):
+        # on the runtime loop: the shared session, (re)created when needed
+        if self._session is None or self._session.closed:
+            self._session = ClientSession(connector=TCPConnector(limit=IO_CONNECTIONS, keepalive_timeout=IO_KEEPALIVE_TIMEOUT,
+                                                                ttl_dns_cache=IO_DNS_CACHE_TTL))
+        return self._session
+
+    def close(self):
+        with self._lock:
+            loop, session = self._loop, self._session
+            if loop is None or self._pid != os.getpid():
+                return
+            if session is not None and not session.closed:
+                asyncio.run_coroutine_threadsafe(session.close(), loop).result(5)
+            loop.call_soon_threadsafe(loop.stop)
+            self._loop = self._session = None
+
+io_runtime = IORuntime()
+atexit.register(io_runtime.close)
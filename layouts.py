@@ -126,7 +126,7 @@ dcflayout = html.Div([
                         dbc.Input(id="opm-next", type="number", value=0, max=50, step=0.1, placeholder="Enter number", debounce=True
                                 ),
                         html.Br(),
-                        dbc.Label("CAGR (%) for years 2-5 (select range: 0 to 15)", html_for="cagr-2-5"),
+                        dbc.Label("CAGR (%) for years 2-5, or up to the High Growth Years (select range: 0 to 15)", html_for="cagr-2-5"),
                         dcc.Slider(id="cagr-2-5", min=0, max=15, step=0.1, value=5,
                         tooltip={'always_visible': True, 'placement': 'topRight'},
                         marks={v: str(v) for v in range(0, 16)}),
@@ -205,12 +205,12 @@ dcflayout = html.Div([
             html.Br(),
             dcc.Markdown(children='''
             **Other Assumptions for Intrinsic Value DCF Valuation:**\n
-                1. TERMINAL_YEAR_LENGTH = 10
+                1. Forecast horizon of 10 years with 5 high growth years (you can override these)
                 2. No Preferred stock/dividends in capital structure (you can override this)
                 3. No Convertible debt/equity portion in capital structure (you can override this)
             '''),
             dbc.Button("Run DCF calculation again with overrides", id='run-dcf', color='primary'),
-            make_card("DCF table (2-stage Terminal value after 10 years) ", "secondary",
+            make_card("DCF table (Terminal value after the forecast horizon) ", "secondary",
             dbc.Spinner(html.Div(id="dcf-table")))
         ])),
         dbc.Col([
@@ -221,9 +221,55 @@ dcflayout = html.Div([
     ]), # row 3
     dbc.Row([
         dbc.Col([
-
+            make_card("Monte Carlo Valuation (distributions over GPE Levers and Cost of Capital)", "info", dbc.Form([
+                dcc.Store(id='simulation-store'),
+                dbc.Label("Number of draws", html_for="simulation-draws"),
+                dbc.Input(id="simulation-draws", type="number", value=50000, min=1000, max=100000, step=1000, debounce=True),
+                dbc.Label("Distribution of each assumption", html_for="simulation-distribution"),
+                dcc.Dropdown(id='simulation-distribution', value='normal', clearable=False,
+                    options=[{'label': d.capitalize(), 'value': d} for d in ['normal', 'triangular', 'uniform']]),
+                dbc.Label("Spread (%) around the current input values (std for Normal, +/- range otherwise)", html_for="simulation-spread"),
+                dcc.Slider(id="simulation-spread", min=0, max=50, step=1, value=20,
+                marks={v: str(v) for v in range(0, 55, 5)}),
+                dbc.Label("Correlation of CAGR (years 2-5) and Target Operating Margin", html_for="simulation-correlation"),
+                dcc.Slider(id="simulation-correlation", min=-0.9, max=0.9, step=0.1, value=0,
+                marks={v/10: str(v/10) for v in range(-9, 10, 3)}),
+                dbc.Label("Seed (leave empty for a new random run, the seed of a run is shown with its results)", html_for="simulation-seed"),
+                dbc.Input(id="simulation-seed", type="number", min=0, step=1, placeholder="Random", debounce=True),
+                html.Br(),
+                dbc.Button("Run Monte Carlo simulation", id='run-simulation', color='primary'),
+            ]))
+        ]),
+        dbc.Col([
+            make_card("Distribution of Estimated Value per Share", "secondary", dbc.Spinner([
+                dcc.Graph(id='simulation-graph'),
+                html.Div(id="simulation-data")
+            ]))
         ]),
     ]), # row 4
+    dbc.Row([
+        dbc.Col([
+            make_card("Sensitivity Analysis of Estimated Value per Share", "info", [
+                dbc.Label("Select the two-way sensitivity grid", html_for="sensitivity-axes"),
+                dcc.Dropdown(id='sensitivity-axes', value='cost_of_cap:terminal_growth_rate', clearable=False,
+                    options=[{'label': 'Cost of Capital x Terminal Growth Rate', 'value': 'cost_of_cap:terminal_growth_rate'},
+                            {'label': 'CAGR (years 2-5) x Target Operating Margin', 'value': 'cagr_2_5:opm_target'}]),
+                html.Br(),
+                dbc.Button("Run sensitivity analysis", id='run-sensitivity', color='primary'),
+                dbc.Spinner(dcc.Graph(id='sensitivity-graph'))
+            ])
+        ]),
+    ]), # row 5
+    dbc.Row([
+        dbc.Col([
+            make_card("Backtest: Estimated Value per Share as of each report year", "info", [
+                dcc.Markdown('''Default assumptions derived from the report up to each year, other inputs as in the current DCF.
+                The current price is shown for reference, the report has no historical prices.'''),
+                dbc.Button("Run backtest", id='run-backtest', color='primary'),
+                dbc.Spinner(dcc.Graph(id='backtest-graph'))
+            ])
+        ]),
+    ]), # row 6
     html.Hr(),
     dbc.Row([dbc.Col(
         # MD text area Element for interpretation and analysis of data
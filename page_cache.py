@@ -0,0 +1,145 @@
+"""
+Raw page cache below fetch_async: the response bodies keyed by URL, compressed on disk (zstd when zstandard is
+installed, else gzip) with their ETag/Last-Modified validators. A page older than its max age is revalidated with a
+conditional GET, an unchanged page (304) costs no download. Re-parsing cached pages (max_age=PAGE_CACHE_FOREVER)
+costs no network at all. Files are replaced atomically, a page that can't be read whole is not cached, and the least
+recently fetched pages are evicted beyond PAGE_CACHE_MAX_BYTES or PAGE_CACHE_MAX_KEEP.
+"""
+import os
+import gzip
+import json
+import hashlib
+import tempfile
+import time
+from pathlib import Path
+try:
+    import zstandard
+except ImportError:     # gzip only
+    zstandard = None
+
+PAGE_CACHE_DIR = os.environ.get('PAGE_CACHE_DIR', 'app_pages')     # not in the Flask-Caching dir, its clear() expects files only
+PAGE_CACHE_MAX_AGE = 12*60*60   # seconds a page is used without revalidation, as the report cache timeout
+PAGE_CACHE_FOREVER = float('inf')
+PAGE_CACHE_MAX_BYTES = int(os.environ.get('PAGE_CACHE_MAX_BYTES', 1 << 30))  # on disk, compressed
+PAGE_CACHE_MAX_KEEP = 90*24*60*60   # seconds a page is kept since it was last fetched or revalidated
+PAGE_CACHE_PRUNE_EVERY = 200    # page writes of this process between evictions
+
+# compression codecs by file suffix, the first one available compresses new pages
+PAGE_CODECS = {'.zst': (zstandard.ZstdCompressor(level=10).compress, zstandard.ZstdDecompressor().decompress)} if zstandard else {}
+PAGE_CODECS['.gz'] = (lambda body: gzip.compress(body, compresslevel=6), gzip.decompress)
+
+class PageCache:
+    """
+    Page bodies in <cache_dir>/<sha1 of url><codec suffix>, their url, validators and fetch time in a .json sidecar
+    """
+    def __init__(self, cache_dir=PAGE_CACHE_DIR, max_bytes=PAGE_CACHE_MAX_BYTES, max_keep=PAGE_CACHE_MAX_KEEP):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.max_keep = max_keep
+        self.n_writes = 0
+
+    def get_paths(self, url):
+        key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        return Path(self.cache_dir, key + '.json'), {suffix: Path(self.cache_dir, key + suffix) for suffix in PAGE_CODECS}
+
+    def get(self, url):
+        """
+        Cached entry of url: {'text', 'etag', 'last_modified', 'fetched_at'}, None if not cached
+        """
+        meta_path, body_paths = self.get_paths(url)
+        try:
+            entry = json.loads(meta_path.read_text())
+            body_path = body_paths[entry['codec']]
+            entry['text'] = PAGE_CODECS[entry['codec']][1](body_path.read_bytes()).decode('utf-8')
+            return entry
+        except Exception:   # not cached, evicted while read, written by a codec not installed here or corrupt (EOFError, ZstdError...)
+            return None
+
+    def set(self, url, text, etag=None, last_modified=None):
+        meta_path, body_paths = self.get_paths(url)
+        codec = next(iter(PAGE_CODECS))
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        # body first, an interrupted write leaves the previous sidecar pointing at the previous codec or nothing
+        self.write_atomic(body_paths[codec], PAGE_CODECS[codec][0](text.encode('utf-8')))
+        self.write_meta(meta_path, {'url': url, 'codec': codec, 'etag': etag, 'last_modified': last_modified,
+                                    'fetched_at': time.time()})
+        self.n_writes += 1
+        if self.n_writes % PAGE_CACHE_PRUNE_EVERY == 0:
+            self.prune()
+
+    def touch(self, url):
+        """
+        Mark the cached page of url as revalidated now (304 Not Modified)
+        """
+        meta_path, _ = self.get_paths(url)
+        try:
+            entry = json.loads(meta_path.read_text())
+        except Exception:   # evicted meanwhile, cached again at the next fetch
+            return
+        entry['fetched_at'] = time.time()
+        self.write_meta(meta_path, entry)
+
+    def delete(self, url):
+        meta_path, body_paths = self.get_paths(url)
+        for path in [meta_path, *body_paths.values()]:
+            path.unlink(missing_ok=True)
+
+    def write_meta(self, meta_path, entry):
+        self.write_atomic(meta_path, json.dumps(entry).encode('utf-8'))
+
+    def write_atomic(self, path, data):
+        # to a temp file of the cache dir renamed over path, a reader sees the previous file or the new one whole
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as tmp_file:
+                tmp_file.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            Path(tmp_path).unlink(missing_ok=True)
+            raise
+
+    def prune(self):
+        """
+        Evict the pages not fetched within max_keep seconds, then the least recently fetched ones beyond max_bytes,
+        and temp files left by interrupted writes. Returns the number of pages evicted
+        """
+        pages = {}  # key: [meta mtime, bytes, paths]
+        now = time.time()
+        for path in self.cache_dir.glob('*'):
+            try:
+                stat = path.stat()
+            except OSError:     # removed meanwhile
+                continue
+            if path.suffix == '.tmp':
+                if now - stat.st_mtime > 60*60:
+                    path.unlink(missing_ok=True)
+                continue
+            page = pages.setdefault(path.stem, [0, 0, []])
+            if path.suffix == '.json':
+                page[0] = stat.st_mtime     # rewritten at each fetch and revalidation
+            page[1] += stat.st_size
+            page[2].append(path)
+        total_bytes = sum(page[1] for page in pages.values())
+        n_evicted = 0
+        for fetched_at, size, paths in sorted(pages.values(), key=lambda page: page[0]):
+            if now - fetched_at <= self.max_keep and total_bytes <= self.max_bytes:
+                break
+            for path in paths:
+                path.unlink(missing_ok=True)
+            total_bytes -= size
+            n_evicted += 1
+        return n_evicted
+
+    def get_validators(self, entry):
+        # conditional request headers of a cached entry
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def is_fresh(self, entry, max_age=PAGE_CACHE_MAX_AGE):
+        return time.time() - entry['fetched_at'] < max_age
+
+page_cache = PageCache()
@@ -0,0 +1,130 @@
+"""
+Cache pre-warmer: refreshes the financial reports and sector collections users request most, and the treasury rate,
+before their cached values go stale, so the next user finds them warm instead of waiting through the scrape.
+
+    python prewarm.py --top 50 --interval 3600
+
+Requests are counted per ticker and sector in redis sorted sets (see record_request, the counts decay at each run so
+the top follows current interest, and the rarely requested names are dropped), with how many of them found a warm
+cache (see get_request_stats).
+A run refreshes at most --workers values at a time, and skips a value another worker is already computing,
+to leave the upstream hosts to live traffic.
+"""
+import time
+import asyncio
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from redis.exceptions import RedisError
+# Local imports
+from app import cache, db, logger
+from io_runtime import io_runtime
+from get_fin_report import get_financial_report, get_sector_data, get_rates_fin_values, fetch_rates_fin_values, FIN_SOURCE_TIMEOUTS
+
+PREWARM_KEYS = {'ticker': 'prewarm:tickers', 'sector': 'prewarm:sectors'}  # request counts, by kind
+PREWARM_STATS_KEY = 'prewarm:requests'
+PREWARM_TOP_N = 50
+PREWARM_INTERVAL = 60*60    # seconds between runs, values going stale before the next run are refreshed
+PREWARM_WORKERS = 2
+PREWARM_DECAY = 0.9     # request counts kept at each run
+PREWARM_MIN_COUNT = 0.1     # names decayed below are dropped, a single request after about 22 runs
+PREWARM_MAX_NAMES = 1000    # most requested names kept per kind
+
+def record_request(kind, name, warm):
+    """
+    Count a user request of name (kind 'ticker' or 'sector'), warm when its value was cached (fresh or stale)
+    """
+    try:
+        with db.pipeline() as pipe:
+            pipe.zincrby(PREWARM_KEYS[kind], 1, name)
+            pipe.hincrby(PREWARM_STATS_KEY, kind + ':requests', 1)
+            if warm:
+                pipe.hincrby(PREWARM_STATS_KEY, kind + ':warm', 1)
+            pipe.execute()
+    except RedisError as e:     # not counted, the request goes on
+        logger.warning(f'Request of {name} not recorded: {type(e).__name__} {e}')
+
+def get_top_requested(kind, top_n=PREWARM_TOP_N):
+    return [name.decode('utf-8') for name in db.zrevrange(PREWARM_KEYS[kind], 0, top_n - 1)]
+
+def get_request_stats():
+    """
+    User requests by kind, with how many found a warm cache
+    """
+    counts = {k.decode('utf-8'): int(v) for k, v in db.hgetall(PREWARM_STATS_KEY).items()}
+    stats = {}
+    for kind in PREWARM_KEYS:
+        requests, warm = counts.get(kind + ':requests', 0), counts.get(kind + ':warm', 0)
+        stats[kind] = {'requests': requests, 'warm': warm, 'warm_ratio': warm / requests if requests else None}
+    return stats
+
+def get_due_refreshes(names_by_memoized, ahead=PREWARM_INTERVAL):
+    """
+    (memoized, name) of the names whose cached value is missing or goes stale within ahead seconds, and the number
+    of fresh ones
+    """
+    due, n_fresh = [], 0
+    for memoized, names in names_by_memoized:
+        for name in names:
+            fresh_seconds = memoized.get_fresh_seconds(name)
+            if fresh_seconds is not None and fresh_seconds > ahead:
+                n_fresh += 1
+            else:
+                due.append((memoized, name))
+    return due, n_fresh
+
+def refresh_rates_fin_values():
+    # get_rates_fin_values caches its fallback on failure, the prewarmer keeps the cached rate instead
+    value = io_runtime.run(asyncio.wait_for(fetch_rates_fin_values(), FIN_SOURCE_TIMEOUTS['rates']))
+    cache.set(get_rates_fin_values.make_cache_key(get_rates_fin_values.uncached), value, timeout=get_rates_fin_values.cache_timeout)
+    return value
+
+def prewarm(top_n=PREWARM_TOP_N, ahead=PREWARM_INTERVAL, workers=PREWARM_WORKERS):
+    """
+    Refresh the top_n most requested reports and sector collections due within ahead seconds, and the treasury rate.
+    Returns the counts of refreshed, fresh, skipped (refreshing elsewhere or no value) and failed values
+    """
+    due, n_fresh = get_due_refreshes([(get_financial_report, get_top_requested('ticker', top_n)),
+                                    (get_sector_data, get_top_requested('sector', top_n))], ahead)
+    counts = {'refreshed': 0, 'fresh': n_fresh, 'skipped': 0, 'failed': 0}
+    with ThreadPoolExecutor(workers, thread_name_prefix='prewarm') as executor:
+        futures = {executor.submit(memoized.refresh, name): name for memoized, name in due}
+        futures[executor.submit(refresh_rates_fin_values)] = 'riskfree rate'
+        for future in as_completed(futures):
+            try:
+                counts['refreshed' if future.result() is not None else 'skipped'] += 1
+            except Exception as e:
+                logger.warning(f'Prewarm of {futures[future]} failed: {type(e).__name__} {e}')
+                counts['failed'] += 1
+    decay_request_counts()
+    return counts
+
+def decay_request_counts(decay=PREWARM_DECAY, min_count=PREWARM_MIN_COUNT, max_names=PREWARM_MAX_NAMES):
+    # one-off and mistyped names leave the sorted sets instead of piling up
+    with db.pipeline() as pipe:
+        for key in PREWARM_KEYS.values():
+            pipe.zunionstore(key, {key: decay})
+            pipe.zremrangebyscore(key, '-inf', f'({min_count}')
+            pipe.zremrangebyrank(key, 0, -max_names - 1)
+        pipe.execute()
+
+def run_prewarm_schedule(interval=PREWARM_INTERVAL, **prewarm_kwargs):
+    while True:
+        start = time.monotonic()
+        counts = prewarm(ahead=interval, **prewarm_kwargs)
+        logger.info(f'Prewarm: {counts}, user requests: {get_request_stats()}')
+        time.sleep(max(0, interval - (time.monotonic() - start)))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Refresh the most requested reports and sectors before they go stale')
+    parser.add_argument('--top', type=int, default=PREWARM_TOP_N, help='most requested tickers and sectors to keep warm')
+    parser.add_argument('--interval', type=int, default=PREWARM_INTERVAL, help='seconds between runs')
+    parser.add_argument('--workers', type=int, default=PREWARM_WORKERS, help='refreshes at a time')
+    parser.add_argument('--once', action='store_true', help='run once and exit')
+    args = parser.parse_args(argv)
+    if args.once:
+        print(f'Prewarm: {prewarm(args.top, args.interval, args.workers)}, user requests: {get_request_stats()}')
+    else:
+        run_prewarm_schedule(args.interval, top_n=args.top, workers=args.workers)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+Sector table: the advanced-stats of the companies of the selected sectors as one typed columnar DataFrame, built once
+per selection with its derived metrics and the ratio columns scaled to %, sorted by enterprise value so that
+filtering an EV range is a slice (see get_sector_slice).
+Tables stay server-side, in this worker and in redis for the other workers, under a short handle of the selection:
+the browser keeps only the handle (sector-store) and receives only the points of the figure.
+"""
+import time
+import hashlib
+import numpy as np
+import pandas as pd
+# Local imports
+from get_fin_report import get_sector_data
+from cache_utils import LRUResultCache
+
+SECTOR_REQUIRED_COLUMNS = ['marketcap', 'enterpriseValue', 'profitMargin', 'enterpriseValueToRevenue']
+SECTOR_DERIVED_COLUMNS = ['EBITDAToEV(%)', 'EBITDAToRevenueMargin', 'TotalAssets', 'EBITDAToAssets(%)']
+SECTOR_TEXT_COLUMNS = ['companyName', 'sector']
+SECTOR_TABLE_TTL = 60*60    # seconds a table is reused, refreshed sector data shows up after at most this
+
+# keyed on (handle, TTL period), shared with the other workers through cache_redis
+sector_tables = LRUResultCache(maxsize=16, use_redis=True, timeout=SECTOR_TABLE_TTL, redis_prefix='sector-table-', name='sector table')
+
+def is_ratio_column(col):   # scaled up by 100 for display
+    return 'Margin' in col or 'Percent' in col or '%' in col
+
+def get_sector_table(sector_data_by_sector):
+    """
+    Sector table of {sector: get_sector_data(sector)}, indexed by ticker (the last sector of a ticker wins),
+    without the companies missing a required column
+    """
+    frames = [pd.DataFrame.from_dict({ticker: data['advanced-stats'] for ticker, data in sector_data.items()}, orient='index').assign(sector=sector)
+                for sector, sector_data in sector_data_by_sector.items() if sector_data]
+    if not frames:
+        return pd.DataFrame(columns=SECTOR_REQUIRED_COLUMNS + SECTOR_DERIVED_COLUMNS + SECTOR_TEXT_COLUMNS)
+    table = pd.concat(frames)
+    table = table[~table.index.duplicated(keep='last')]
+    for col in table.columns:
+        if col in SECTOR_TEXT_COLUMNS:
+            table[col] = table[col].astype('category' if col == 'sector' else str)
+        elif table[col].dtype == object:    # numbers with missing values, dates and other text stay as they are
+            numbers = pd.to_numeric(table[col], errors='coerce')
+            if numbers.notna().sum() == table[col].notna().sum():
+                table[col] = numbers
+    table = table.dropna(subset=SECTOR_REQUIRED_COLUMNS)
+    table['EBITDAToEV(%)'] = table.EBITDA / table.enterpriseValue
+    table['EBITDAToRevenueMargin'] = table['EBITDAToEV(%)'] * table.enterpriseValueToRevenue
+    table['TotalAssets'] = (table.marketcap / table.priceToBook) * (1 + table.debtToEquity) + table.currentDebt
+    # Alternate Debt + Equity: (table.enterpriseValue - table.marketcap + table.totalCash) * (1 + 1/table.debtToEquity)
+    table['EBITDAToAssets(%)'] = table.EBITDA / table.TotalAssets
+    ratio_cols = [col for col in table.columns if is_ratio_column(col) and pd.api.types.is_numeric_dtype(table[col])]
+    table[ratio_cols] = table[ratio_cols] * 100
+    return table.sort_values('enterpriseValue', kind='stable')
+
+def get_sector_handle(sector_names):
+    # the same handle for a selection in any order
+    return hashlib.sha1(repr(tuple(sorted(sector_names))).encode()).hexdigest()[:16]
+
+def get_selected_sector_table(sector_names):
+    """
+    Sector table of the selected sectors (in any order), built by the first worker asking for it in each TTL period
+    """
+    key = (get_sector_handle(sector_names), int(time.time() // SECTOR_TABLE_TTL))
+    return sector_tables.get_or_compute(key, lambda _: get_sector_table({s: get_sector_data(s) for s in sorted(sector_names)}))
+
+def get_sector_slice(table, ev_limits, company_selections=None):
+    """
+    Companies of the table with an enterprise value within 10**ev_limits, of company_selections (names) when given
+    """
+    ev = table['enterpriseValue'].to_numpy()
+    start, end = np.searchsorted(ev, 10 ** ev_limits[0], side='left'), np.searchsorted(ev, 10 ** ev_limits[1], side='right')
+    sector_slice = table.iloc[start:end]
+    if company_selections:
+        sector_slice = sector_slice[sector_slice['companyName'].isin(company_selections).to_numpy()]
+    return sector_slice
@@ -0,0 +1,67 @@
+import os,sys,inspect,json,time
+import unittest
+from pathlib import Path
+current_dir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+sys.path.insert(0, os.path.dirname(current_dir))
+from fetch_corpus import is_replay, read_corpus
+from get_fin_report import get_financial_report_urls, get_statement_page, get_statement_lines, get_report_frame, get_report_ratios, \
+    FINDATA_KEYS
+
+BENCHMARK_TICKERS = ['AAPL', 'BAC', 'PGR', 'EPR', 'EAF', 'SKX', 'MU']
+BENCHMARK_REPEAT = int(os.environ.get('BENCHMARK_REPEAT', 20))
+# a stage fails when slower than BENCHMARK_TOLERANCE x its baseline + BENCHMARK_MIN_MS (timer noise of the short stages).
+# The baselines (ms) are pinned in the repo, per ticker when recorded with BENCHMARK_WRITE_BASELINE=1, else the
+# budgets of 'default'
+BENCHMARK_BASELINE_PATH = Path(current_dir, 'benchmark_baseline.json')
+BENCHMARK_TOLERANCE = float(os.environ.get('BENCHMARK_TOLERANCE', 1.5))
+BENCHMARK_MIN_MS = float(os.environ.get('BENCHMARK_MIN_MS', 1.0))
+BENCHMARK_WRITE_BASELINE = os.environ.get('BENCHMARK_WRITE_BASELINE', 'False').lower() in ('1', 'true')
+
+def get_stage_timings(ticker, repeat=BENCHMARK_REPEAT):
+    """
+    Best of repeat timings (ms) of the get_financial_report stages for the recorded pages of ticker
+    """
+    timings = {}
+    def timed(stage, func):
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = func()
+            best = min(best, time.perf_counter() - start)
+        timings[stage] = 1e3 * best
+        return result
+    urls = get_financial_report_urls(ticker)
+    page_texts = timed('fetch', lambda: [read_corpus(url) for url in urls])
+    statement_pages = timed('parse', lambda: [get_statement_page(page_text) for page_text in page_texts])
+    finsoup = dict(zip(FINDATA_KEYS, statement_pages))
+    data_lines = timed('row mapping', lambda: get_statement_lines(finsoup))
+    df = timed('dataframe', lambda: get_report_frame(*data_lines))
+    timed('derived ratios', lambda: get_report_ratios(df.copy()))
+    return timings
+
+@unittest.skipUnless(is_replay(), 'No fetch corpus, set FETCH_CORPUS_DIR (see fetch_corpus.py)')
+class ParserBenchmarkTest(unittest.TestCase):
+    def setUp(self):
+        self.result = None
+    def tearDown(self):
+        pass
+    def testwithParserStages(self):
+        self.result = {}
+        for ticker in BENCHMARK_TICKERS:
+            try:
+                self.result[ticker] = get_stage_timings(ticker)
+            except FileNotFoundError:   # not recorded
+                continue
+            print(ticker, ', '.join(f'{stage}: {ms:.2f}ms' for stage, ms in self.result[ticker].items()))
+        if not self.result:
+            self.skipTest('None of the benchmark tickers is in the fetch corpus')
+        baseline = json.loads(BENCHMARK_BASELINE_PATH.read_text())
+        if BENCHMARK_WRITE_BASELINE:    # on the reference machine, the file is then committed
+            BENCHMARK_BASELINE_PATH.write_text(json.dumps({'default': baseline['default'], **self.result}, indent=2) + '\n')
+            return
+        for ticker, timings in self.result.items():
+            for stage, ms in timings.items():
+                with self.subTest(ticker=ticker, stage=stage):
+                    baseline_ms = baseline.get(ticker, baseline['default'])[stage]
+                    self.assertLessEqual(ms, BENCHMARK_TOLERANCE*baseline_ms + BENCHMARK_MIN_MS,
+                                        f'FAIL with: {ticker} {stage} regressed from {baseline_ms:.2f}ms')
@@ -0,0 +1,100 @@
+import os,sys,inspect,time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+current_dir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+sys.path.insert(0, os.path.dirname(current_dir))
+from get_fin_report import get_yahoo_fin_values, get_report_timeout, get_quote_timeout, REPORT_TTL_MAX, REPORT_TTL_NEAR_EARNINGS, \
+    TIMEOUT_12HR, cache
+from cache_utils import memoize_swr, get_cache_stats, LRUResultCache
+from prewarm import get_due_refreshes
+
+class CacheUnitTest(unittest.TestCase):
+    def setUp(self):
+        self.result = None
+        pass
+    def tearDown(self):
+        pass
+    def testwithSWRMemoize(self):
+        calls = []
+        def get_value(key):
+            calls.append(key)
+            time.sleep(0.2)
+            return len(calls)
+        memoized = memoize_swr(cache, timeout=1, stale_timeout=60)(get_value)
+        memoized.delete('k')
+        try:
+            with ThreadPoolExecutor(8) as executor:     # concurrent misses share one computation
+                self.result = list(executor.map(memoized, ['k']*8))
+            self.assertEqual(self.result, [1]*8)
+            self.assertEqual(len(calls), 1)
+            self.assertEqual(memoized('k'), 1)
+            time.sleep(1.1)
+            self.assertEqual([memoized('k') for _ in range(3)], [1]*3)  # stale, served while a single refresh runs
+            time.sleep(0.5)
+            self.assertEqual(memoized('k'), 2)
+            self.assertEqual(len(calls), 2)
+            stats = get_cache_stats()[memoized.name]
+            self.assertEqual((stats['misses'], stats['collapsed'], stats['refreshes']), (8, 7, 2))
+            self.assertGreaterEqual(stats['stale_hits'], 3)
+            self.assertGreaterEqual(stats['refresh_seconds_max'], 0.2)
+        finally:
+            memoized.delete('k')
+    def testwithLRUResultCache(self):
+        results = LRUResultCache(maxsize=2, name='test result')
+        for record in [('a', 1), ('b', 2), ('a', 1), ('c', 3)]:
+            self.result = results.get_or_compute(record, lambda r: r[1] * 10)
+        self.assertEqual(self.result, 30)
+        self.assertEqual((results.get(('a', 1)), results.get(('b', 2))), (10, None))    # b least recently used
+        self.assertEqual(results.stats()['hits'], 2)
+        self.assertEqual(results.stats()['size'], 2)
+    def testwithSWRCacheDown(self):
+        class DownCache:    # as cache_redis when redis is not reachable
+            def get(self, key):
+                raise ConnectionError('cache down')
+            set = delete = get
+        memoized = memoize_swr(DownCache(), timeout=60)(lambda ticker: ticker.lower())
+        self.result = [memoized('AAPL'), memoized('AAPL')]  # computed each time, not cached
+        self.assertEqual(self.result, ['aapl', 'aapl'])
+        self.assertIsNone(memoized.get_fresh_seconds('AAPL'))
+        self.assertFalse(memoized.is_cached('AAPL'))
+        stats = get_cache_stats()[memoized.name]
+        self.assertEqual((stats['misses'], stats['refreshes']), (2, 2))
+        self.assertGreaterEqual(stats['cache_errors'], 3)
+    def testwithPrewarmDue(self):
+        memoized = memoize_swr(cache, timeout=3600, stale_timeout=3600)(lambda ticker: ticker.lower())
+        for ticker in ('AAPL', 'MSFT', 'BAC'):
+            memoized.delete(ticker)
+        try:
+            memoized('AAPL')
+            memoized.set_cached('msft', 'MSFT')
+            self.assertEqual([memoized.is_cached(t) for t in ('AAPL', 'MSFT', 'BAC')], [True, True, False])
+            self.result = get_due_refreshes([(memoized, ['AAPL', 'MSFT', 'BAC'])], ahead=600)
+            self.assertEqual(self.result, ([(memoized, 'BAC')], 2))  # AAPL and MSFT fresh for an hour
+            self.result = get_due_refreshes([(memoized, ['AAPL', 'MSFT', 'BAC'])], ahead=7200)
+            self.assertEqual([name for _, name in self.result[0]], ['AAPL', 'MSFT', 'BAC'])
+            self.assertEqual(memoized.refresh('BAC'), 'bac')
+            self.assertGreater(memoized.get_fresh_seconds('BAC'), 3500)
+        finally:
+            for ticker in ('AAPL', 'MSFT', 'BAC'):
+                memoized.delete(ticker)
+    def testwithEarningsTTL(self):
+        today = datetime.now()
+        def get_note(mrq_date):
+            return mrq_date.strftime('%d-%b-%Y') + ', Fiscal year is October-September. All values USD Millions.'
+        get_yahoo_fin_values.set_cached(('N/A', 1.2), 'ZZZZ')  # fresh for a week, no earnings date
+        # long between filings, capped
+        self.assertAlmostEqual(get_report_timeout((None, None, None, get_note(today - timedelta(days=10))), 'ZZZZ'), REPORT_TTL_MAX, delta=60)
+        self.assertAlmostEqual(get_report_timeout((None, None, None, get_note(today - timedelta(days=100))), 'ZZZZ'), 5*86400, delta=86400)
+        # filing due, or no MRQ date: as before
+        self.assertEqual(get_report_timeout((None, None, None, get_note(today - timedelta(days=120))), 'ZZZZ'), REPORT_TTL_NEAR_EARNINGS)
+        self.assertEqual(get_report_timeout((None, None, None, ''), 'ZZZZ'), REPORT_TTL_NEAR_EARNINGS)
+        earnings_date = (today + timedelta(days=3)).strftime('%b %d, %Y')
+        # the next earnings date of the quote, and no longer than the quote stays fresh
+        get_yahoo_fin_values.set_cached((earnings_date, 1.2), 'ZZZZ')
+        self.assertAlmostEqual(get_report_timeout((None, None, None, get_note(today - timedelta(days=10))), 'ZZZZ'), 2.5*86400, delta=86400)
+        cache.set(get_yahoo_fin_values.make_cache_key('ZZZZ'), {'value': ('N/A', 1.2), 'fresh_until': time.time() + 86400})
+        self.assertAlmostEqual(get_report_timeout((None, None, None, get_note(today - timedelta(days=10))), 'ZZZZ'), 86400, delta=60)
+        get_yahoo_fin_values.delete('ZZZZ')
+        self.assertAlmostEqual(get_quote_timeout((earnings_date + ' - ' + earnings_date, 1.2), 'ZZZZ'), 3*86400, delta=86400)
+        self.assertEqual(get_quote_timeout(('N/A', 1.2), 'ZZZZ'), TIMEOUT_12HR*2*7)
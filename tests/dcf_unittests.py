@@ -1,17 +1,32 @@
-import os,sys,inspect
+import os,sys,inspect,json,tempfile
 import unittest
+import numpy as np
 current_dir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
 sys.path.insert(0, os.path.dirname(current_dir))
-from callbacks import check_ticker_validity
+from callbacks import check_ticker_validity, restore_simulation_settings, restore_horizon_settings
 from get_fin_report import get_financial_report, get_yahoo_fin_values
-from get_dcf_valuation import get_dcf_df
+from get_dcf_valuation import get_dcf_df, get_dcf_inputs, get_dcf_batch, get_simulation_distributions, get_dcf_simulation, \
+    get_dcf_sensitivity, get_dcf_tornado, get_dcf_input_record, dcf_cache, \
+    get_dcf_result, dcf_projection_cache, get_dcf_implied, get_dcf_summary_df, get_dcf_backtest, TERMINAL_YEAR_LENGTH
+from batch_valuation import run_batch_valuation
+import pandas as pd
+
+DCF_INPUT = {'AAPL':{'stats_dict':{'lastprice':115}}}
+
+def get_dcf_args(riskfree_rate='1.25', terminal_growth_rate='3.5', terminal_growth_eq_riskfree_rate=False):
+    # dcf_valuation callback arguments of the AAPL fixture, valued 73.00 per share as is
+    return [DCF_INPUT, '0', '10', '5', '32', '1.2', '15', riskfree_rate, terminal_growth_rate, '8.5', None,
+            273430, 17890, 10630, 86220, 2.97, 93050, 94050, 17250, 0, 0, 0, 3, 29, 0, terminal_growth_eq_riskfree_rate, [1],
+            '1f46bbc4-b0b5-5932-8ccf-9f4ebda9e047']
+
+DCF_ARGS = get_dcf_args()
 
 class DCFUnitTest(unittest.TestCase):
     def setUp(self):
         self.result = None
         pass
     def tearDown(self):
-        pass    
+        pass
     def testwithValidTicker(self):
         for ticker in ['AAPL', 'BAC', 'PGR', 'EPR', 'EAF', 'SKX', 'MU']:
             self.result = get_financial_report(ticker)
@@ -23,10 +38,109 @@ class DCFUnitTest(unittest.TestCase):
         self.result = get_yahoo_fin_values('WMT')
         self.assertTrue(self.result[1] < 0.5)
     def testwithDCFinputs(self):
-        dcf_input = {'AAPL':{'stats_dict':{'lastprice':115}}}
-        self.result = get_dcf_df(dcf_input, '0', '10', '5', '32', '1.2', '15', '1.25', '3.5', '8.5', None, 
-                                    273430, 17890, 10630, 86220, 2.97, 93050, 94050, 17250, 0, 0, 0, 3, 29, 0, False, [1], '1f46bbc4-b0b5-5932-8ccf-9f4ebda9e047')
+        self.result = get_dcf_df(*DCF_ARGS)
+        self.assertAlmostEqual(self.result[1]['estimated_value_per_share'], 73.00, delta=0.01)
+        self.result = get_dcf_df(*get_dcf_args(riskfree_rate='4.5', terminal_growth_rate='6.5', terminal_growth_eq_riskfree_rate=True))
+        self.assertAlmostEqual(self.result[1]['estimated_value_per_share'], 84.67, delta=0.01)
+    def testwithDCFcache(self):
+        dcf_cache.clear()
+        self.result = get_dcf_df(*DCF_ARGS)
+        cached = get_dcf_df(DCF_INPUT, '0.0', 10, '5', '32.0', 1.2, '15', '1.25', '3.50', '8.5', 3,
+                                    273430.0, 17890, 10630, 86220, 2.97, 93050, 94050, 17250, 0, 0, 0, 3, 29, 0, False, [1], '1f46bbc4-b0b5-5932-8ccf-9f4ebda9e047')
+        self.assertIs(cached[0], self.result[0])
+        self.assertEqual(cached[1], self.result[1])
+        self.assertEqual(dcf_cache.stats()['hits'], 1)
+        self.assertEqual(dcf_cache.stats()['misses'], 1)
+        inputs = get_dcf_inputs(*DCF_ARGS)
+        self.assertEqual(hash(get_dcf_input_record(inputs)), hash(get_dcf_input_record(dict(inputs, cost_of_cap=0.085+1e-15))))
+        projection_misses = dcf_projection_cache.stats()['misses']
+        dcf_record = get_dcf_input_record(inputs)._replace(cost_of_cap=0.075, cash=1e10)
+        self.result = get_dcf_result(dcf_record)
+        self.assertEqual(dcf_projection_cache.stats()['misses'], projection_misses)
+        self.assertAlmostEqual(self.result[1]['estimated_value_per_share'], get_dcf_batch(**dcf_record._asdict())[1]['estimated_value_per_share'][0])
+    def testwithDCFbatch(self):
+        inputs = get_dcf_inputs(*DCF_ARGS)
+        inputs['terminal_growth_rate'] = np.array([0.035, 0.045])
+        inputs['cost_of_cap'] = np.array([0.085, 0.085])
+        dcftable, dcf_output = get_dcf_batch(**inputs)
+        self.assertEqual(dcftable['FCF($)'].shape, (2, TERMINAL_YEAR_LENGTH+2))
+        self.assertAlmostEqual(dcf_output['estimated_value_per_share'][0], 73.00, delta=0.01)
+        self.assertAlmostEqual(dcf_output['estimated_value_per_share'][1], 84.67, delta=0.01)
+    def testwithDCFsimulation(self):
+        inputs = get_dcf_inputs(*DCF_ARGS)
+        for dist in ['normal', 'triangular', 'uniform']:
+            distributions = get_simulation_distributions(inputs, dist, 10)
+            self.result = get_dcf_simulation(inputs, distributions, 50000, seed=42)
+            self.assertEqual(self.result, get_dcf_simulation(inputs, distributions, 50000, seed=42), 'FAIL with: ' + dist)
+            self.assertAlmostEqual(self.result['percentiles'][50], 73.00, delta=3, msg='FAIL with: ' + dist)
+        # the settings saved with a snapshot are restored to rerun the same simulation
+        simulation_dict = {'seed': 42, 'n_draws': 50000, 'distribution': 'uniform', 'spread': 10, 'correlation': 0.3}
+        self.assertEqual(restore_simulation_settings({'AAPL': dict(DCF_INPUT['AAPL'], simulation_dict=simulation_dict)}, []),
+                        (50000, 'uniform', 10, 0.3, 42))
+    def testwithDCFsensitivity(self):
+        inputs = get_dcf_inputs(*DCF_ARGS)
+        self.result = get_dcf_sensitivity(inputs, 'cost_of_cap', [0.075, 0.085], 'terminal_growth_rate', [0.035, 0.045])
+        self.assertEqual(self.result.shape, (2, 2))
+        self.assertAlmostEqual(self.result[0][1], 73.00, delta=0.01)
+        self.assertAlmostEqual(self.result[1][1], 84.67, delta=0.01)
+        base_value, tornado = get_dcf_tornado(inputs)
+        self.assertAlmostEqual(base_value, 73.00, delta=0.01)
+        self.assertEqual(tornado[0][0], 'cost_of_cap')
+    def testwithDCFimplied(self):
+        inputs = get_dcf_inputs(*DCF_ARGS)
+        for key in ['cagr_2_5', 'opm_target', 'cost_of_cap']:
+            self.result = get_dcf_implied(inputs, 115, key)
+            dcf_output = get_dcf_batch(**dict(inputs, **{key: self.result}))[1]
+            self.assertAlmostEqual(dcf_output['estimated_value_per_share'][0], 115, delta=0.01, msg='FAIL with: ' + key)
+        self.assertAlmostEqual(get_dcf_implied(inputs, 73.00, 'cost_of_cap'), 0.085, delta=1e-5)
+        self.result = get_dcf_implied([inputs, inputs, inputs], [73.00, 84.67, 1e9], 'cost_of_cap')
+        self.assertTrue(np.allclose(self.result[:2], [0.0850, 0.0782], atol=1e-4))
+        self.assertTrue(np.isnan(self.result[2]))
+    def testwithDCFhorizon(self):
+        self.result = get_dcf_df(*DCF_ARGS, 10, 5, [])
         self.assertAlmostEqual(self.result[1]['estimated_value_per_share'], 73.00, delta=0.01)
-        self.result = get_dcf_df(dcf_input, '0', '10', '5', '32', '1.2', '15', '4.5', '6.5', '8.5', None, 
-                                    273430, 17890, 10630, 86220, 2.97, 93050, 94050, 17250, 0, 0, 0, 3, 29, 0, True, [1], '1f46bbc4-b0b5-5932-8ccf-9f4ebda9e047')
-        self.assertAlmostEqual(self.result[1]['estimated_value_per_share'], 84.67, delta=0.01)
\ No newline at end of file
+        dcftable, dcf_output = get_dcf_batch(**get_dcf_inputs(*DCF_ARGS, 50, 10, []))
+        self.assertEqual(dcftable['FCF($)'].shape, (1, 52))
+        self.assertEqual(len(get_dcf_summary_df(get_dcf_df(*DCF_ARGS, 50, 10, [])[0], 10)), 16)
+        # without fade years the closed-form fade is the explicit 2-stage model
+        explicit = get_dcf_batch(**get_dcf_inputs(*DCF_ARGS, 8, 8, []))[1]['estimated_value_per_share'][0]
+        closed_form = get_dcf_batch(**get_dcf_inputs(*DCF_ARGS, 8, 8, [1]))[1]['estimated_value_per_share'][0]
+        self.assertAlmostEqual(explicit, closed_form, delta=1e-6)
+        dcftable, dcf_output = get_dcf_batch(**get_dcf_inputs(*DCF_ARGS, 50, 10, [1]))
+        self.assertEqual(dcftable['FCF($)'].shape, (1, 12))
+        self.assertTrue(np.isfinite(dcf_output['estimated_value_per_share'][0]))
+        # with fade years an approximation of the explicit projection (73.00)
+        self.assertAlmostEqual(get_dcf_df(*DCF_ARGS, 10, 5, [1])[1]['estimated_value_per_share'], 68.55, delta=0.01)
+        # a snapshot shows the horizon settings of its valuation
+        self.assertEqual(restore_horizon_settings({'AAPL': {'dcf_inputs': get_dcf_inputs(*DCF_ARGS, 50, 10, [1])}}, []), (50, 10, [1]))
+    def testwithBatchValuation(self):
+        years = [2021, 2022, 2023, 2024, 2025]
+        fin_report_dict = [{'Year': y, 'Revenue($)': 200e9*1.05**i, 'Pretax Income($)': 50e9*1.05**i, 'Research & Development($)': 15e9,
+                            'Net Investing Cash Flow($)': -10e9, 'Longterm Debt($)': 90e9, 'Interest Expense($)': 3e9, 'Cash($)': 60e9,
+                            'Shares Outstanding': 16e9, 'Revenue Growth(%)': 5.0, 'EBIT Margin(%)': 25.0, 'Sales-to-Capital(%)': 1.5}
+                            for i, y in enumerate(years)]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for ticker in ['AAA', 'BBB']:
+                with open(os.path.join(tmpdir, ticker + '.json'), 'w') as report_file:
+                    json.dump({'fin_report_dict': fin_report_dict, 'stats_dict': {'lastprice': 100.0, 'beta': 1.1}}, report_file)
+            output = os.path.join(tmpdir, 'valuations.csv')
+            self.result = run_batch_valuation(['AAA', 'BBB', 'ZZZ'], output, {'reports_dir': tmpdir}, workers=1)
+            self.assertEqual(self.result, (2, 1))
+            # resumes after the checkpointed tickers, retries the failed ones in place of their error rows
+            self.assertEqual(run_batch_valuation(['AAA', 'BBB', 'ZZZ', 'CCC'], output, {'reports_dir': tmpdir}, workers=1), (0, 2))
+            self.result = pd.read_csv(output)
+            self.assertEqual(sorted(self.result['ticker']), ['AAA', 'BBB', 'CCC', 'ZZZ'])   # one row per ticker
+            self.assertEqual(self.result['last_price'].iloc[0], 100.0)
+            self.assertEqual(self.result['error'].notna().sum(), 2)
+    def testwithDCFbacktest(self):
+        fin_report_df = pd.DataFrame([{'index': y, 'Revenue($)': 200e9*1.05**i, 'Pretax Income($)': 50e9*1.05**i, 'Research & Development($)': 15e9,
+                            'Net Investing Cash Flow($)': -10e9, 'Longterm Debt($)': 90e9, 'Interest Expense($)': 3e9, 'Cash($)': 60e9,
+                            'Shares Outstanding': 16e9, 'Sales-to-Capital(%)': 1.5} for i, y in enumerate(range(2020, 2026))])
+        inputs = get_dcf_inputs(*DCF_ARGS)
+        self.result = get_dcf_backtest(fin_report_df, inputs)
+        self.assertEqual(list(self.result['Year']), [2022, 2023, 2024, 2025])
+        # the last as-of year is the valuation of the default assumptions
+        last_inputs = dict(inputs, **self.result.iloc[-1].drop(['Year', 'estimated_value_per_share']).to_dict())
+        self.assertAlmostEqual(self.result['estimated_value_per_share'].iloc[-1],
+                                get_dcf_batch(**last_inputs)[1]['estimated_value_per_share'][0], delta=1e-9)
+        self.assertAlmostEqual(self.result['cagr_2_5'].iloc[-1], 0.05, delta=1e-4)
@@ -0,0 +1,126 @@
+import os,sys,inspect,tempfile,asyncio,time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from aiohttp import web, ClientSession, ClientResponseError
+current_dir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+sys.path.insert(0, os.path.dirname(current_dir))
+from get_fin_report import get_page_text, HostRateLimiter, get_memoized_async, get_rates_fin_values, get_yahoo_fin_values, QUOTE_FALLBACK, cache
+from cache_utils import memoize_swr
+from fetch_corpus import is_replay
+from io_runtime import io_runtime
+from page_cache import PageCache
+
+class FetchUnitTest(unittest.TestCase):
+    def setUp(self):
+        self.result = None
+        pass
+    def tearDown(self):
+        pass
+    @unittest.skipIf(is_replay(), 'fetching from the corpus')
+    def testwithFetchRetry(self):
+        statuses = [503, 429, 200, 404]
+        async def handler(request):
+            return web.Response(status=statuses.pop(0), text='statement page')
+        async def fetch_twice():
+            app = web.Application()
+            app.router.add_get('/', handler)
+            runner = web.AppRunner(app)
+            await runner.setup()
+            site = web.TCPSite(runner, '127.0.0.1', 0)
+            await site.start()
+            url = 'http://127.0.0.1:{}/'.format(site._server.sockets[0].getsockname()[1])
+            try:
+                async with ClientSession() as session:
+                    limiter = HostRateLimiter(concurrency=2, rate=100)
+                    page_text = await get_page_text(session, url, limiter, backoff=0.01)
+                    with self.assertRaises(ClientResponseError):    # revalidated, not retried
+                        await get_page_text(session, url, limiter, backoff=0.01, max_age=0)
+                    return page_text
+            finally:
+                await runner.cleanup()
+        self.result = asyncio.run(fetch_twice())
+        self.assertEqual(self.result, 'statement page')
+        self.assertEqual(statuses, [])
+    def testwithIORuntime(self):
+        async def get_loop_session():
+            await asyncio.sleep(0.01)
+            return asyncio.get_running_loop(), await io_runtime.get_session()
+        with ThreadPoolExecutor(4) as executor:     # sync callers in worker threads share one loop and session
+            self.result = list(executor.map(lambda _: io_runtime.run(get_loop_session()), range(8)))
+        self.assertEqual(len(set(self.result)), 1)
+        self.assertIs(self.result[0][0], io_runtime.get_loop())
+        async def block_on_runtime():   # from a coroutine of the runtime loop
+            coro = get_loop_session()
+            try:
+                return io_runtime.run(coro)
+            finally:
+                coro.close()
+        self.assertRaises(RuntimeError, io_runtime.run, block_on_runtime())
+    def testwithFinSourceFallback(self):
+        async def get_rate_slow():
+            await asyncio.sleep(1)
+            return 4.5
+        async def get_rate():
+            return 4.5
+        cache.delete_memoized(get_rates_fin_values)
+        try:
+            self.result = io_runtime.run(get_memoized_async(get_rates_fin_values, get_rate_slow, timeout=0.01, fallback=2))
+            self.assertEqual(self.result, 2)
+            # the fallback is not cached, the value fetched in time is
+            self.result = io_runtime.run(get_memoized_async(get_rates_fin_values, get_rate, timeout=1, fallback=2))
+            self.assertEqual(self.result, 4.5)
+            self.assertEqual(io_runtime.run(get_memoized_async(get_rates_fin_values, get_rate_slow, timeout=0.01, fallback=2)), 4.5)
+            self.assertEqual(get_rates_fin_values(), 4.5)
+        finally:
+            cache.delete_memoized(get_rates_fin_values)
+    def testwithQuoteFallback(self):
+        quotes = [None, ('Oct 27, 2026', 1.2)]  # a failed quote page, then the quote values
+        def get_quote(ticker):
+            return quotes.pop(0)
+        async def fetch_quote(ticker):
+            return quotes.pop(0)
+        memoized = memoize_swr(cache, timeout=3600)(get_quote)
+        try:
+            self.result = io_runtime.run(get_memoized_async(memoized, fetch_quote, 'AAPL', timeout=1, fallback=QUOTE_FALLBACK))
+            self.assertEqual(self.result, QUOTE_FALLBACK)
+            self.assertFalse(memoized.is_cached('AAPL'))    # the fallback is not cached, the next call fetches again
+            self.result = io_runtime.run(get_memoized_async(memoized, fetch_quote, 'AAPL', timeout=1, fallback=QUOTE_FALLBACK))
+            self.assertEqual(self.result, ('Oct 27, 2026', 1.2))
+            self.assertEqual(memoized.get_cached('AAPL'), ('Oct 27, 2026', 1.2))
+        finally:
+            memoized.delete('AAPL')
+        get_yahoo_fin_values.delete('INVALID')
+        self.assertIsNone(get_yahoo_fin_values('INVALID'))
+        self.assertFalse(get_yahoo_fin_values.is_cached('INVALID'))
+    def testwithPageCache(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            page_cache = PageCache(tmpdir)
+            url = 'https://www.marketwatch.com/investing/stock/AAPL/financials'
+            self.assertIsNone(page_cache.get(url))
+            page_cache.set(url, '<html>Sales/Revenue</html>' * 100, etag='"abc"', last_modified='Sat, 17 Oct 2026 10:00:00 GMT')
+            self.result = page_cache.get(url)
+            self.assertEqual(self.result['text'], '<html>Sales/Revenue</html>' * 100)
+            self.assertEqual(page_cache.get_validators(self.result),
+                            {'If-None-Match': '"abc"', 'If-Modified-Since': 'Sat, 17 Oct 2026 10:00:00 GMT'})
+            self.assertTrue(page_cache.is_fresh(self.result))
+            self.assertFalse(page_cache.is_fresh(self.result, max_age=0))
+            page_cache.touch(url)
+            self.assertGreaterEqual(page_cache.get(url)['fetched_at'], self.result['fetched_at'])
+            self.assertLess(sum(f.stat().st_size for f in page_cache.cache_dir.iterdir()), 2600)   # compressed
+    def testwithPageCacheBounds(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            page_cache = PageCache(tmpdir)
+            urls = [f'https://www.marketwatch.com/investing/stock/T{i}/financials' for i in range(4)]
+            for i, url in enumerate(urls):
+                page_cache.set(url, os.urandom(500).hex())
+                os.utime(page_cache.get_paths(url)[0], (time.time() - 100 + i,)*2)   # fetched in order
+            _, body_paths = page_cache.get_paths(urls[3])
+            body_path = next(path for path in body_paths.values() if path.exists())
+            body_path.write_bytes(body_path.read_bytes()[:20])  # half-written body
+            self.assertIsNone(page_cache.get(urls[3]))
+            page_cache.delete(urls[3])
+            page_cache.touch(urls[3])   # deleted meanwhile, no error
+            page_cache.max_bytes = 2.5 * sum(f.stat().st_size for f in page_cache.cache_dir.iterdir()) / 3   # room for 2 pages
+            self.assertEqual(page_cache.prune(), 1)     # the least recently fetched beyond max_bytes
+            self.assertEqual([page_cache.get(url) is not None for url in urls], [False, True, True, False])
+            self.assertEqual(list(page_cache.cache_dir.glob('*.tmp')), [])
@@ -2,9 +2,19 @@ import unittest
 if __package__:
     from .dcf_unittests import DCFUnitTest
     from .sector_unittests import SectorUnitTest
+    from .report_unittests import ReportUnitTest
+    from .fetch_unittests import FetchUnitTest
+    from .cache_unittests import CacheUnitTest
+    from .symbol_unittests import SymbolUnitTest
+    from .benchmark_unittests import ParserBenchmarkTest
 else:
     from dcf_unittests import DCFUnitTest
     from sector_unittests import SectorUnitTest
+    from report_unittests import ReportUnitTest
+    from fetch_unittests import FetchUnitTest
+    from cache_unittests import CacheUnitTest
+    from symbol_unittests import SymbolUnitTest
+    from benchmark_unittests import ParserBenchmarkTest
 
 def suite():
     '''
@@ -17,6 +27,21 @@ def suite():
     suite.addTests(        
         unittest.TestLoader().loadTestsFromTestCase(SectorUnitTest)
     )
+    suite.addTests(
+        unittest.TestLoader().loadTestsFromTestCase(ReportUnitTest)
+    )
+    suite.addTests(
+        unittest.TestLoader().loadTestsFromTestCase(FetchUnitTest)
+    )
+    suite.addTests(
+        unittest.TestLoader().loadTestsFromTestCase(CacheUnitTest)
+    )
+    suite.addTests(
+        unittest.TestLoader().loadTestsFromTestCase(SymbolUnitTest)
+    )
+    suite.addTests(
+        unittest.TestLoader().loadTestsFromTestCase(ParserBenchmarkTest)
+    )
     return suite
 
 if __name__ == '__main__':
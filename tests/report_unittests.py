@@ -0,0 +1,89 @@
+import os,sys,inspect,time
+import unittest
+import numpy as np
+import pandas as pd
+current_dir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+sys.path.insert(0, os.path.dirname(current_dir))
+from get_fin_report import get_report_df, get_strings_from_numbers, get_string_from_number, get_numbers_from_strings, \
+    get_number_from_string, get_statement_page, PAGE_EXTRACTORS, StatementPage, StatementRow, get_statement_lines, get_report_frame, \
+    FINDATA_KEYS
+from dash_utils import get_display_df
+
+class ReportUnitTest(unittest.TestCase):
+    def setUp(self):
+        self.result = None
+        pass
+    def tearDown(self):
+        pass
+    def testwithNumberParsing(self):
+        values = ['1,234.50', '(2.10B)', '12.00%', '(5.00%)', '-0.25', '3.20T', '-', '--', 'N/A', None, 4.5]
+        self.result = get_numbers_from_strings(pd.Series(values, name='Revenue($)'))
+        np.testing.assert_allclose(self.result, [1234.5, -2.1e9, 0.12, -0.05, -0.25, 3.2e12] + [np.nan]*4 + [4.5])
+        self.assertEqual(self.result.name, 'Revenue($)')
+        self.assertTrue(np.isnan(get_numbers_from_strings(['e5', '.e5', 'E3', '-e2', ',', '.', '+']).astype(float)).all())
+        np.testing.assert_allclose(get_numbers_from_strings(['1e3', '.5e2', '1,000', '2.', ' (2.10B) ', '5MM', '1 2', '(%)']), [1e3, 50, 1e3, 2, -2.1e9] + [np.nan]*3)
+        self.assertIsNone(get_number_from_string('-'))
+        numbers = np.array([[1.5e12, -2.34e9], [4.5e6, -12.5]])   # formatted and parsed back, any shape
+        np.testing.assert_allclose(get_numbers_from_strings(get_strings_from_numbers(numbers.ravel()).reshape(2, 2)), numbers)
+    def testwithDisplayFormat(self):
+        values = [1234.5, -2.5e6, 3.2e9, 0.1234, -0.05, float('nan'), None]
+        self.assertEqual(list(get_strings_from_numbers(values[:-2])), [get_string_from_number(v) for v in values[:-2]])
+        self.assertEqual(list(get_strings_from_numbers(values[3:5], ratio_to_percent=True)), ['12.34%', '(5.00%)'])
+        self.assertEqual(list(get_strings_from_numbers(values[-2:])), ['-', '-'])
+    def testwithDisplayFormatSpeed(self):
+        numbers = np.random.default_rng(0).choice([-1, 1], 20000) * 10 ** np.random.default_rng(1).uniform(-3, 14, 20000)
+        numbers[:6] = [-0.0, 0.0, np.nan, np.inf, -np.inf, 1e6]
+        def get_seconds(func):  # best of 3, against the noise of a loaded machine
+            seconds = []
+            for _ in range(3):
+                start = time.perf_counter()
+                func()
+                seconds.append(time.perf_counter() - start)
+            return min(seconds)
+        for ratio_to_percent in (False, True):
+            self.result = get_strings_from_numbers(numbers, ratio_to_percent)
+            self.assertEqual(list(self.result), [get_string_from_number(n, ratio_to_percent) for n in numbers])
+            self.assertLess(get_seconds(lambda: get_strings_from_numbers(numbers, ratio_to_percent)),
+                            get_seconds(lambda: [get_string_from_number(n, ratio_to_percent) for n in numbers]))
+        self.assertEqual(list(get_strings_from_numbers([-0.0, np.nan, np.inf, -np.inf], True)), ['-0.00%', '-', 'infT', '(infT)'])
+        report_df = get_report_df([{'index': '2020', 'Revenue($)': '1.50B', 'ROCE(%)': '12.50%'}, {'index': '2021', 'Revenue($)': 2e9, 'ROCE(%)': None}])
+        self.assertEqual(report_df['Revenue($)'].tolist(), [1.5e9, 2e9])
+        self.assertEqual(get_display_df(report_df).values.tolist(), [['2020', '1.50B', '12.50%'], ['2021', '2.00B', '-']])
+    @unittest.skipUnless('lxml' in PAGE_EXTRACTORS, 'lxml not installed')
+    def testwithStatementPage(self):
+        page_text = """<html><body><bg-quote class="value" field="Last">1,175.50</bg-quote><bg-quote field="date">Oct 16, 2026</bg-quote>
+            <small class="small">Fiscal year is October-September.</small>
+            <table><thead class="table__header">
+                <tr>
+                    <th class="overflow__heading fixed--column">Item</th>
+                    <th class="overflow__heading"> 31-Mar-2026 </th>
+                    <th class="overflow__heading">30-Jun-2026</th>
+                    <th class="overflow__heading">5-qtr trend</th>
+                </tr>
+            </thead><tbody>
+                <tr><td class="overflow__cell fixed--column"><div> Sales/Revenue </div><!-- note --></td>
+                    <td class="overflow__cell">1.00B</td><td class="overflow__cell">2.00B</td>
+                    <td class="overflow__cell"><div><div data-chart-data="1000000000.0,2000000000.0"></div></div></td></tr>
+                <tr><td class="overflow__cell fixed--column"><div>Sales Growth</div></td>
+                    <td class="overflow__cell"><div class="x"><div data-chart-data=",1.0"></div></div></td></tr>
+            </tbody></table></body></html>"""
+        self.result = get_statement_page(page_text, 'lxml')
+        self.assertEqual(self.result, get_statement_page(page_text, 'bs4'))
+        self.assertEqual(self.result.rows[1].data, ['', '1.0'])
+        self.assertEqual(self.result.table_header[0].split('\n')[-4], '30-Jun-2026')
+    def testwithLineItemProfiles(self):
+        def get_page(rows, n):  # rows: label: value of each period
+            return StatementPage([StatementRow(f'\n {label} {label}', [repr(float(v))] * n) for label, v in rows.items()], [], [], [], [])
+        income = {'Net Interest Income': 50, 'Net Interest Inc After Loan Loss Prov': 40, 'Non-Interest Income': 10,
+                'Net Interest Inc After Loan Loss Prov Growth': 0.1, 'Net Income': 20, 'Net Income After Extraordinaries': 99}
+        balance_sheet = {'Cash & Due from Banks': 5, 'Total Assets': 900, 'Total Assets Growth': 0.05}
+        finsoup = dict(zip(FINDATA_KEYS, [get_page(income, 5), get_page(balance_sheet, 5), get_page({'Free Cash Flow': 7}, 5),
+                                        get_page(income, 5), get_page(balance_sheet, 5), get_page({'Free Cash Flow': 7}, 5)]))
+        self.result = get_report_frame(*get_statement_lines(finsoup))
+        self.assertEqual(list(self.result['Revenue($)']), [50]*5 + [200])   # TTM: last 4 quarters summed
+        self.assertAlmostEqual(self.result['Revenue Growth(%)'].iloc[-1], 3)
+        self.assertEqual(list(self.result['Net Income($)']), [20]*5 + [80])
+        self.assertEqual(list(self.result['Total Assets($)']), [900]*6)     # MRQ
+        self.assertEqual(list(self.result['Cash($)']), [5]*6)
+        self.assertEqual(list(self.result['Total Current Liabilities($)']), [0]*6)
+        self.assertTrue(self.result['EPS($)'].isna().all())
@@ -1,8 +1,13 @@
-import os,sys,inspect
+import os,sys,inspect,asyncio,time
 import unittest
+from aiohttp import web
 current_dir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
 sys.path.insert(0, os.path.dirname(current_dir))
-from get_fin_report import get_sector_data
+from get_fin_report import get_sector_data, get_sector_batches, get_exchange_key, get_us_exchange_keys, get_sector_coverage, \
+    set_sector_coverage
+from fetch_corpus import is_replay
+from io_runtime import io_runtime
+from sector_table import get_sector_table, get_sector_slice, get_sector_handle
 
 class SectorUnitTest(unittest.TestCase):
     def setUp(self):
@@ -13,4 +18,58 @@ class SectorUnitTest(unittest.TestCase):
     def testwithValidSector(self):
         for sector in ['Electronic Technology', 'Health Technology', 'Technology Services']:
             self.result = 'advanced-stats' in list(get_sector_data(sector).values())[0]
-            self.assertTrue(self.result, 'FAIL with: ' + sector)
\ No newline at end of file
+            self.assertTrue(self.result, 'FAIL with: ' + sector)
+    def testwithExchangeKeys(self):
+        self.assertIn(get_exchange_key('NYSE Arca'), get_us_exchange_keys())
+        self.assertEqual(get_exchange_key('nyse arca'), get_exchange_key('NYSE Arca'))
+    def testwithSectorCoverage(self):
+        self.result = {'companies': 3, 'fetched': 2, 'batches': 2, 'failed_batches': [1]}
+        set_sector_coverage('Test Sector', self.result)     # saved in redis when reachable, in this process always
+        self.assertEqual(get_sector_coverage('Test Sector'), self.result)
+    @unittest.skipIf(is_replay(), 'fetching from the corpus')
+    def testwithSectorBatches(self):
+        async def handler(request):     # 100 ms per batch, one batch missing
+            await asyncio.sleep(0.1)
+            symbols = request.query['symbols'].split(',')
+            if 'S13' in symbols:
+                return web.Response(status=404)
+            return web.json_response({s: {'advanced-stats': {'peRatio': 10}} for s in symbols})
+        async def start_server():
+            app = web.Application()
+            app.router.add_get('/batch', handler)
+            runner = web.AppRunner(app)
+            await runner.setup()
+            site = web.TCPSite(runner, '127.0.0.1', 0)
+            await site.start()
+            return runner, 'http://127.0.0.1:{}/batch'.format(site._server.sockets[0].getsockname()[1])
+        runner, url = io_runtime.run(start_server())
+        try:
+            urls = [url + '?symbols=' + ','.join(f'S{i}' for i in range(b*10, b*10+10)) for b in range(16)]
+            start = time.monotonic()
+            self.result = dict(get_sector_batches(urls, concurrency=8, rate=1000, retries=0))
+            self.assertLess(time.monotonic() - start, 1.2)     # 16 batches 8 at a time, not one after the other
+            self.assertIsInstance(self.result.pop(1), Exception)
+            self.assertEqual(sorted(self.result), [b for b in range(16) if b != 1])
+            self.assertEqual(sum(len(data) for data in self.result.values()), 150)
+        finally:
+            io_runtime.run(runner.cleanup())
+    def testwithSectorTable(self):
+        def stats(name, ev, ebitda=None):
+            return {'advanced-stats': {'companyName': name, 'marketcap': ev/2, 'enterpriseValue': ev, 'profitMargin': 0.1,
+                    'enterpriseValueToRevenue': 2, 'EBITDA': ebitda, 'priceToBook': 2, 'debtToEquity': 1, 'currentDebt': 0}}
+        self.result = get_sector_table({'Tech': {'A': stats('A Inc', 1e9, 1e8), 'B': stats('B Inc', 1e11), 'C': stats('C Inc', 1e10, 1e9)},
+                                        'Health': {'C': stats('C Inc', 1e10, 1e9), 'D': {'advanced-stats': {'companyName': 'D Inc', 'enterpriseValue': 1e9}}}})
+        self.assertEqual(list(self.result.index), ['A', 'C', 'B'])    # sorted by enterprise value, D misses the required columns
+        self.assertEqual(self.result.loc['C', 'sector'], 'Health')
+        self.assertAlmostEqual(self.result.loc['A', 'EBITDAToEV(%)'], 10)
+        self.assertAlmostEqual(self.result.loc['A', 'profitMargin'], 10)
+        self.assertAlmostEqual(self.result.loc['A', 'TotalAssets'], 5e8)
+        self.assertEqual(list(get_sector_slice(self.result, [9, 10]).index), ['A', 'C'])
+        self.assertEqual(list(get_sector_slice(self.result, [9, 12], ['B Inc', 'C Inc']).index), ['C', 'B'])
+        self.assertTrue(get_sector_slice(self.result, [12, 13]).empty)
+    def testwithSectorHandle(self):
+        self.result = get_sector_handle(['Electronic Technology', 'Health Technology'])
+        self.assertEqual(len(self.result), 16)
+        self.assertEqual(self.result, get_sector_handle(('Electronic Technology', 'Health Technology')))
+        self.assertNotEqual(self.result, get_sector_handle(['Electronic Technology']))
+        self.assertEqual(self.result, get_sector_handle(['Health Technology', 'Electronic Technology']))
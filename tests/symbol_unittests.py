@@ -0,0 +1,22 @@
+import os,sys,inspect
+import unittest
+current_dir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+sys.path.insert(0, os.path.dirname(current_dir))
+from __init__ import get_symbol_index, ticker_dict, exchange_list
+
+class SymbolUnitTest(unittest.TestCase):
+    def setUp(self):
+        self.result = None
+        pass
+    def tearDown(self):
+        pass
+    def testwithSymbolIndex(self):
+        self.assertIs(get_symbol_index(), get_symbol_index())   # built once
+        self.assertIs(ticker_dict(), get_symbol_index().labels)
+        self.assertIn('AAPL', get_symbol_index())
+        self.assertEqual(exchange_list(), sorted(set(exchange_list())))
+        self.assertEqual([m['symbol'] for m in get_symbol_index().search('aap', 2)], ['AAP', 'AAPL'])
+        self.assertEqual(get_symbol_index().search('apple')[0], {'symbol': 'AAPL', 'label': ticker_dict()['AAPL']})
+        self.assertIn('BAC', [m['symbol'] for m in get_symbol_index().search('bank of am')])
+        self.assertEqual([m['symbol'] for m in get_symbol_index().search('MSFTT')], ['MSFT'])     # typo
+        self.assertEqual(get_symbol_index().search(' '), [])